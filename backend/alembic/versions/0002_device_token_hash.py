@@ -0,0 +1,42 @@
+"""device token hash
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 06:02:11.418220
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('devices', sa.Column('device_token_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_devices_device_token_hash'), 'devices', ['device_token_hash'], unique=True)
+
+    # backfill hashes for devices paired before tokens were looked up by hash, and drop the plaintext
+    devices = sa.table('devices', sa.column('id', sa.Integer), sa.column('device_token', sa.String), sa.column('device_token_hash', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(devices.c.id, devices.c.device_token).where(devices.c.device_token.isnot(None))).all()
+    for device_id, token in rows:
+        bind.execute(
+            devices.update()
+            .where(devices.c.id == device_id)
+            .values(device_token_hash=hashlib.sha256(token.encode()).hexdigest(), device_token=None)
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_devices_device_token_hash'), table_name='devices')
+    op.drop_column('devices', 'device_token_hash')
@@ -0,0 +1,72 @@
+"""timestamp columns
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 06:21:40.902113
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, nullable after the backfill)
+TIMESTAMP_COLUMNS = [
+    ('organizations', 'created_at', False),
+    ('devices', 'registered_at', False),
+    ('devices', 'last_active_at', True),
+    ('stock_items', 'last_updated', False),
+    ('orders', 'created_at', False),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # same format as the str(datetime.utcnow()) values already in the columns
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+    # SQLite keeps DATETIME as that same ISO text, so the values can be copied as-is.
+    # Reflecting the old column as DateTime stops batch mode from wrapping the copy in
+    # CAST(... AS DATETIME), which would coerce the text to a number (the year).
+    is_sqlite = op.get_bind().dialect.name == 'sqlite'
+
+    for table, column, nullable in TIMESTAMP_COLUMNS:
+        # rows written without a timestamp get the migration time
+        if not nullable:
+            op.execute(
+                sa.text(f"UPDATE {table} SET {column} = :now WHERE {column} IS NULL OR {column} = ''").bindparams(now=now)
+            )
+        # the old values are naive UTC
+        reflect_args = [sa.Column(column, sa.DateTime(timezone=True))] if is_sqlite else ()
+        with op.batch_alter_table(table, reflect_args=reflect_args) as batch_op:
+            batch_op.alter_column(
+                column,
+                existing_type=sa.String(),
+                type_=sa.DateTime(timezone=True),
+                nullable=nullable,
+                postgresql_using=f"NULLIF({column}, '')::timestamp AT TIME ZONE 'UTC'",
+            )
+
+    op.create_index('ix_orders_location_id_created_at', 'orders', ['location_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_location_id_created_at', table_name='orders')
+
+    for table, column, nullable in reversed(TIMESTAMP_COLUMNS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                column,
+                existing_type=sa.DateTime(timezone=True),
+                type_=sa.String(),
+                nullable=True,
+                postgresql_using=f"to_char({column} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US')",
+            )
@@ -0,0 +1,43 @@
+"""access path indexes
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 05:57:04.165320
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Build concurrently on Postgres so the POS can keep writing orders during the
+    # deploy. CREATE INDEX CONCURRENTLY can't run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_devices_location_id'), 'devices', ['location_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_licenses_location_id'), 'licenses', ['location_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_locations_organization_id'), 'locations', ['organization_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_order_items_order_id'), 'order_items', ['order_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_orders_location_id_status', 'orders', ['location_id', 'status'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_organization_users_user_id_organization_id', 'organization_users', ['user_id', 'organization_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_products_Location_id'), 'products', ['Location_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_products_Location_id'), table_name='products')
+    op.drop_index('ix_organization_users_user_id_organization_id', table_name='organization_users')
+    op.drop_index('ix_orders_location_id_status', table_name='orders')
+    op.drop_index(op.f('ix_order_items_order_id'), table_name='order_items')
+    op.drop_index(op.f('ix_locations_organization_id'), table_name='locations')
+    op.drop_index(op.f('ix_licenses_location_id'), table_name='licenses')
+    op.drop_index(op.f('ix_devices_location_id'), table_name='devices')
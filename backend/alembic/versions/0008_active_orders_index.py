@@ -0,0 +1,30 @@
+"""active orders index
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 06:10:01.371978
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # see 0005, don't block order writes while the index builds
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_active_location_id', 'orders', ['location_id'], unique=False, postgresql_where=sa.text("status <> 'paid'"), sqlite_where=sa.text("status <> 'paid'"), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_active_location_id', table_name='orders', postgresql_where=sa.text("status <> 'paid'"), sqlite_where=sa.text("status <> 'paid'"))
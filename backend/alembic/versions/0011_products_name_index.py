@@ -0,0 +1,30 @@
+"""products name index
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 09:14:52.730114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, Sequence[str], None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # see 0005, don't block menu writes while the index builds
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_location_id_name', 'products', ['Location_id', 'name'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_location_id_name', table_name='products')
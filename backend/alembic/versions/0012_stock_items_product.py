@@ -0,0 +1,36 @@
+"""stock items per product
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18 10:20:03.292438
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0012'
+down_revision: Union[str, Sequence[str], None] = '0011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("UPDATE stock_items SET quantity = 0 WHERE quantity IS NULL")
+    with op.batch_alter_table('stock_items') as batch_op:
+        batch_op.alter_column('quantity', existing_type=sa.Integer(), server_default='0', nullable=False)
+    # see 0005, don't block writes while the index builds. Fails if a product
+    # already has two rows, merge those by hand first.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_stock_items_product_id', 'stock_items', ['product_id'], unique=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_stock_items_product_id', table_name='stock_items')
+    with op.batch_alter_table('stock_items') as batch_op:
+        batch_op.alter_column('quantity', existing_type=sa.Integer(), server_default=None, nullable=True)
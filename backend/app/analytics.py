@@ -0,0 +1,254 @@
+"""
+Product mix and basket analytics: top sellers, attach rates and average ticket
+per location and day part.
+
+Sold order lines in the range are pulled as a columnar extract (location,
+order, product, quantity, price, epoch seconds) straight into NumPy arrays,
+ANALYTICS_EXTRACT_BATCH_SIZE rows at a time off a server-side cursor. Every
+metric is then a vectorized group-by over integer codes (np.unique + bincount),
+and item pairs are counted sparsely: only pairs that occur in some basket are
+materialized, never a products x products matrix. The number crunching runs in
+a worker thread so the event loop keeps serving while a year is being read.
+
+Results are cached per (location, from, to) for ANALYTICS_CACHE_TTL seconds.
+"""
+import asyncio
+from datetime import date, datetime
+
+import numpy as np
+from decouple import config
+from sqlalchemy import BigInteger, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from app.cache import TTLCache
+from app.models import Order, OrderItem, Product
+from app.revenue import local_days_filter, location_zone, utc_bounds
+from app.sales_rollup import REVENUE_STATUSES
+
+
+ANALYTICS_CACHE_SIZE = config("ANALYTICS_CACHE_SIZE", default=256, cast=int)
+ANALYTICS_CACHE_TTL = config("ANALYTICS_CACHE_TTL", default=300, cast=float)
+ANALYTICS_EXTRACT_BATCH_SIZE = config("ANALYTICS_EXTRACT_BATCH_SIZE", default=50000, cast=int)
+TOP_N = 10
+
+# (name, first local hour), a day part runs until the next one starts and the last wraps past midnight
+DAY_PARTS = (("breakfast", 6), ("lunch", 11), ("afternoon", 15), ("dinner", 17), ("late", 22))
+EXTRACT_COLUMNS = ("location_id", "order_id", "product_id", "quantity", "price", "ts")
+
+analytics_cache = TTLCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ANALYTICS_CACHE_TTL)
+
+
+class epoch_seconds(FunctionElement):
+    """Seconds since the Unix epoch of a UTC timestamp, as an integer."""
+    type = BigInteger()
+    inherit_cache = True
+
+@compiles(epoch_seconds, "postgresql")
+def _compile_pg(element, compiler, **kw):
+    return f"CAST(extract(epoch FROM {compiler.process(element.clauses, **kw)}) AS BIGINT)"
+
+@compiles(epoch_seconds)
+def _compile_default(element, compiler, **kw):
+    return f"CAST(strftime('%s', {compiler.process(element.clauses, **kw)}) AS INTEGER)"
+
+
+def _day_part_of_hour() -> np.ndarray:
+    parts = np.empty(24, dtype=np.int8)
+    for index, (_name, first_hour) in enumerate(DAY_PARTS):
+        parts[first_hour:] = index
+    parts[:DAY_PARTS[0][1]] = len(DAY_PARTS) - 1
+    return parts
+
+DAY_PART_OF_HOUR = _day_part_of_hour()
+
+
+async def extract_lines(db: AsyncSession, locations: list, start: date, end: date) -> dict[str, np.ndarray]:
+    """Sold order lines of `locations` on the local days `start`..`end`, one array per EXTRACT_COLUMNS entry."""
+    result = await db.stream(
+        select(Order.location_id, Order.id, OrderItem.product_id, OrderItem.quantity, OrderItem.price, epoch_seconds(Order.created_at))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(local_days_filter(Order.location_id, Order.created_at, locations, start, end), Order.status.in_(REVENUE_STATUSES))
+        .execution_options(yield_per=ANALYTICS_EXTRACT_BATCH_SIZE)
+    )
+    batches = []
+    async for rows in result.partitions():
+        batches.append(np.array(rows, dtype=np.int64).reshape(-1, len(EXTRACT_COLUMNS)))
+    table = np.concatenate(batches) if batches else np.empty((0, len(EXTRACT_COLUMNS)), dtype=np.int64)
+    # ids, quantities and prices are 32-bit columns, only the timestamp needs 64
+    return {
+        name: table[:, index].astype(np.int64 if name == "ts" else np.int32)
+        for index, name in enumerate(EXTRACT_COLUMNS)
+    }
+
+def local_hours(location_ids: np.ndarray, ts: np.ndarray, locations: list, start: date, end: date) -> np.ndarray:
+    """Hour of day on each line's location wall clock, from a per-UTC-hour offset table of each location's zone."""
+    if not len(ts):
+        return np.zeros(0, dtype=np.int8)
+    bounds = [utc_bounds(location.timezone, start, end) for location in locations]
+    first_hour = min(int(lower.timestamp()) for lower, _upper in bounds) // 3600
+    last_hour = max(int(upper.timestamp()) for _lower, upper in bounds) // 3600
+    # one row of UTC offsets per zone (hour granularity, so a DST change in a :30 zone is off for that half hour)
+    zone_rows: dict[str, int] = {}
+    row_of = {location.id: zone_rows.setdefault(location.timezone or "UTC", len(zone_rows)) for location in locations}
+    offsets = np.array([
+        [datetime.fromtimestamp(hour * 3600, zone).utcoffset().total_seconds() for hour in range(first_hour, last_hour + 1)]
+        for zone in map(location_zone, zone_rows)
+    ], dtype=np.int64)
+    location_codes, location_index = _codes(location_ids)
+    rows = np.array([row_of[int(location_id)] for location_id in location_codes])[location_index]
+    local = ts + offsets[rows, ts // 3600 - first_hour]
+    return ((local // 3600) % 24).astype(np.int8)
+
+def _codes(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """np.unique(values, return_inverse=True), without the sort when the values span a compact range (ids usually do)."""
+    if not len(values):
+        return values, values.astype(np.int64)
+    low, high = int(values.min()), int(values.max())
+    if high - low > 8 * len(values):
+        return np.unique(values, return_inverse=True)
+    present = np.zeros(high - low + 1, dtype=bool)
+    present[values - low] = True
+    code_of = np.cumsum(present) - 1
+    return np.flatnonzero(present) + low, code_of[values - low]
+
+def _distinct(keys: np.ndarray) -> np.ndarray:
+    """Sorted distinct keys; np.unique hashes huge inputs, which is slower than sorting here."""
+    keys = np.sort(keys)
+    return keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+
+def _sums(keys: np.ndarray, *weights: np.ndarray) -> tuple:
+    """Distinct keys with the count and per-weight sums of their rows: a sparse GROUP BY."""
+    groups, inverse = _codes(keys)
+    return (groups, np.bincount(inverse, minlength=len(groups)), *(np.bincount(inverse, weights=w, minlength=len(groups)) for w in weights))
+
+def _top(groups: np.ndarray, *scores: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the n best rows of every group, best first; ties go to the later scores, then to the order given."""
+    order = np.lexsort(tuple(-score for score in reversed(scores)) + (groups,))
+    grouped = groups[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < n]
+
+def _pairs(basket_orders: np.ndarray, basket_products: np.ndarray) -> np.ndarray:
+    """(a, b) product codes with a < b for every pair in the same basket; baskets sorted by order then product, no repeats."""
+    if not len(basket_orders):
+        return np.empty((0, 2), dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, basket_orders[1:] != basket_orders[:-1]])
+    sizes = np.diff(np.r_[starts, len(basket_orders)])
+    # how many products follow each line in its basket
+    following = np.repeat(sizes, sizes) - (np.arange(len(basket_orders)) - np.repeat(starts, sizes)) - 1
+    chunks = []
+    rows, distance = np.flatnonzero(following > 0), 1
+    # pair every line with the one `distance` places on; the candidates shrink to the bigger baskets each round
+    while len(rows):
+        chunks.append(np.stack([basket_products[rows], basket_products[rows + distance]], axis=1))
+        distance += 1
+        rows = rows[following[rows] >= distance]
+    return np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+
+def basket_metrics(lines: dict[str, np.ndarray], hours: np.ndarray, top_n: int = TOP_N) -> dict[int, dict]:
+    """Per location id: totals and top sellers overall and per day part, and the most frequent pairs with attach rates."""
+    if not len(lines["order_id"]):
+        return {}
+    location_codes, location_index = _codes(lines["location_id"])
+    product_codes, product_index = _codes(lines["product_id"])
+    order_codes, order_index = _codes(lines["order_id"])
+    n_parts, n_products = len(DAY_PARTS), len(product_codes)
+    quantity = lines["quantity"].astype(np.float64)
+    amount = quantity * lines["price"]
+    part = DAY_PART_OF_HOUR[hours].astype(np.int64)
+
+    # every line of an order shares its location and time, so any of them labels the order
+    order_location = np.empty(len(order_codes), dtype=np.int64)
+    order_location[order_index] = location_index
+    order_part = np.empty(len(order_codes), dtype=np.int64)
+    order_part[order_index] = part
+    order_total = np.bincount(order_index, weights=amount)
+
+    metrics = {
+        int(location_id): {"orders": 0, "revenue": 0, "day_parts": {}, "top_sellers": [], "attach": []}
+        for location_id in location_codes
+    }
+
+    # tickets per location and day part
+    slots, tickets, revenue = _sums(order_location * n_parts + order_part, order_total)
+    for slot, count, total in zip(slots.tolist(), tickets.tolist(), revenue.tolist()):
+        location = metrics[int(location_codes[slot // n_parts])]
+        location["orders"] += count
+        location["revenue"] += round(total)
+        location["day_parts"][DAY_PARTS[slot % n_parts][0]] = {"orders": count, "revenue": round(total), "top_sellers": []}
+
+    # top sellers per location (part n_parts stands for the whole day) and per day part
+    for grouping in (location_index * (n_parts + 1) + n_parts, location_index * (n_parts + 1) + part):
+        keys, _count, units, sales = _sums(grouping * n_products + product_index, quantity, amount)
+        slot, product = keys // n_products, keys % n_products
+        for row in _top(slot, units, sales, n=top_n).tolist():
+            location = metrics[int(location_codes[slot[row] // (n_parts + 1)])]
+            part_index = slot[row] % (n_parts + 1)
+            target = location if part_index == n_parts else location["day_parts"][DAY_PARTS[part_index][0]]
+            target["top_sellers"].append({"product_id": int(product_codes[product[row]]), "quantity": round(units[row]), "revenue": round(sales[row])})
+
+    # attach rates: of the orders with product a, the share that also had b
+    baskets = _distinct(order_index.astype(np.int64) * n_products + product_index)
+    basket_orders, basket_products = baskets // n_products, baskets % n_products
+    orders_with = np.bincount(basket_products, minlength=n_products)
+    product_location = np.empty(n_products, dtype=np.int64)
+    product_location[basket_products] = order_location[basket_orders]
+    pairs = _pairs(basket_orders, basket_products)
+    pair_keys, together = _sums(pairs[:, 0] * n_products + pairs[:, 1])[:2]
+    first, second = pair_keys // n_products, pair_keys % n_products
+    # both directions, a product's location is the location of its pairs
+    anchor, other, together = np.r_[first, second], np.r_[second, first], np.r_[together, together]
+    rate = together / orders_with[anchor]
+    for row in _top(product_location[anchor], together, rate, n=top_n).tolist():
+        metrics[int(location_codes[product_location[anchor[row]]])]["attach"].append({
+            "product_id": int(product_codes[anchor[row]]),
+            "with_product_id": int(product_codes[other[row]]),
+            "orders": int(together[row]),
+            "attach_rate": round(float(rate[row]), 4),
+        })
+
+    for location in metrics.values():
+        location["average_ticket"] = round(location["revenue"] / location["orders"], 2)
+        location["day_parts"] = [
+            {"day_part": name, **part_metrics, "average_ticket": round(part_metrics["revenue"] / part_metrics["orders"], 2)}
+            for name, _first_hour in DAY_PARTS
+            if (part_metrics := location["day_parts"].get(name))
+        ]
+    return metrics
+
+def _compute(lines: dict[str, np.ndarray], locations: list, start: date, end: date) -> dict[int, dict]:
+    return basket_metrics(lines, local_hours(lines["location_id"], lines["ts"], locations, start, end))
+
+async def product_mix(db: AsyncSession, locations: list, start: date, end: date) -> list[dict]:
+    """Basket analytics for each of `locations` over the local days `start`..`end`, served from the cache where possible."""
+    results, missing = {}, []
+    for location in locations:
+        cached = analytics_cache.get((location.id, start, end))
+        if cached is None:
+            missing.append(location)
+        else:
+            results[location.id] = cached
+
+    if missing:
+        lines = await extract_lines(db, missing, start, end)
+        computed = await asyncio.to_thread(_compute, lines, missing, start, end)
+        product_ids = {
+            row[key]
+            for location in computed.values()
+            for row in [*location["top_sellers"], *location["attach"], *(s for p in location["day_parts"] for s in p["top_sellers"])]
+            for key in ("product_id", "with_product_id") if key in row
+        }
+        names = dict((await db.execute(select(Product.id, Product.name).where(Product.id.in_(product_ids)))).all()) if product_ids else {}
+        for location in missing:
+            metrics = computed.get(location.id, {"orders": 0, "revenue": 0, "average_ticket": None, "day_parts": [], "top_sellers": [], "attach": []})
+            for row in [*metrics["top_sellers"], *(s for p in metrics["day_parts"] for s in p["top_sellers"])]:
+                row["name"] = names.get(row["product_id"])
+            for row in metrics["attach"]:
+                row["name"], row["with_name"] = names.get(row["product_id"]), names.get(row["with_product_id"])
+            results[location.id] = {"location_id": location.id, "name": location.name, **metrics}
+            analytics_cache.set((location.id, start, end), results[location.id])
+
+    return [results[location.id] for location in locations]
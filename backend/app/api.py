@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -5,7 +7,7 @@ from typing import Annotated
 from sqlalchemy.orm import Session
 
 from app.auth.auth_handler import sign_jwt
-from app.auth.auth_bearer import JWTBearer
+from app.auth.device_bearer import on_device_event
 from app.schema import PostSchema, UserLoginSchema, UserSchema
 
 from .routers import users
@@ -15,11 +17,38 @@ from .routers import menu
 from .routers import orders
 from .routers import displays
 from .routers import management
+from .routers import stock
+from .routers import internal
 
+from .conditional import NotModified, not_modified_handler
 from .database import get_db
+from .events import device_events, menu_events, order_events
+from .heartbeats import device_heartbeats
+from .menu_cache import menu_cache
+from .order_board import order_board
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await order_events.start()
+    await order_board.start(order_events)
+    await menu_events.start()
+    menu_events.add_listener(menu_cache.on_menu_event)
+    await device_events.start()
+    device_events.add_listener(on_device_event)
+    await device_heartbeats.start()
+    yield
+    await device_heartbeats.stop()
+    device_events.remove_listener(on_device_event)
+    await device_events.stop()
+    menu_events.remove_listener(menu_cache.on_menu_event)
+    await menu_events.stop()
+    await order_board.stop()
+    await order_events.stop()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_exception_handler(NotModified, not_modified_handler)
 
 # CORS for frontend dev server
 origins = [
@@ -47,6 +76,8 @@ app.include_router(menu.router)
 app.include_router(orders.router)
 app.include_router(displays.router)
 app.include_router(management.router)
+app.include_router(stock.router)
+app.include_router(internal.router)
 
 def check_user(data: UserLoginSchema):
     for user in users:
@@ -1,5 +1,5 @@
 import time
-from typing import Dict
+from typing import Dict, Optional
 
 import jwt
 from decouple import config
@@ -7,21 +7,26 @@ from decouple import config
 
 JWT_SECRET = config("secret", default="my-default-jwt-secret-key-123")
 JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = config("ACCESS_TOKEN_TTL", default=600, cast=int)
 
 
-def token_response(token: str):
-    return {
-        "access_token": token
+def token_response(token: str, refresh_token: Optional[str] = None):
+    response = {
+        "access_token": token,
+        "expires_in": ACCESS_TOKEN_TTL
     }
+    if refresh_token:
+        response["refresh_token"] = refresh_token
+    return response
 
-def sign_jwt(user_id: str) -> Dict[str, str]:
+def sign_jwt(user_id: str, refresh_token: Optional[str] = None) -> Dict[str, str]:
     payload = {
         "user_id": user_id,
-        "expires": time.time() + 600
+        "expires": time.time() + ACCESS_TOKEN_TTL
     }
     token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-    return token_response(token)
+    return token_response(token, refresh_token)
 
 def decode_jwt(token: str) -> dict:
     try:
@@ -1,88 +1,71 @@
-from fastapi import Depends, Request, HTTPException
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import jwt
-from sqlalchemy.orm import Session
 import hashlib
-
-from app.auth.auth_bearer import JWTBearer
-from app.database import SessionLocal, get_db
-from app.models import Device, User
-
-
-class DeviceBearer(HTTPBearer):
-    def __init__(self, auto_error: bool = True):
-        super().__init__(auto_error=auto_error)
-
-    async def __call__(self, request: Request) -> Device:
-        print("DeviceBearer called")
-        credentials: HTTPAuthorizationCredentials = await super().__call__(request)
-        print(f"Credentials received: {credentials}")
-        if credentials.scheme != "Bearer":
-            print("Invalid authentication scheme:", credentials.scheme)
-            raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-
-        token = credentials.credentials
-        print(f"token: {token}")
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
-
-        db: Session = SessionLocal()
-        try:
-            print("Looking for device with token:", token)
-            device = db.query(Device).filter(
-                Device.device_token == token,
-                #Device.device_token_hash == token_hash,
-                Device.device_status == "paired",
-            ).first()
-
-            if not device:
-                raise HTTPException(status_code=401, detail="Invalid or revoked device token")
-
-            return device
-
-        finally:
-            db.close()
+from dataclasses import dataclass
+from typing import Optional
 
 from decouple import config
-
-
-JWT_SECRET = config("secret", default="my-default-jwt-secret-key-123")
-JWT_ALGORITHM = config("algorithm", default="HS256")
-
-async def EitherBearer(request: Request, db: Session = Depends(get_db)):
-    """
-    Try JWTBearer first, then DeviceBearer.
-    Devices must have device_type = "POS".
-    Returns {"type": "user", "data": User} or {"type": "device", "data": Device}
-    """
-    # JWT first
-    try:
-        print("Trying JWTBearer")
-        token: str = await JWTBearer()(request)
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            user_id = payload.get("user_id")  # adjust depending on your JWT payload
-            if not user_id:
-                raise HTTPException(status_code=401, detail="Invalid JWT payload")
-        except jwt.PyJWTError:
-            raise HTTPException(status_code=401, detail="Invalid token")
-
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-
-        return {"type": "user", "data": user}
-
-    except HTTPException:
-        pass
-
-    # Device
-    try:
-        print("Trying DeviceBearer")
-        device: Device = await DeviceBearer()(request)
-        if device.device_type != "POS":
-            raise HTTPException(status_code=403, detail="Device type not allowed")
-        return {"type": "device", "data": device}
-    except HTTPException:
-        pass
-
-    raise HTTPException(status_code=401, detail="Not authenticated")
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import TTLCache
+from app.events import device_events, publish_after_commit
+from app.models import Device
+
+
+# Device tokens are opaque strings handed out at pairing time, see routers/devices.py.
+# The prefix lets the auth context tell them apart from JWTs without trying to decode them.
+DEVICE_TOKEN_PREFIX = "dev_"
+
+DEVICE_CACHE_SIZE = config("DEVICE_CACHE_SIZE", default=2048, cast=int)
+DEVICE_CACHE_TTL = config("DEVICE_CACHE_TTL", default=60, cast=float)
+
+
+@dataclass(frozen=True)
+class DevicePrincipal:
+    """Detached snapshot of a paired device, safe to share between requests."""
+    id: int
+    location_id: int
+    device_name: str
+    device_type: str
+    device_status: str
+
+# token hash -> DevicePrincipal. Decommission / re-pair in routers/devices.py
+# revoke the token on device_events, which pops it in every worker.
+device_token_cache = TTLCache(maxsize=DEVICE_CACHE_SIZE, ttl=DEVICE_CACHE_TTL)
+
+def hash_device_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def get_paired_device(db: AsyncSession, token: str) -> Optional[DevicePrincipal]:
+    token_hash = hash_device_token(token)
+    principal = device_token_cache.get(token_hash)
+    if principal is not None:
+        return principal
+
+    device = await db.scalar(select(Device).where(
+        Device.device_token_hash == token_hash,
+        Device.device_status == "paired",
+    ))
+    if not device:
+        return None
+
+    principal = DevicePrincipal(
+        id=device.id,
+        location_id=device.location_id,
+        device_name=device.device_name,
+        device_type=device.device_type,
+        device_status=device.device_status,
+    )
+    device_token_cache.set(token_hash, principal)
+    return principal
+
+def revoke_device_token(db: AsyncSession, location_id: int, token_hash: Optional[str]) -> None:
+    """Drop the device's cached principal in every worker once the revocation commits."""
+    if token_hash:
+        publish_after_commit(db, location_id, {"type": "device_token_revoked", "token_hash": token_hash}, bus=device_events)
+
+def on_device_event(location_id: Optional[int], device_event: dict) -> None:
+    if device_event.get("type") == "device_token_revoked":
+        device_token_cache.pop(device_event["token_hash"])
+    elif device_event.get("type") == "resync":
+        # revocations may have been missed
+        device_token_cache.clear()
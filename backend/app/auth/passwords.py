@@ -0,0 +1,52 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from decouple import config
+from fastapi import HTTPException, status
+
+
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+# hashes running or waiting for a worker before new ones are turned away
+PASSWORD_HASH_MAX_PENDING = config("PASSWORD_HASH_MAX_PENDING", default=32, cast=int)
+
+# bcrypt releases the GIL while hashing, so a thread pool keeps the event loop
+# free without the pickling overhead of a process pool.
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+async def _run_in_pool(fn, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent logins, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        return await asyncio.wrap_future(_executor.submit(fn, *args))
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+async def hash_password(password: str) -> bytes:
+    return await _run_in_pool(_hash, password.encode('utf-8'), BCRYPT_ROUNDS)
+
+async def verify_password(password: str, hashed: bytes) -> bool:
+    return await _run_in_pool(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+def needs_rehash(hashed: bytes) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split(b"$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
@@ -0,0 +1,63 @@
+import hashlib
+import secrets
+import time
+from typing import Optional
+
+from decouple import config
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import RefreshToken
+
+
+REFRESH_TOKEN_TTL = config("REFRESH_TOKEN_TTL", default=30 * 24 * 3600, cast=int)
+
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_refresh_token(db: AsyncSession, user_id: int, family_id: Optional[str] = None) -> str:
+    """Add a new refresh token to the session (caller commits) and return its plaintext."""
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=int(time.time()) + REFRESH_TOKEN_TTL,
+    ))
+    return token
+
+async def revoke_token_family(db: AsyncSession, family_id: str) -> None:
+    await db.execute(
+        update(RefreshToken).where(RefreshToken.family_id == family_id).values(revoked=True)
+    )
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> tuple[int, str]:
+    """
+    Exchange a refresh token for a new one in the same family and return (user_id, new_token).
+    Presenting a token that was already rotated means it leaked, so the whole family is revoked.
+    """
+    invalid = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+    stored = await db.scalar(select(RefreshToken).where(RefreshToken.token_hash == hash_refresh_token(token)))
+    if not stored or stored.revoked:
+        raise invalid
+    now = int(time.time())
+    if stored.expires_at < now:
+        raise invalid
+
+    # conditional update so two concurrent refreshes with the same token can't both win
+    claimed = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == stored.id, RefreshToken.used_at.is_(None))
+        .values(used_at=now)
+    )
+    if not claimed.rowcount:
+        await revoke_token_family(db, stored.family_id)
+        await db.commit()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token reuse detected")
+
+    new_token = issue_refresh_token(db, stored.user_id, stored.family_id)
+    await db.commit()
+    return stored.user_id, new_token
@@ -0,0 +1,91 @@
+"""
+Maintenance commands, run from backend/:
+
+    python -m app.cli check-order-totals [--fix] [--limit 100]
+    python -m app.cli backfill-order-totals
+    python -m app.cli purge-idempotency-keys
+    python -m app.cli rebuild-sales-rollup [--location-id 1 --location-id 2]
+"""
+import argparse
+import asyncio
+import sys
+
+from app.database import AsyncSessionLocal, async_engine
+from app.idempotency import purge_expired_keys
+from app.order_totals import find_total_drift, recompute_order_totals
+from app.sales_rollup import rebuild_sales_rollup
+
+
+async def check_order_totals(fix: bool, limit: int) -> int:
+    async with AsyncSessionLocal() as db:
+        drift = await find_total_drift(db, limit=limit)
+        for row in drift:
+            print(
+                f"order {row.id}: stored subtotal={row.subtotal} total_amount={row.total_amount} "
+                f"item_count={row.item_count}, expected subtotal={row.expected_subtotal} "
+                f"item_count={row.expected_item_count}"
+            )
+        if not drift:
+            print("order totals are consistent")
+            return 0
+        if not fix:
+            print(f"{len(drift)} order(s) out of step, rerun with --fix to repair them")
+            return 1
+        fixed = await recompute_order_totals(db, [row.id for row in drift])
+        await db.commit()
+        print(f"fixed {fixed} order(s)")
+        return 0
+
+async def backfill_order_totals() -> int:
+    async with AsyncSessionLocal() as db:
+        updated = await recompute_order_totals(db)
+        await db.commit()
+    print(f"recomputed totals for {updated} order(s)")
+    return 0
+
+async def purge_idempotency_keys() -> int:
+    async with AsyncSessionLocal() as db:
+        purged = await purge_expired_keys(db)
+    print(f"purged {purged} expired idempotency key(s)")
+    return 0
+
+async def rebuild_rollup(location_ids: list[int]) -> int:
+    async with AsyncSessionLocal() as db:
+        written = await rebuild_sales_rollup(db, location_ids)
+        await db.commit()
+    scope = f"location(s) {', '.join(map(str, location_ids))}" if location_ids else "all locations"
+    print(f"rebuilt sales rollup for {scope}: {written} bucket(s)")
+    return 0
+
+
+async def run(args) -> int:
+    try:
+        if args.command == "check-order-totals":
+            return await check_order_totals(args.fix, args.limit)
+        if args.command == "backfill-order-totals":
+            return await backfill_order_totals()
+        if args.command == "purge-idempotency-keys":
+            return await purge_idempotency_keys()
+        if args.command == "rebuild-sales-rollup":
+            return await rebuild_rollup(args.location_id)
+    finally:
+        await async_engine.dispose()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Restaurant POS maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check = commands.add_parser("check-order-totals", help="compare stored order totals with their items")
+    check.add_argument("--fix", action="store_true", help="recompute the orders that are out of step")
+    check.add_argument("--limit", type=int, default=1000, help="report at most this many orders")
+    commands.add_parser("backfill-order-totals", help="recompute the totals of every order")
+    commands.add_parser("purge-idempotency-keys", help="delete expired Idempotency-Key records")
+    rebuild = commands.add_parser("rebuild-sales-rollup", help="recompute the hourly sales rollup from the orders")
+    rebuild.add_argument("--location-id", type=int, action="append", default=[], help="only this location, repeatable")
+
+    return asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
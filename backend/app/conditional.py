@@ -0,0 +1,47 @@
+"""
+Conditional GETs for reads that rarely change.
+
+A route opts in with `dependencies=[Depends(conditional(some_etag))]`, where
+`some_etag` is a dependency returning the resource's current ETag, or None when
+the request isn't cacheable. If the request's If-None-Match already holds that
+tag, NotModified ends it with a 304 before the route body runs its queries.
+Otherwise the tag and Cache-Control go out on the normal response.
+"""
+from typing import Callable, Optional
+
+from fastapi import Depends, Request, Response
+
+
+# POS clients may keep the body but must revalidate before every use
+POS_CACHE_CONTROL = "private, no-cache"
+
+
+class NotModified(Exception):
+    def __init__(self, headers: dict):
+        self.headers = headers
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the parts that identify one version of a representation."""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match compares weakly, W/"x" matches "x"
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def conditional(etag_dependency: Callable, cache_control: str = POS_CACHE_CONTROL) -> Callable:
+    async def check_etag(request: Request, response: Response, etag: Optional[str] = Depends(etag_dependency)) -> None:
+        if etag is None:
+            return
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise NotModified(headers)
+        response.headers.update(headers)
+    return check_etag
+
+async def not_modified_handler(request: Request, exc: NotModified) -> Response:
+    return Response(status_code=304, headers=exc.headers)
@@ -1,35 +1,69 @@
+from decouple import Csv, config
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-import jwt
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.auth.auth_handler import decode_jwt
+from app.auth.device_bearer import DEVICE_TOKEN_PREFIX, DevicePrincipal, get_paired_device
 from app.database import get_db
+from app.heartbeats import device_heartbeats
 from app.models import User
-from decouple import config
-
-
-JWT_SECRET = config("secret")
-JWT_ALGORITHM = config("algorithm")
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login")
-
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id: int = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401)
-    except jwt.PyJWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-        )
-
-    user = db.query(User).filter(User.id == user_id).first()
+
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# users who run the deployment (not organization owners), e.g. for /internal
+OPERATOR_EMAILS = config("OPERATOR_EMAILS", default="", cast=Csv())
+
+async def get_auth_context(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_db),
+) -> dict:
+    """
+    Resolve the caller of the current request exactly once.
+
+    Device tokens are opaque and start with DEVICE_TOKEN_PREFIX, everything else
+    is treated as a user JWT, so each request does either one JWT decode or one
+    device lookup, never both. FastAPI caches the result per request, so routes can
+    depend on this (or get_current_user / get_current_device) as often as they like.
+    Returns {"type": "user", "data": User} or {"type": "device", "data": DevicePrincipal}
+    """
+    if credentials is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
+    if credentials.scheme != "Bearer":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid authentication scheme.")
+
+    token = credentials.credentials
+    if token.startswith(DEVICE_TOKEN_PREFIX):
+        device = await get_paired_device(db, token)
+        if not device:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or revoked device token")
+        # in memory only, written behind in batches (see app.heartbeats)
+        device_heartbeats.record(device.id)
+        return {"type": "device", "data": device}
+
+    payload = decode_jwt(token)
+    user_id = payload.get("user_id") if payload else None
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token or expired token.")
+
+    user = await db.get(User, user_id)
     if not user:
-        raise HTTPException(status_code=401)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    return {"type": "user", "data": user}
+
+async def get_current_user(auth: dict = Depends(get_auth_context)) -> User:
+    if auth["type"] != "user":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User authentication required")
+    return auth["data"]
+
+async def get_current_device(auth: dict = Depends(get_auth_context)) -> DevicePrincipal:
+    if auth["type"] != "device":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Device authentication required")
+    return auth["data"]
 
-    return user
\ No newline at end of file
+async def get_operator(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.email not in OPERATOR_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operator access required")
+    return current_user
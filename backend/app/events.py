@@ -0,0 +1,364 @@
+"""
+Order event bus.
+
+Write paths queue events on their session with publish_after_commit(). When the
+transaction commits they go to the bus backend, which fans them out to every
+worker, and each worker hands them to its local subscribers (display streams,
+caches, ...) for the order's location. Menu changes and device token
+revocations travel the same way on buses of their own, menu_events and
+device_events.
+
+Subscribers get a bounded queue. When a slow consumer falls behind, events an
+order has since superseded are coalesced away first; if the queue is still full
+everything pending is dropped and the subscriber is told to resync from the DB.
+
+PostgresBackend reconnects with backoff when either of its connections drops
+(or stops answering the health check). Whatever was notified meanwhile is lost,
+so on reconnect every subscriber and listener gets RESYNC with location_id None,
+meaning all locations.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENT_BACKEND = config("ORDER_EVENT_BACKEND", default="memory")
+ORDER_EVENT_QUEUE_SIZE = config("ORDER_EVENT_QUEUE_SIZE", default=256, cast=int)
+ORDER_EVENT_CHANNEL = "order_events"
+MENU_EVENT_CHANNEL = "menu_events"
+DEVICE_EVENT_CHANNEL = "device_events"
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+ORDER_EVENT_HEALTHCHECK_SECONDS = config("ORDER_EVENT_HEALTHCHECK_SECONDS", default=10, cast=float)
+ORDER_EVENT_RECONNECT_MIN_SECONDS = config("ORDER_EVENT_RECONNECT_MIN_SECONDS", default=0.5, cast=float)
+ORDER_EVENT_RECONNECT_MAX_SECONDS = config("ORDER_EVENT_RECONNECT_MAX_SECONDS", default=30, cast=float)
+
+# yielded by Subscription.get() when events were dropped, reload state from the DB
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    """Bounded queue of events for one consumer."""
+
+    def __init__(self, location_id: int, maxsize: int):
+        self.location_id = location_id
+        self.maxsize = maxsize
+        self._events: deque = deque()
+        self._ready = asyncio.Event()
+        self._resync = False
+        self.coalesced = 0
+        self.dropped = 0
+
+    def push(self, order_event: dict) -> None:
+        if order_event.get("type") == "resync":
+            self._drop_pending()
+        else:
+            if len(self._events) >= self.maxsize:
+                self._coalesce(order_event)
+            if len(self._events) >= self.maxsize:
+                # the reload on resync covers this event as well
+                self.dropped += 1
+                self._drop_pending()
+            else:
+                self._events.append(order_event)
+        self._ready.set()
+
+    def _coalesce(self, order_event: dict) -> None:
+        # a full order snapshot supersedes everything still queued for that order
+        order = order_event.get("order")
+        if order is None:
+            return
+        kept = deque(e for e in self._events if _order_id(e) != order["id"])
+        self.coalesced += len(self._events) - len(kept)
+        self._events = kept
+
+    def _drop_pending(self) -> None:
+        self.dropped += len(self._events)
+        self._events.clear()
+        self._resync = True
+
+    async def get(self) -> dict:
+        while not self._events and not self._resync:
+            self._ready.clear()
+            await self._ready.wait()
+        if self._resync:
+            self._resync = False
+            return RESYNC
+        return self._events.popleft()
+
+    def get_nowait(self) -> Optional[dict]:
+        if self._resync:
+            self._resync = False
+            return RESYNC
+        return self._events.popleft() if self._events else None
+
+
+def _order_id(order_event: dict) -> Optional[int]:
+    if "order" in order_event:
+        return order_event["order"]["id"]
+    return order_event.get("order_id")
+
+
+class MemoryBroker:
+    """In-process stand-in for a shared channel, buses attached to one broker see each other's events."""
+
+    def __init__(self):
+        self.receivers: list[Callable[[int, dict], None]] = []
+
+
+class MemoryBackend:
+    def __init__(self, broker: Optional[MemoryBroker] = None):
+        self.broker = broker or MemoryBroker()
+
+    async def start(self, deliver: Callable[[int, dict], None]) -> None:
+        self._deliver = deliver
+        self.broker.receivers.append(deliver)
+
+    async def stop(self) -> None:
+        self.broker.receivers.remove(self._deliver)
+
+    def send(self, location_id: int, order_event: dict) -> None:
+        for deliver in list(self.broker.receivers):
+            deliver(location_id, order_event)
+
+
+class PostgresBackend:
+    """Fans events out across workers and pods with LISTEN/NOTIFY on one channel."""
+
+    def __init__(
+        self,
+        dsn: str,
+        channel: str = ORDER_EVENT_CHANNEL,
+        healthcheck_seconds: float = ORDER_EVENT_HEALTHCHECK_SECONDS,
+        reconnect_min_seconds: float = ORDER_EVENT_RECONNECT_MIN_SECONDS,
+        reconnect_max_seconds: float = ORDER_EVENT_RECONNECT_MAX_SECONDS,
+    ):
+        self.dsn = dsn
+        self.channel = channel
+        self.healthcheck_seconds = healthcheck_seconds
+        self.reconnect_min_seconds = reconnect_min_seconds
+        self.reconnect_max_seconds = reconnect_max_seconds
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._listener = None
+        self._sender = None
+        self.reconnects = 0
+
+    async def start(self, deliver: Callable[[Optional[int], dict], None]) -> None:
+        self._deliver = deliver
+        self._connected = asyncio.Event()
+        self._lost = asyncio.Event()
+        await self._connect()
+        self._supervisor_task = asyncio.create_task(self._supervise())
+        self._sender_task = asyncio.create_task(self._send_loop())
+
+    async def stop(self) -> None:
+        for task in (self._supervisor_task, self._sender_task):
+            task.cancel()
+        await asyncio.gather(self._supervisor_task, self._sender_task, return_exceptions=True)
+        await self._close()
+
+    def send(self, location_id: int, order_event: dict) -> None:
+        payload = json.dumps({"location_id": location_id, "event": order_event}, separators=(",", ":"))
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            # too big to notify, tell that location's subscribers to reload instead
+            payload = json.dumps({"location_id": location_id, "event": RESYNC})
+        self._outbox.put_nowait(payload)
+
+    async def _connect(self) -> None:
+        import asyncpg
+
+        listener = await asyncpg.connect(self.dsn)
+        try:
+            listener.add_termination_listener(self._on_lost)
+            await listener.add_listener(self.channel, self._on_notify)
+            sender = await asyncpg.connect(self.dsn)
+        except BaseException:
+            listener.remove_termination_listener(self._on_lost)
+            await listener.close()
+            raise
+        sender.add_termination_listener(self._on_lost)
+        self._listener, self._sender = listener, sender
+        self._lost.clear()
+        self._connected.set()
+
+    async def _close(self) -> None:
+        connections, self._listener, self._sender = (self._listener, self._sender), None, None
+        for connection in connections:
+            if connection is None:
+                continue
+            # closing on purpose isn't a lost connection
+            connection.remove_termination_listener(self._on_lost)
+            try:
+                await asyncio.wait_for(connection.close(), self.healthcheck_seconds)
+            except Exception:
+                connection.terminate()
+
+    def _on_lost(self, connection) -> None:
+        self._connected.clear()
+        self._lost.set()
+
+    async def _supervise(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.healthcheck_seconds)
+            except asyncio.TimeoutError:
+                # a dead peer doesn't always close the socket, ask it something now and then
+                try:
+                    await asyncio.wait_for(self._listener.execute("SELECT 1"), self.healthcheck_seconds)
+                    continue
+                except Exception as exc:
+                    logger.warning("order event connection failed its health check: %r", exc)
+                    self._on_lost(self._listener)
+            await self._reconnect()
+
+    async def _reconnect(self) -> None:
+        await self._close()
+        delay = self.reconnect_min_seconds
+        while True:
+            try:
+                await self._connect()
+                break
+            except Exception as exc:
+                logger.warning("order event reconnect failed (%r), retrying in %.1f s", exc, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.reconnect_max_seconds)
+        self.reconnects += 1
+        logger.warning("order event connections re-established, resyncing every location")
+        # notifications sent while we weren't listening are gone
+        self._deliver(None, RESYNC)
+
+    async def _send_loop(self) -> None:
+        # one sender keeps notifications in commit order
+        payload = None
+        while True:
+            if payload is None:
+                payload = await self._outbox.get()
+            await self._connected.wait()
+            sender = self._sender
+            try:
+                await asyncio.wait_for(sender.execute("SELECT pg_notify($1, $2)", self.channel, payload), self.healthcheck_seconds)
+            except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError) or sender.is_closed():
+                    # goes out on the new connection once the supervisor has reconnected
+                    self._on_lost(sender)
+                    continue
+                logger.exception("failed to publish order event")
+            payload = None
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        message = json.loads(payload)
+        self._deliver(message["location_id"], message["event"])
+
+
+class OrderEventBus:
+    def __init__(self, backend=None, queue_size: int = ORDER_EVENT_QUEUE_SIZE):
+        self.backend = backend or MemoryBackend()
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscription]] = defaultdict(set)
+        # called synchronously with every event for every location, for in-memory state
+        self._listeners: list[Callable[[Optional[int], dict], None]] = []
+        self.published = 0
+        self.delivered = 0
+        self._coalesced = 0
+        self._dropped = 0
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver)
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    @contextmanager
+    def subscribe(self, location_id: int):
+        subscription = Subscription(location_id, self.queue_size)
+        self._subscribers[location_id].add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._coalesced += subscription.coalesced
+            self._dropped += subscription.dropped
+            subscribers = self._subscribers[location_id]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[location_id]
+
+    def add_listener(self, listener: Callable[[Optional[int], dict], None]) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Optional[int], dict], None]) -> None:
+        self._listeners.remove(listener)
+
+    def publish(self, location_id: int, order_event: dict) -> None:
+        self.published += 1
+        self.backend.send(location_id, order_event)
+
+    def _deliver(self, location_id: Optional[int], order_event: dict) -> None:
+        """Hand an event to listeners and subscribers, location_id None (with RESYNC) means every location."""
+        for listener in self._listeners:
+            try:
+                listener(location_id, order_event)
+            except Exception:
+                logger.exception("order event listener failed")
+        if location_id is None:
+            subscriptions = [s for subscriptions in self._subscribers.values() for s in subscriptions]
+        else:
+            subscriptions = self._subscribers.get(location_id, ())
+        for subscription in subscriptions:
+            subscription.push(order_event)
+            self.delivered += 1
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def stats(self) -> dict:
+        live = [s for subscriptions in self._subscribers.values() for s in subscriptions]
+        return {
+            "backend": type(self.backend).__name__,
+            "reconnects": getattr(self.backend, "reconnects", 0),
+            "subscribers": len(live),
+            "locations": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "coalesced": self._coalesced + sum(s.coalesced for s in live),
+            "dropped": self._dropped + sum(s.dropped for s in live),
+        }
+
+
+def build_backend(name: str = ORDER_EVENT_BACKEND, channel: str = ORDER_EVENT_CHANNEL):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "postgres":
+        from app.database import ASYNC_DATABASE_URL
+
+        # asyncpg takes a plain postgresql:// DSN
+        return PostgresBackend(ASYNC_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1), channel)
+    raise ValueError(f"Unknown ORDER_EVENT_BACKEND {name!r}, expected 'memory' or 'postgres'")
+
+
+order_events = OrderEventBus(build_backend())
+menu_events = OrderEventBus(build_backend(channel=MENU_EVENT_CHANNEL))
+device_events = OrderEventBus(build_backend(channel=DEVICE_EVENT_CHANNEL))
+
+
+def publish_after_commit(db: AsyncSession, location_id: int, order_event: dict, bus: Optional[OrderEventBus] = None) -> None:
+    """Queue an event on the session, it goes out on `bus` (order_events by default) only if the transaction commits."""
+    db.sync_session.info.setdefault("order_events", []).append((bus or order_events, location_id, order_event))
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session):
+    for bus, location_id, order_event in session.info.pop("order_events", ()):
+        bus.publish(location_id, order_event)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop("order_events", None)
@@ -0,0 +1,128 @@
+"""
+Write-behind device activity for Device.last_active_at.
+
+Every authenticated device request (and POST /devices/heartbeat) only records
+the time in memory. A background task writes what was recorded every
+DEVICE_HEARTBEAT_FLUSH_SECONDS in one UPDATE per DEVICE_HEARTBEAT_BATCH_SIZE
+devices, however many requests they made in between. A device counts as online
+while its last activity is within DEVICE_ONLINE_SECONDS. Other workers see a
+device's activity once it is flushed, which is well inside that window.
+Display streams authenticate once, so they record activity themselves every
+DEVICE_STREAM_HEARTBEAT_SECONDS while they stay open.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from decouple import config
+from sqlalchemy import case, or_, update
+
+from app import database
+from app.models import Device, utcnow
+
+
+logger = logging.getLogger(__name__)
+
+DEVICE_HEARTBEAT_FLUSH_SECONDS = config("DEVICE_HEARTBEAT_FLUSH_SECONDS", default=5, cast=float)
+DEVICE_HEARTBEAT_BATCH_SIZE = 1000
+DEVICE_ONLINE_SECONDS = config("DEVICE_ONLINE_SECONDS", default=90, cast=float)
+DEVICE_STREAM_HEARTBEAT_SECONDS = config("DEVICE_STREAM_HEARTBEAT_SECONDS", default=DEVICE_ONLINE_SECONDS / 3, cast=float)
+
+
+def _aware(moment: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands timestamps back naive, they are UTC
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+class DeviceHeartbeats:
+    def __init__(self):
+        # device_id -> latest activity not written yet
+        self._pending: dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+
+    def record(self, device_id: int) -> None:
+        self._pending[device_id] = utcnow()
+        self.recorded += 1
+
+    def last_active_at(self, device_id: int, stored: Optional[datetime]) -> Optional[datetime]:
+        """The later of the stored last_active_at and activity this worker hasn't written yet."""
+        stored, pending = _aware(stored), self._pending.get(device_id)
+        if pending is None or (stored is not None and stored >= pending):
+            return stored
+        return pending
+
+    def status(self, device_status: str, last_active_at: Optional[datetime]) -> str:
+        if device_status != "paired" or last_active_at is None:
+            return "offline"
+        online = _aware(last_active_at) >= utcnow() - timedelta(seconds=DEVICE_ONLINE_SECONDS)
+        return "online" if online else "offline"
+
+    async def flush(self) -> int:
+        """Write the pending activity and return how many devices it covered."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        device_ids = sorted(pending)
+        try:
+            async with database.AsyncSessionLocal() as db:
+                for i in range(0, len(device_ids), DEVICE_HEARTBEAT_BATCH_SIZE):
+                    batch = device_ids[i:i + DEVICE_HEARTBEAT_BATCH_SIZE]
+                    seen = case({device_id: pending[device_id] for device_id in batch}, value=Device.id)
+                    # never moves backwards past a later time another worker wrote
+                    await db.execute(
+                        update(Device)
+                        .where(Device.id.in_(batch), or_(Device.last_active_at.is_(None), Device.last_active_at < seen))
+                        .values(last_active_at=seen)
+                        .execution_options(synchronize_session=False)
+                    )
+                await db.commit()
+        except Exception:
+            # put it back for the next flush, keeping anything newer recorded meanwhile
+            for device_id, moment in pending.items():
+                if self._pending.get(device_id, moment) <= moment:
+                    self._pending[device_id] = moment
+            self.failures += 1
+            raise
+        self.flushes += 1
+        self.written += len(pending)
+        return len(pending)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("final device heartbeat flush failed")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(DEVICE_HEARTBEAT_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("device heartbeat flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+        }
+
+
+device_heartbeats = DeviceHeartbeats()
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from decouple import config
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import TTLCache
+from app.models import IdempotencyKey
+
+
+IDEMPOTENCY_KEY_TTL = config("IDEMPOTENCY_KEY_TTL", default=24 * 3600, cast=int)
+IDEMPOTENCY_CACHE_SIZE = config("IDEMPOTENCY_CACHE_SIZE", default=4096, cast=int)
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# (scope, key) -> (request_hash, status_code, response_body), completed requests only.
+# Entries never change once written so the LRU only has to respect the key TTL.
+idempotency_cache = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_KEY_TTL)
+
+# one lock per key being processed in this worker, so concurrent retries wait
+# for the first attempt and then replay it instead of racing it
+_inflight: dict = {}
+
+
+def idempotency_scope(auth: dict) -> str:
+    return f"{auth['type']}:{auth['data'].id}"
+
+def request_fingerprint(method: str, path: str, body) -> str:
+    payload = json.dumps(jsonable_encoder(body), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{method} {path}\n{payload}".encode()).hexdigest()
+
+@asynccontextmanager
+async def _key_lock(cache_key):
+    entry = _inflight.get(cache_key)
+    if entry is None:
+        entry = _inflight[cache_key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _inflight[cache_key]
+
+def _replay(stored, request_hash: str) -> JSONResponse:
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return JSONResponse(content=json.loads(body), status_code=status_code, headers={REPLAYED_HEADER: "true"})
+
+async def _load(db: AsyncSession, scope: str, key: str):
+    row = await db.scalar(select(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key))
+    if row is None:
+        return None
+    if row.expires_at < int(time.time()):
+        # free the key for reuse, it is rewritten in the same transaction as the new response
+        await db.delete(row)
+        await db.flush()
+        return None
+    return row.request_hash, row.status_code, row.response_body
+
+
+async def run_idempotent(
+    db: AsyncSession,
+    scope: str,
+    key: Optional[str],
+    request_hash: str,
+    handler: Callable[[], Awaitable[dict]],
+    status_code: int = 200,
+):
+    """
+    Run `handler` at most once per (scope, key) and replay its response afterwards.
+
+    The handler adds its writes to `db` without committing. The key row is added to
+    the same transaction and committed with them, so a stored response always
+    matches data that exists. Without a key the handler just runs and commits.
+    """
+    if not key:
+        result = await handler()
+        await db.commit()
+        return result
+
+    cache_key = (scope, key)
+    async with _key_lock(cache_key):
+        stored = idempotency_cache.get(cache_key) or await _load(db, scope, key)
+        if stored:
+            idempotency_cache.set(cache_key, stored)
+            return _replay(stored, request_hash)
+
+        result = await handler()
+        body = json.dumps(jsonable_encoder(result))
+        db.add(IdempotencyKey(
+            scope=scope,
+            key=key,
+            request_hash=request_hash,
+            status_code=status_code,
+            response_body=body,
+            expires_at=int(time.time()) + IDEMPOTENCY_KEY_TTL,
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # another worker committed the same key first, drop our writes and replay theirs
+            await db.rollback()
+            stored = await _load(db, scope, key)
+            if not stored:
+                raise
+            idempotency_cache.set(cache_key, stored)
+            return _replay(stored, request_hash)
+
+        idempotency_cache.set(cache_key, (request_hash, status_code, body))
+        return result
+
+
+async def purge_expired_keys(db: AsyncSession) -> int:
+    result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < int(time.time())))
+    await db.commit()
+    return result.rowcount
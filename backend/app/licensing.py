@@ -0,0 +1,241 @@
+"""
+License lookups in front of keystone.LicenseValidator.
+
+Answers are cached per license key: valid ones are fresh for LICENSE_CACHE_TTL
+seconds, unknown keys are remembered for LICENSE_NEGATIVE_TTL. After that an
+entry for a known key is served stale while one background call revalidates
+it, for up to LICENSE_STALE_SECONDS. Calls to the validator run off the event loop and give
+up after LICENSE_TIMEOUT_SECONDS. LICENSE_BREAKER_FAILURES failed calls in a
+row open a circuit breaker: for LICENSE_BREAKER_RESET_SECONDS nobody waits on
+the validator, stale entries keep being served and keys without one raise
+LicenseUnavailable. Then a single trial call decides whether it closes again.
+"""
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from decouple import config
+from keystone import LicenseValidationError, LicenseValidator
+
+
+logger = logging.getLogger(__name__)
+
+LICENSE_CACHE_SIZE = config("LICENSE_CACHE_SIZE", default=1024, cast=int)
+LICENSE_CACHE_TTL = config("LICENSE_CACHE_TTL", default=300, cast=float)
+LICENSE_NEGATIVE_TTL = config("LICENSE_NEGATIVE_TTL", default=60, cast=float)
+LICENSE_STALE_SECONDS = config("LICENSE_STALE_SECONDS", default=86400, cast=float)
+LICENSE_TIMEOUT_SECONDS = config("LICENSE_TIMEOUT_SECONDS", default=3, cast=float)
+LICENSE_BREAKER_FAILURES = config("LICENSE_BREAKER_FAILURES", default=5, cast=int)
+LICENSE_BREAKER_RESET_SECONDS = config("LICENSE_BREAKER_RESET_SECONDS", default=30, cast=float)
+
+# Device.device_type -> the license feature that allows it
+DEVICE_FEATURES = {
+    "POS": "pos_terminal",
+    "KitchenDisplay": "kitchen_display",
+    "CustomerDisplay": "customer_screen",
+}
+
+
+class LicenseUnavailable(Exception):
+    """The validator can't be reached and there is no cached answer for the key."""
+
+
+@dataclass(frozen=True)
+class LicenseInfo:
+    """Detached copy of what the validator said about a key, safe to share between requests."""
+    is_valid: bool
+    is_expired: bool
+    features: dict = field(default_factory=dict)
+
+    @property
+    def usable(self) -> bool:
+        return self.is_valid and not self.is_expired
+
+    def allows(self, feature: str) -> bool:
+        return bool(self.features.get(feature, False))
+
+    @classmethod
+    def from_validator(cls, info) -> "LicenseInfo":
+        return cls(
+            is_valid=bool(getattr(info, "is_valid", False)),
+            is_expired=bool(getattr(info, "is_expired", False)),
+            features=dict(getattr(info, "features", None) or {}),
+        )
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, reset_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. Half open lets a single trial call through."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self._consecutive += 1
+        # a failed trial opens it again; calls already out when it opened don't extend it
+        if self._trial or (self._opened_at is None and self._consecutive >= self.failures):
+            self._opened_at = self._clock()
+            self.opened += 1
+        self._trial = False
+
+
+class LicenseService:
+    def __init__(
+        self,
+        validator=None,
+        maxsize: int = LICENSE_CACHE_SIZE,
+        ttl: float = LICENSE_CACHE_TTL,
+        negative_ttl: float = LICENSE_NEGATIVE_TTL,
+        stale_seconds: float = LICENSE_STALE_SECONDS,
+        timeout: float = LICENSE_TIMEOUT_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        # built on first use, so importing this module doesn't reach out to Keystone
+        self.validator = validator
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_seconds = stale_seconds
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(LICENSE_BREAKER_FAILURES, LICENSE_BREAKER_RESET_SECONDS, clock)
+        self._clock = clock
+        # license key -> (fetched at, LicenseInfo or None for an unknown key)
+        self._entries: "OrderedDict[str, tuple[float, Optional[LicenseInfo]]]" = OrderedDict()
+        # one validator call per key at a time, everyone else awaits it
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    async def get(self, license_key: str) -> Optional[LicenseInfo]:
+        """
+        What the validator says about `license_key`, None if it doesn't know it.
+        Raises LicenseValidationError when the validator rejects the key, and
+        LicenseUnavailable when it can't be asked and nothing usable is cached.
+        """
+        entry = self._entries.get(license_key)
+        if entry is not None:
+            fetched_at, info = entry
+            age = self._clock() - fetched_at
+            self._entries.move_to_end(license_key)
+            if age < (self.ttl if info is not None else self.negative_ttl):
+                self.hits += 1
+                return info
+            # unknown keys are asked about again, one may have been issued since
+            if info is not None and age < self.stale_seconds:
+                self.stale_hits += 1
+                if license_key not in self._inflight and self.breaker.allow():
+                    self._start_fetch(license_key).add_done_callback(self._log_refresh_failure)
+                return info
+
+        self.misses += 1
+        task = self._inflight.get(license_key)
+        if task is None:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise LicenseUnavailable("License service unavailable")
+            task = self._start_fetch(license_key)
+        # shielded, so a caller that gives up doesn't cancel the call for everybody else
+        return await asyncio.shield(task)
+
+    def _start_fetch(self, license_key: str) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(self._fetch(license_key))
+        self._inflight[license_key] = task
+        task.add_done_callback(lambda _task: self._inflight.pop(license_key, None))
+        return task
+
+    async def _fetch(self, license_key: str) -> Optional[LicenseInfo]:
+        if self.validator is None:
+            self.validator = LicenseValidator()
+        self.calls += 1
+        try:
+            if inspect.iscoroutinefunction(self.validator.get_license_info):
+                call = self.validator.get_license_info(license_key)
+            else:
+                # a blocking client, keep it off the event loop
+                call = asyncio.to_thread(self.validator.get_license_info, license_key)
+            raw = await asyncio.wait_for(call, self.timeout)
+        except LicenseValidationError:
+            # the validator answered, it just didn't like the key
+            self.breaker.record_success()
+            raise
+        except Exception as exc:
+            self.failures += 1
+            self.breaker.record_failure()
+            entry = self._entries.get(license_key)
+            if entry is not None and self._clock() - entry[0] < self.stale_seconds:
+                logger.warning("license validation failed (%r), serving the cached answer", exc)
+                return entry[1]
+            raise LicenseUnavailable("License service unavailable") from exc
+
+        self.breaker.record_success()
+        info = LicenseInfo.from_validator(raw) if raw else None
+        self._entries[license_key] = (self._clock(), info)
+        self._entries.move_to_end(license_key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return info
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("background license revalidation failed: %r", task.exception())
+
+    def invalidate(self, license_key: str) -> None:
+        self._entries.pop(license_key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+            "validator_calls": self.calls,
+            "validator_failures": self.failures,
+            "rejected": self.rejected,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+        }
+
+
+license_service = LicenseService()
@@ -0,0 +1,95 @@
+"""
+Per-location cache of the serialized menu.
+
+Entries hold the JSON bytes GET /menu/{location_id} returns, tagged with the
+location's menu_version. A lookup only hits when the tag matches the version the
+request just read with its membership check, so a worker that missed an
+invalidation still never serves an old menu. Menu writes publish a menu_changed
+event after commit and every worker drops its copy right away.
+"""
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from decouple import config
+
+
+MENU_CACHE_SIZE = config("MENU_CACHE_SIZE", default=1024, cast=int)
+
+
+class MenuCache:
+    def __init__(self, maxsize: int = MENU_CACHE_SIZE):
+        self.maxsize = maxsize
+        # location_id -> (menu_version, body), least recently used first
+        self._data: "OrderedDict[int, tuple[int, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self.max_rebuild_seconds = 0.0
+
+    def get(self, location_id: int, version: int) -> Optional[bytes]:
+        entry = self._data.get(location_id)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._data.move_to_end(location_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, location_id: int, version: int, body: bytes) -> None:
+        entry = self._data.get(location_id)
+        if entry is not None and entry[0] > version:
+            # a request that read a newer version already cached its menu
+            return
+        self._data[location_id] = (version, body)
+        self._data.move_to_end(location_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_build(self, location_id: int, version: int, build: Callable[[], Awaitable[bytes]]) -> bytes:
+        body = self.get(location_id, version)
+        if body is None:
+            started = time.perf_counter()
+            body = await build()
+            elapsed = time.perf_counter() - started
+            self.rebuilds += 1
+            self.rebuild_seconds += elapsed
+            self.max_rebuild_seconds = max(self.max_rebuild_seconds, elapsed)
+            self.set(location_id, version, body)
+        return body
+
+    def invalidate(self, location_id: int) -> None:
+        if self._data.pop(location_id, None) is not None:
+            self.invalidations += 1
+
+    def on_menu_event(self, location_id: Optional[int], menu_event: dict) -> None:
+        if location_id is None:
+            # menu events were lost, any location may be stale
+            self.clear()
+        else:
+            self.invalidate(location_id)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "rebuilds": self.rebuilds,
+            "avg_rebuild_ms": round(self.rebuild_seconds / self.rebuilds * 1000, 3) if self.rebuilds else None,
+            "max_rebuild_ms": round(self.max_rebuild_seconds * 1000, 3),
+        }
+
+
+menu_cache = MenuCache()
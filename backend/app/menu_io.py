@@ -0,0 +1,202 @@
+"""
+Bulk menu import and export in CSV or NDJSON.
+
+Imports are parsed as the body streams in and written in batches of
+MENU_IMPORT_BATCH_SIZE rows, so memory stays flat however big the catalog is.
+Exports stream products off a server-side cursor the same way.
+"""
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Optional
+
+from decouple import config
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Product
+from app.schema import ImportProductRowSchema
+
+
+MENU_IMPORT_BATCH_SIZE = config("MENU_IMPORT_BATCH_SIZE", default=500, cast=int)
+MENU_EXPORT_BATCH_SIZE = config("MENU_EXPORT_BATCH_SIZE", default=1000, cast=int)
+# longest single record accepted, a body without newlines shouldn't be buffered whole
+MENU_IMPORT_MAX_RECORD = 64 * 1024
+# per-row errors reported back, the rest are only counted
+MENU_IMPORT_MAX_ERRORS = 100
+
+CSV_COLUMNS = ["id", "name", "description", "price"]
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class MenuImportError(ValueError):
+    """The body as a whole can't be read, as opposed to one bad row."""
+
+
+def import_format(content_type: Optional[str]) -> Optional[str]:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type == "text/csv":
+        return "csv"
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # utf-8-sig drops the BOM spreadsheet exports like to start with
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    try:
+        async for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+            if len(pending) > MENU_IMPORT_MAX_RECORD:
+                raise MenuImportError(f"record longer than {MENU_IMPORT_MAX_RECORD} bytes")
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise MenuImportError("body is not valid UTF-8")
+    if pending:
+        yield pending.rstrip("\r")
+
+async def _csv_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, object]]:
+    header = None
+    record, row_number = [], 0
+    async for line in lines:
+        record.append(line)
+        # an odd number of quotes means a quoted field runs on to the next line
+        if sum(part.count('"') for part in record) % 2:
+            if sum(len(part) for part in record) > MENU_IMPORT_MAX_RECORD:
+                raise MenuImportError(f"record longer than {MENU_IMPORT_MAX_RECORD} bytes")
+            continue
+        text = "\n".join(record)
+        record = []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            if "name" not in header or "price" not in header:
+                raise MenuImportError("CSV header needs at least name and price columns")
+            continue
+        row_number += 1
+        yield row_number, {column: value for column, value in zip(header, values) if value != ""}
+    if record:
+        raise MenuImportError("CSV ends inside a quoted field")
+
+async def _ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple[int, object]]:
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield row_number, f"invalid JSON: {exc.msg}"
+
+def read_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, object]]:
+    """(row number, parsed row or an error message) for every data row of the body."""
+    parse = _csv_records if fmt == "csv" else _ndjson_records
+    return parse(_lines(chunks))
+
+
+class MenuImport:
+    def __init__(self, db: AsyncSession, location_id: int):
+        self.db = db
+        self.location_id = location_id
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors: list[dict] = []
+        self._batch: list[tuple[int, ImportProductRowSchema]] = []
+
+    def error(self, row_number: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MENU_IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    async def add(self, row_number: int, record: object) -> None:
+        if isinstance(record, str):
+            self.error(row_number, record)
+            return
+        try:
+            row = ImportProductRowSchema.model_validate(record)
+        except ValidationError as exc:
+            self.error(row_number, "; ".join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in exc.errors()))
+            return
+        self._batch.append((row_number, row))
+        if len(self._batch) >= MENU_IMPORT_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        ids = {row.id for _, row in batch if row.id is not None}
+        names = {row.name for _, row in batch if row.id is None}
+        existing_ids, by_name = set(), {}
+        if ids or names:
+            for product_id, name in (await self.db.execute(
+                select(Product.id, Product.name)
+                .where(Product.Location_id == self.location_id)
+                .where(Product.id.in_(ids) | Product.name.in_(names))
+                .order_by(Product.id.desc())
+            )).all():
+                existing_ids.add(product_id)
+                # the oldest product wins if a name is already duplicated
+                by_name[name] = product_id
+
+        # later rows for the same product win within a batch
+        updates, inserts = {}, {}
+        for row_number, row in batch:
+            values = {"name": row.name, "description": row.description, "price": row.price}
+            if row.id is not None:
+                if row.id not in existing_ids:
+                    self.error(row_number, f"product {row.id} not found at this location")
+                    continue
+                updates[row.id] = {"id": row.id, **values}
+            elif row.name in by_name:
+                updates[by_name[row.name]] = {"id": by_name[row.name], **values}
+            else:
+                inserts[row.name] = {"Location_id": self.location_id, **values}
+
+        if updates:
+            # executemany by primary key
+            await self.db.execute(update(Product), list(updates.values()))
+        if inserts:
+            # multi-row INSERT ... VALUES
+            await self.db.execute(insert(Product), list(inserts.values()))
+        self.updated += len(updates)
+        self.inserted += len(inserts)
+
+    def result(self) -> dict:
+        return {"inserted": self.inserted, "updated": self.updated, "error_count": self.error_count, "errors": self.errors}
+
+
+def csv_chunk(rows: list[list]) -> str:
+    """CSV text for a batch of rows, to yield from a streaming response."""
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(rows)
+    return out.getvalue()
+
+async def export_products(db: AsyncSession, location_id: int, fmt: str) -> AsyncIterator[str]:
+    """The location's products as CSV or NDJSON text, one cursor batch at a time."""
+    result = await db.stream(
+        select(Product.id, Product.name, Product.description, Product.price)
+        .where(Product.Location_id == location_id)
+        .order_by(Product.id)
+        .execution_options(yield_per=MENU_EXPORT_BATCH_SIZE)
+    )
+    if fmt == "csv":
+        yield csv_chunk([CSV_COLUMNS])
+    async for rows in result.partitions():
+        if fmt == "csv":
+            yield csv_chunk([list(row) for row in rows])
+        else:
+            yield "".join(json.dumps(dict(row._mapping), separators=(",", ":")) + "\n" for row in rows)
@@ -0,0 +1,42 @@
+import bisect
+import threading
+
+
+# seconds, tuned for things that should normally take well under a second
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram in the Prometheus style (cumulative `le` buckets)."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, value_sum, value_max = sum(counts), self._sum, self._max
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[f"le_{bound}"] = running
+        cumulative["le_inf"] = total
+        return {
+            "count": total,
+            "sum": round(value_sum, 6),
+            "max": round(value_max, 6),
+            "avg": round(value_sum / total, 6) if total else None,
+            "buckets": cumulative,
+        }
@@ -1,6 +1,9 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from .database import Base
-from sqlalchemy import Column, Integer, LargeBinary, String, Text, ForeignKey, Enum
+from sqlalchemy import text, BigInteger, Boolean, Column, DateTime, Integer, LargeBinary, String, Text, ForeignKey, Enum, Index, UniqueConstraint
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 class User(Base):
     __tablename__ = "users"
@@ -10,15 +13,31 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     password = Column(LargeBinary, nullable=False)
 
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # every rotation of one login shares a family, reuse of an old token revokes the family
+    family_id = Column(String(32), index=True, nullable=False)
+    expires_at = Column(Integer, nullable=False)
+    used_at = Column(Integer, nullable=True)
+    revoked = Column(Boolean, default=False, nullable=False)
+
 class Organization(Base):
     __tablename__ = "organizations"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=False, index=True, nullable=False)
-    created_at = Column(String, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
 
 class OrganizationUser(Base):
     __tablename__ = "organization_users"
+    __table_args__ = (
+        # membership checks filter on user_id alone or on (user_id, organization_id)
+        Index("ix_organization_users_user_id_organization_id", "user_id", "organization_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -30,37 +49,46 @@ class Location(Base):
     __tablename__ = "locations"
 
     id = Column(Integer, primary_key=True, index=True)
-    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     address = Column(Text, nullable=True)
     timezone = Column(String, default="UTC")
+    # bumped by every order write at this location, displays long-poll on it
+    orders_version = Column(BigInteger, default=0, server_default="0", nullable=False)
+    # bumped by every menu write at this location, the menu ETag is built from it
+    menu_version = Column(BigInteger, default=0, server_default="0", nullable=False)
 
 class License(Base):
     __tablename__ = "licenses"
 
     id = Column(Integer, primary_key=True, index=True)
-    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False, index=True)
     license_key = Column(String, unique=True, nullable=False)
 
 class Device(Base):
     __tablename__ = "devices"
 
     id = Column(Integer, primary_key=True, index=True)
-    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False, index=True)
     device_name = Column(String, nullable=False)
     device_status = Column(Enum("paired", "unpaired", "decommissioned", name="device_statuses"), default="unpaired")
     device_type = Column(Enum("POS", "KitchenDisplay", "CustomerDisplay", name="device_type"), default="POS")
     pairing_code = Column(String, unique=True, nullable=False)
     hardware_id = Column(String, unique=True)
     device_token = Column(String, unique=True)
-    registered_at = Column(String, default=datetime.utcnow)
-    last_active_at = Column(String, default=datetime.utcnow)
+    device_token_hash = Column(String(64), unique=True, index=True)
+    registered_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+    last_active_at = Column(DateTime(timezone=True), default=utcnow)
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # menu imports match rows to existing products by name
+        Index("ix_products_location_id_name", "Location_id", "name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    Location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    Location_id = Column(Integer, ForeignKey("locations.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     price = Column(Integer, nullable=False)
@@ -69,23 +97,77 @@ class StockItem(Base):
     __tablename__ = "stock_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
-    quantity = Column(Integer, default=0)
-    last_updated = Column(String, default=datetime.utcnow)
+    # one row per tracked product, orders decrement it by product_id
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, unique=True, index=True)
+    quantity = Column(Integer, default=0, server_default="0", nullable=False)
+    last_updated = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # display feeds filter by location and status
+        Index("ix_orders_location_id_status", "location_id", "status"),
+        # time-range reads per location (revenue, reports)
+        Index("ix_orders_location_id_created_at", "location_id", "created_at"),
+        # long-poll deltas: orders changed since a location version
+        Index("ix_orders_location_id_version", "location_id", "version"),
+        # only the unpaid orders, for loading the in-memory order board
+        Index(
+            "ix_orders_active_location_id", "location_id",
+            postgresql_where=text("status <> 'paid'"), sqlite_where=text("status <> 'paid'"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
     status = Column(Enum("open", "preparing", "ready", "paid", name="order_statuses"), default="pending")
-    created_at = Column(String, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+    # kept in step with order_items by app.order_totals in the same transaction as
+    # every item change, total_amount equals subtotal until taxes/discounts exist
+    subtotal = Column(Integer, default=0, server_default="0", nullable=False)
+    total_amount = Column(Integer, default=0, server_default="0", nullable=False)
+    item_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # the location's orders_version at this order's last change
+    version = Column(BigInteger, default=0, server_default="0", nullable=False)
 
 class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, default=1)
-    price = Column(Integer, nullable=False)
\ No newline at end of file
+    price = Column(Integer, nullable=False)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        # keys are only unique per client, scope is "user:<id>" or "device:<id>"
+        UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(32), nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 of method, path and body, a reused key with a different request is rejected
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    expires_at = Column(Integer, index=True, nullable=False)
+
+class SalesRollup(Base):
+    __tablename__ = "sales_rollup"
+    __table_args__ = (
+        # one row per location, UTC hour and product, upserted as orders are sold
+        UniqueConstraint("location_id", "hour_start", "product_id", name="uq_sales_rollup_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    # start of the UTC hour the orders were created in
+    hour_start = Column(DateTime(timezone=True), nullable=False)
+    # 0 holds whole orders (order_count, item_count, total_amount), other ids that product's lines
+    product_id = Column(Integer, nullable=False)
+    order_count = Column(Integer, default=0, server_default="0", nullable=False)
+    quantity = Column(Integer, default=0, server_default="0", nullable=False)
+    revenue = Column(Integer, default=0, server_default="0", nullable=False)
@@ -0,0 +1,178 @@
+"""
+Per-location board of active (not yet paid) orders with their items, held in memory.
+
+Warmed from the DB at startup, kept current by the order event bus and reconciled
+against the DB every ORDER_BOARD_RECONCILE_SECONDS. The displays read it instead
+of querying `orders` on every poll. A location whose state is in doubt (not
+warmed yet, or told to resync) reports None so callers fall back to the DB.
+"""
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from decouple import config
+from sqlalchemy import select
+
+from app import database
+from app.events import OrderEventBus
+from app.models import Location, Order, OrderItem
+from app.routers.orders import serialize_order
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_BOARD_RECONCILE_SECONDS = config("ORDER_BOARD_RECONCILE_SECONDS", default=60, cast=float)
+ACTIVE_ORDER = Order.status != "paid"
+
+
+class OrderBoard:
+    def __init__(self):
+        # location_id -> order_id -> serialized order with items
+        self._locations: dict[int, dict[int, dict]] = {}
+        # location_id -> orders_version the board reflects
+        self._versions: dict[int, int] = {}
+        # events applied per location, to spot locations that changed during a DB load
+        self._touched: dict[int, int] = {}
+        self._stale: set[int] = set()
+        self.ready = False
+        self._resyncs = 0
+        self.reconciles = 0
+        self.repaired = 0
+        self._bus: Optional[OrderEventBus] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def orders(self, location_id: int, predicate: Callable[[str], bool]) -> Optional[list[dict]]:
+        if not self.ready or location_id in self._stale:
+            return None
+        board = self._locations.get(location_id, {})
+        return [board[order_id] for order_id in sorted(board) if predicate(board[order_id]["status"])]
+
+    def version(self, location_id: int) -> Optional[int]:
+        """The location's orders_version as of what orders() returns, None when orders() would."""
+        if not self.ready or location_id in self._stale:
+            return None
+        # locations created after the load start at 0 and every change since came in as an event
+        return self._versions.get(location_id, 0)
+
+    def apply(self, location_id: Optional[int], order_event: dict) -> None:
+        if location_id is None:
+            # the bus lost events for every location, read from the DB until the next reconcile
+            self.ready = False
+            self._resyncs += 1
+            return
+        self._touched[location_id] = self._touched.get(location_id, 0) + 1
+        if order_event["type"] == "resync":
+            self._stale.add(location_id)
+            return
+
+        version = order_event.get("order", order_event.get("totals", {})).get("version")
+        if version is not None:
+            self._versions[location_id] = max(version, self._versions.get(location_id, 0))
+
+        board = self._locations.setdefault(location_id, {})
+        if "order" in order_event:
+            order = order_event["order"]
+            if order["status"] == "paid":
+                board.pop(order["id"], None)
+            else:
+                board[order["id"]] = {**order, "items": list(order["items"])}
+            return
+
+        order = board.get(order_event["order_id"])
+        if order is None:
+            return
+        items = [item for item in order["items"] if item["id"] != order_event["item"]["id"]]
+        if order_event["type"] != "order_item_removed":
+            items.append(order_event["item"])
+        board[order["id"]] = {**order, **order_event["totals"], "items": items}
+
+    async def load(self) -> int:
+        """Replace the board with the DB's active orders and return how many orders differed."""
+        touched_before = dict(self._touched)
+        async with database.AsyncSessionLocal() as db:
+            # versions first, so a write landing mid-load can only make them older than the orders
+            versions = dict((await db.execute(select(Location.id, Location.orders_version))).all())
+            orders = (await db.scalars(select(Order).where(ACTIVE_ORDER))).all()
+            items = {}
+            for item in (await db.scalars(
+                select(OrderItem).where(OrderItem.order_id.in_(select(Order.id).where(ACTIVE_ORDER)))
+            )).all():
+                items.setdefault(item.order_id, []).append(item)
+
+        loaded: dict[int, dict[int, dict]] = {}
+        for order in orders:
+            loaded.setdefault(order.location_id, {})[order.id] = serialize_order(order, items.get(order.id, []))
+
+        # no awaits from here on, so no event can land between the check and the swap
+        repaired = 0
+        for location_id in set(loaded) | set(versions) | set(self._locations) | self._stale:
+            if self._touched.get(location_id) != touched_before.get(location_id):
+                # events arrived while we were reading, the DB copy may already be behind them.
+                # After warm-up the board has those events applied, before it the location is incomplete.
+                if not self.ready:
+                    self._stale.add(location_id)
+                continue
+            current, fresh = self._locations.get(location_id, {}), loaded.get(location_id, {})
+            repaired += sum(1 for order_id in set(current) | set(fresh) if current.get(order_id) != fresh.get(order_id))
+            self._locations[location_id] = fresh
+            self._versions[location_id] = versions.get(location_id, 0)
+            self._stale.discard(location_id)
+        return repaired
+
+    async def start(self, bus: OrderEventBus) -> None:
+        self._bus = bus
+        self._locations.clear()
+        self._versions.clear()
+        self._touched.clear()
+        self._stale.clear()
+        self.ready = False
+        # listen first so nothing committed during the warm-up load is missed
+        bus.add_listener(self.apply)
+        try:
+            resyncs = self._resyncs
+            await self.load()
+            self.ready = self._resyncs == resyncs
+        except Exception:
+            logger.exception("order board warm-up failed, displays read from the DB until the next reconcile")
+        self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self) -> None:
+        if self._bus:
+            self._bus.remove_listener(self.apply)
+            self._bus = None
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.ready = False
+
+    async def reconcile(self) -> int:
+        resyncs = self._resyncs
+        repaired = await self.load()
+        # a resync during the load may have dropped events the load read too early to see
+        self.ready = self._resyncs == resyncs
+        self.reconciles += 1
+        self.repaired += repaired
+        if repaired:
+            logger.warning("order board reconcile repaired %s order(s)", repaired)
+        return repaired
+
+    async def _reconcile_loop(self) -> None:
+        while True:
+            await asyncio.sleep(ORDER_BOARD_RECONCILE_SECONDS)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("order board reconcile failed")
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "locations": len(self._locations),
+            "active_orders": sum(len(board) for board in self._locations.values()),
+            "stale_locations": len(self._stale),
+            "reconciles": self.reconciles,
+            "repaired": self.repaired,
+        }
+
+
+order_board = OrderBoard()
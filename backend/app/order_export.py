@@ -0,0 +1,88 @@
+"""
+Orders and their line items as CSV or NDJSON, for accounting.
+
+Streams one location at a time off a server-side cursor in
+ORDER_EXPORT_BATCH_SIZE row batches, each read as an index range on
+(location_id, created_at) so rows come back in order without a sort. The first
+bytes go out after the first batch and memory stays flat however long the range
+is. CSV has a row per line item (an order without items gets one row with the
+item columns empty). NDJSON has a line per order with its items nested.
+"""
+import json
+from datetime import date, datetime, timezone
+from typing import AsyncIterator
+
+from decouple import config
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.menu_io import csv_chunk
+from app.models import Order, OrderItem, Product
+from app.revenue import location_zone, utc_bounds
+
+
+ORDER_EXPORT_BATCH_SIZE = config("ORDER_EXPORT_BATCH_SIZE", default=2000, cast=int)
+
+ORDER_COLUMNS = ["order_id", "location_id", "location_name", "created_at", "local_time", "status", "subtotal", "total_amount", "item_count"]
+ITEM_COLUMNS = ["item_id", "product_id", "product_name", "quantity", "price", "line_total"]
+CSV_COLUMNS = ORDER_COLUMNS + ITEM_COLUMNS
+
+
+def _order_fields(location, zone, row) -> list:
+    created_at = row.created_at
+    if created_at.tzinfo is None:
+        # SQLite hands timestamps back naive, they are UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return [
+        row.order_id, location.id, location.name,
+        created_at.astimezone(timezone.utc).isoformat(),
+        created_at.astimezone(zone).replace(tzinfo=None).isoformat(),
+        row.status, row.subtotal, row.total_amount, row.item_count,
+    ]
+
+def _item_fields(row) -> list:
+    if row.item_id is None:
+        return [None] * len(ITEM_COLUMNS)
+    return [row.item_id, row.product_id, row.product_name, row.quantity, row.price, row.quantity * row.price]
+
+def _json_line(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+async def export_orders(db: AsyncSession, locations: list, start: date, end: date, fmt: str) -> AsyncIterator[str]:
+    """Orders of `locations` placed on the local days `start`..`end`, as CSV or NDJSON text one batch at a time."""
+    if fmt == "csv":
+        yield csv_chunk([CSV_COLUMNS])
+    for location in locations:
+        zone = location_zone(location.timezone)
+        lower, upper = utc_bounds(location.timezone, start, end)
+        result = await db.stream(
+            select(
+                Order.id.label("order_id"), Order.created_at, Order.status, Order.subtotal, Order.total_amount, Order.item_count,
+                OrderItem.id.label("item_id"), OrderItem.product_id, Product.name.label("product_name"), OrderItem.quantity, OrderItem.price,
+            )
+            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .where(Order.location_id == location.id, Order.created_at >= lower, Order.created_at < upper)
+            .order_by(Order.created_at, Order.id, OrderItem.id)
+            .execution_options(yield_per=ORDER_EXPORT_BATCH_SIZE)
+        )
+        if fmt == "csv":
+            async for rows in result.partitions():
+                yield csv_chunk([_order_fields(location, zone, row) + _item_fields(row) for row in rows])
+            continue
+
+        # an order's rows are adjacent, so only the one being assembled is held back between batches
+        current = None
+        async for rows in result.partitions():
+            lines = []
+            for row in rows:
+                if current is None or current["order_id"] != row.order_id:
+                    if current is not None:
+                        lines.append(_json_line(current))
+                    current = {**dict(zip(ORDER_COLUMNS, _order_fields(location, zone, row))), "items": []}
+                if row.item_id is not None:
+                    current["items"].append(dict(zip(ITEM_COLUMNS, _item_fields(row))))
+            if lines:
+                yield "".join(lines)
+        if current is not None:
+            yield _json_line(current)
@@ -0,0 +1,79 @@
+from typing import Iterable, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Order, OrderItem
+
+
+async def apply_item_delta(db: AsyncSession, order_id: int, amount: int, quantity: int, version: int) -> dict:
+    """
+    Shift an order's totals by the change in its items, stamp its new version and
+    return the new totals. Done as `SET col = col + delta` so concurrent item writes
+    to one order can't lose each other's updates. The caller commits together with
+    the item change.
+    """
+    row = (await db.execute(
+        update(Order)
+        .where(Order.id == order_id)
+        .values(
+            subtotal=Order.subtotal + amount,
+            total_amount=Order.total_amount + amount,
+            item_count=Order.item_count + quantity,
+            version=version,
+        )
+        .returning(Order.subtotal, Order.total_amount, Order.item_count, Order.version)
+        .execution_options(synchronize_session=False)
+    )).one()
+    return {"subtotal": row.subtotal, "total_amount": row.total_amount, "item_count": row.item_count, "version": row.version}
+
+
+def _item_totals():
+    return (
+        select(
+            OrderItem.order_id,
+            func.sum(OrderItem.quantity * OrderItem.price).label("subtotal"),
+            func.sum(OrderItem.quantity).label("item_count"),
+        )
+        .group_by(OrderItem.order_id)
+        .subquery()
+    )
+
+async def find_total_drift(db: AsyncSession, limit: Optional[int] = None) -> list:
+    """Orders whose stored totals don't match their items, as (id, stored, expected) rows."""
+    items = _item_totals()
+    expected_subtotal = func.coalesce(items.c.subtotal, 0)
+    expected_count = func.coalesce(items.c.item_count, 0)
+    stmt = (
+        select(
+            Order.id, Order.subtotal, Order.total_amount, Order.item_count,
+            expected_subtotal.label("expected_subtotal"), expected_count.label("expected_item_count"),
+        )
+        .outerjoin(items, items.c.order_id == Order.id)
+        .where(or_(
+            Order.subtotal != expected_subtotal,
+            Order.total_amount != expected_subtotal,
+            Order.item_count != expected_count,
+        ))
+        .order_by(Order.id)
+        .limit(limit)
+    )
+    return (await db.execute(stmt)).all()
+
+async def recompute_order_totals(db: AsyncSession, order_ids: Optional[Iterable[int]] = None) -> int:
+    """Rebuild stored totals from order_items, for all orders or just `order_ids`. Caller commits."""
+    subtotal = (
+        select(func.coalesce(func.sum(OrderItem.quantity * OrderItem.price), 0))
+        .where(OrderItem.order_id == Order.id)
+        .scalar_subquery()
+    )
+    item_count = (
+        select(func.coalesce(func.sum(OrderItem.quantity), 0))
+        .where(OrderItem.order_id == Order.id)
+        .scalar_subquery()
+    )
+    stmt = update(Order).values(subtotal=subtotal, total_amount=subtotal, item_count=item_count)
+    if order_ids is not None:
+        stmt = stmt.where(Order.id.in_(list(order_ids)))
+    result = await db.execute(stmt.execution_options(synchronize_session=False))
+    return result.rowcount
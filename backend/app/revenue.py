@@ -0,0 +1,169 @@
+"""
+Revenue over a range of local days, for every location a user can manage.
+
+Reads the hourly sales_rollup (see app.sales_rollup) rather than the orders.
+Day boundaries follow each location's own timezone: the range is turned into
+UTC bounds per timezone up front, so the aggregate is an index range scan, and
+hour/day buckets are taken on the location's wall clock. Postgres converts with
+the real zone rules. SQLite (tests) has no zone data and shifts by each
+location's UTC offset at the start of the range, which is off by an hour across
+a DST change.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import String, and_, case, func, literal, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from app.models import Location, Order, OrderItem, OrganizationUser, Product, SalesRollup
+from app.sales_rollup import ORDER_TOTALS, REVENUE_STATUSES
+
+GROUP_BY = ("location", "hour", "day", "product")
+MAX_RANGE_DAYS = 366
+
+
+class _local_bucket(FunctionElement):
+    # (created_at, zone name for Postgres, "+N minutes" offset for SQLite)
+    type = String()
+    inherit_cache = True
+
+class local_hour(_local_bucket):
+    """Order time on the location's wall clock, truncated to the hour, as 'YYYY-MM-DDTHH:00'."""
+    inherit_cache = True
+    pg_format, sqlite_format = 'YYYY-MM-DD"T"HH24:00', "%Y-%m-%dT%H:00"
+
+class local_day(_local_bucket):
+    """Order date on the location's wall clock, as 'YYYY-MM-DD'."""
+    inherit_cache = True
+    pg_format, sqlite_format = "YYYY-MM-DD", "%Y-%m-%d"
+
+@compiles(_local_bucket, "postgresql")
+def _compile_pg(element, compiler, **kw):
+    timestamp, tz, _offset = element.clauses
+    return f"to_char(timezone({compiler.process(tz, **kw)}, {compiler.process(timestamp, **kw)}), '{element.pg_format}')"
+
+@compiles(_local_bucket)
+def _compile_default(element, compiler, **kw):
+    timestamp, _tz, offset = element.clauses
+    return f"strftime('{element.sqlite_format}', {compiler.process(timestamp, **kw)}, {compiler.process(offset, **kw)})"
+
+
+def location_zone(name: Optional[str]):
+    """The zone named by Location.timezone, UTC if it's missing or unknown."""
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        return timezone.utc
+
+def utc_bounds(tz_name: Optional[str], start: date, end: date) -> tuple[datetime, datetime]:
+    """UTC instants of local midnight on `start` and the midnight after `end`."""
+    zone = location_zone(tz_name)
+    return (
+        datetime.combine(start, time(), zone).astimezone(timezone.utc),
+        datetime.combine(end + timedelta(days=1), time(), zone).astimezone(timezone.utc),
+    )
+
+def local_days_filter(location_id, timestamp, locations: list, start: date, end: date):
+    """`timestamp` within the local days `start`..`end` of its location, one index range per timezone."""
+    by_zone: dict[str, list[int]] = {}
+    for location in locations:
+        by_zone.setdefault(location.timezone or "UTC", []).append(location.id)
+    return or_(*(
+        and_(location_id.in_(ids), timestamp >= lower, timestamp < upper)
+        for tz_name, ids in by_zone.items()
+        for lower, upper in [utc_bounds(tz_name, start, end)]
+    ))
+
+async def managed_locations(db: AsyncSession, user_id: int, location_ids: Optional[list[int]] = None) -> list:
+    """(id, name, timezone) of the locations in every organization the user belongs to."""
+    stmt = (
+        select(Location.id, Location.name, Location.timezone)
+        .join(OrganizationUser, OrganizationUser.organization_id == Location.organization_id)
+        .where(OrganizationUser.user_id == user_id)
+        .order_by(Location.id)
+        .distinct()
+    )
+    if location_ids:
+        stmt = stmt.where(Location.id.in_(location_ids))
+    return (await db.execute(stmt)).all()
+
+def _hour_aligned(zones, start: date, end: date) -> bool:
+    """Whether every local day boundary in the range falls on a UTC hour, so hourly buckets add up to local days."""
+    return all(
+        zone.utcoffset(datetime.combine(day, time())).total_seconds() % 3600 == 0
+        for zone in zones
+        for day in (start, end + timedelta(days=1))
+    )
+
+async def revenue_report(db: AsyncSession, locations: list, start: date, end: date, group_by: str) -> list[dict]:
+    """
+    Revenue rows for `locations` between the local days `start` and `end` inclusive,
+    in one GROUP BY. Reads the hourly sales_rollup, or the orders themselves when a
+    location's zone is off the hour (e.g. UTC+05:30) and hours don't add up to its days.
+    """
+    if not locations:
+        return []
+    zones = {location.id: location_zone(location.timezone) for location in locations}
+    rollup = _hour_aligned(zones.values(), start, end)
+    if rollup:
+        location_id, timestamp = SalesRollup.location_id, SalesRollup.hour_start
+    else:
+        location_id, timestamp = Order.location_id, Order.created_at
+
+    in_range = local_days_filter(location_id, timestamp, locations, start, end)
+    names = {location.id: location.name for location in locations}
+
+    if group_by == "product":
+        if rollup:
+            product_id, quantity, revenue = SalesRollup.product_id, func.sum(SalesRollup.quantity), func.sum(SalesRollup.revenue)
+            stmt = select(location_id, product_id, Product.name, quantity, revenue).where(in_range, product_id != ORDER_TOTALS)
+        else:
+            product_id, quantity, revenue = OrderItem.product_id, func.sum(OrderItem.quantity), func.sum(OrderItem.quantity * OrderItem.price)
+            stmt = (
+                select(location_id, product_id, Product.name, quantity, revenue)
+                .join(OrderItem, OrderItem.order_id == Order.id)
+                .where(in_range, Order.status.in_(REVENUE_STATUSES))
+            )
+        rows = (await db.execute(
+            stmt.outerjoin(Product, Product.id == product_id)
+            .group_by(location_id, product_id, Product.name)
+            # buckets of orders that were sold and then reopened are left at zero
+            .having(quantity != 0)
+            .order_by(location_id, revenue.desc(), product_id)
+        )).all()
+        return [
+            {"location_id": location, "product_id": product, "name": name, "quantity": units, "revenue": amount}
+            for location, product, name, units, amount in rows
+        ]
+
+    columns = [location_id]
+    if group_by in ("hour", "day"):
+        # per location: the zone for Postgres, its offset at the start of the range for SQLite.
+        # Zones are checked here so a bad Location.timezone reads as UTC instead of failing the query.
+        zone_names = case({location: getattr(zone, "key", "UTC") for location, zone in zones.items()}, value=location_id, else_=literal("UTC"))
+        offsets = case({
+            location: f"{int(zone.utcoffset(datetime.combine(start, time())).total_seconds() // 60):+d} minutes"
+            for location, zone in zones.items()
+        }, value=location_id, else_=literal("+0 minutes"))
+        bucket_type = local_hour if group_by == "hour" else local_day
+        columns.append(bucket_type(timestamp, zone_names, offsets).label(group_by))
+    if rollup:
+        revenue, orders = func.sum(SalesRollup.revenue), func.sum(SalesRollup.order_count)
+        stmt = select(*columns, revenue, orders).where(in_range, SalesRollup.product_id == ORDER_TOTALS)
+    else:
+        # totals are stored on the order (see app.order_totals), no need to read its items here
+        revenue, orders = func.sum(Order.total_amount), func.count(Order.id)
+        stmt = select(*columns, revenue, orders).where(in_range, Order.status.in_(REVENUE_STATUSES))
+    rows = (await db.execute(stmt.group_by(*columns).having(orders > 0).order_by(*columns))).all()
+    if group_by == "location":
+        return [
+            {"location_id": location, "name": names[location], "revenue": amount, "orders": count}
+            for location, amount, count in rows
+        ]
+    return [
+        {"location_id": location, group_by: bucket, "revenue": amount, "orders": count}
+        for location, bucket, amount, count in rows
+    ]
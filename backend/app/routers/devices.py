@@ -1,15 +1,18 @@
 from fastapi import APIRouter, Body
 from fastapi.params import Depends
-from keystone import LicenseValidationError, LicenseValidator
+from keystone import LicenseValidationError
 
-from app.auth.auth_bearer import JWTBearer
-from app.dependencies import get_current_user
+from app.auth.device_bearer import DEVICE_TOKEN_PREFIX, DevicePrincipal, hash_device_token, revoke_device_token
+from app.dependencies import get_current_device, get_current_user
+from app.heartbeats import device_heartbeats
+from app.licensing import DEVICE_FEATURES, LicenseUnavailable, license_service
 
 from ..schema import CreateDeviceSlotSchema, PairDeviceSchema
 from ..database import get_db
-from app.models import Location, Device, OrganizationUser, User, License
+from app.models import Location, Device, OrganizationUser, User, License, utcnow
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import secrets
 
@@ -18,43 +21,47 @@ router = APIRouter(prefix="/devices", tags=["devices"])
 
 PAIRING_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
 
+FEATURE_ERRORS = {
+    "pos_terminal": "License does not allow POS terminals",
+    "kitchen_display": "License does not allow Kitchen Displays",
+    "customer_screen": "License does not allow Customer Displays",
+}
+
 def generate_pairing_code(length: int = 8) -> str:
     return ''.join(secrets.choice(PAIRING_CHARS) for _ in range(length))
 
 def generate_device_token() -> str:
-    return "dev_" + secrets.token_urlsafe(32)
+    return DEVICE_TOKEN_PREFIX + secrets.token_urlsafe(32)
 
-@router.post("/register", dependencies=[Depends(JWTBearer())])
-async def register_device(db: Session = Depends(get_db), current_user: User = Depends(get_current_user), device_data: CreateDeviceSlotSchema = Body(...)):
+@router.post("/register")
+async def register_device(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user), device_data: CreateDeviceSlotSchema = Body(...)):
     # Check if current user is part of the organization that owns the location
-    location = db.query(Location).filter(Location.id == device_data.location_id).first()
+    location = await db.get(Location, device_data.location_id)
     if not location:
         return {"error": "Location not found"}
 
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id).first()
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "User not authorized for this location"}
 
     # Validate license key to have specific device quota
-    license = db.query(License).filter(License.location_id == location.organization_id).first()
+    license = await db.scalar(select(License).where(License.location_id == location.id))
     if not license:
-        return {"error": "No license found for organization"}
+        return {"error": "No license found for this location"}
     try:
-        validator = LicenseValidator()
-        print(f"Validating license key: {license.license_key}")
-        info = validator.get_license_info(license.license_key)
-        if not info:
-            return {"error": "Invalid license"}
-        license_info = info.features #{'customer_screen': False, 'kitchen_display': False, 'pos_terminal': True}
-        print("License info:", license_info)
-        if device_data.device_type == "POS" and not license_info.get('pos_terminal', False):
-            return {"error": "License does not allow POS terminals"}
-        if device_data.device_type == "KitchenDisplay" and not license_info.get('kitchen_display', False):
-            return {"error": "License does not allow Kitchen Displays"}
-        if device_data.device_type == "CustomerDisplay" and not license_info.get('customer_screen', False):
-            return {"error": "License does not allow Customer Displays"}
+        # cached per key, see app.licensing
+        info = await license_service.get(license.license_key)
     except LicenseValidationError as e:
         return {"error": f"License validation error: {str(e)}"}
+    except LicenseUnavailable:
+        return {"error": "License service unavailable, try again shortly"}
+    if not info or not info.usable:
+        return {"error": "Invalid license"}
+    feature = DEVICE_FEATURES.get(device_data.device_type)
+    if feature is None:
+        return {"error": "Unknown device type"}
+    if not info.allows(feature):
+        return {"error": FEATURE_ERRORS[feature]}
     #create device slot
 
     
@@ -68,47 +75,51 @@ async def register_device(db: Session = Depends(get_db), current_user: User = De
     )
     
     db.add(new_device)
-    db.commit()
-    db.refresh(new_device)
+    await db.commit()
+    await db.refresh(new_device)
     
     return {"device_id": new_device.id, "device_name": new_device.device_name, "pairing_code": new_device.pairing_code}
 
 @router.post("/pair", tags=["devices"])
-async def pair_device(db: Session = Depends(get_db), pair_data: PairDeviceSchema = Body(...)):
-    device = db.query(Device).filter(Device.pairing_code == pair_data.pairing_code).first()
+async def pair_device(db: AsyncSession = Depends(get_db), pair_data: PairDeviceSchema = Body(...)):
+    device = await db.scalar(select(Device).where(Device.pairing_code == pair_data.pairing_code))
     if not device:
         return {"error": "Invalid pairing code"}
 
     if device.device_status != "unpaired":
         return {"error": "Device already paired or decommissioned"}
 
-    # Pair the device
+    # Pair the device. Only the token hash is stored, the token itself is returned once.
+    device_token = generate_device_token()
     device.device_status = "paired"
     device.hardware_id = pair_data.hardware_id
-    device.device_token = generate_device_token()  # Implement token generation
+    device.device_token = None
+    device.device_token_hash = hash_device_token(device_token)
+    device.last_active_at = utcnow()
 
-    db.commit()
-    db.refresh(device)
+    await db.commit()
 
-    return {"device_id": device.id, "device_name": device.device_name, "device_token": device.device_token}
+    return {"device_id": device.id, "device_name": device.device_name, "device_token": device_token}
 
-@router.get("/", dependencies=[Depends(JWTBearer())])
-async def list_devices(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/")
+async def list_devices(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Get all devices for locations that the user has access to
-    org_user = db.query(OrganizationUser).filter(
+    org_ids = (await db.scalars(select(OrganizationUser.organization_id).where(
         OrganizationUser.user_id == current_user.id
-    ).all()
-    if not org_user:
+    ))).all()
+    if not org_ids:
         return {"error": "User not authorized"}
 
-    devices = db.query(Device).filter(
+    devices = (await db.scalars(select(Device).where(
         Device.location_id.in_(
-            db.query(Location.id).filter(Location.organization_id == org_user.organization_id)
+            select(Location.id).where(Location.organization_id.in_(org_ids))
         )
-    ).all()
+    ).order_by(Device.id))).all()
 
     device_list = []
     for device in devices:
+        # status is derived from activity, listing devices writes nothing
+        last_active_at = device_heartbeats.last_active_at(device.id, device.last_active_at)
         device_list.append({
             "device_id": device.id,
             "device_name": device.device_name,
@@ -116,8 +127,61 @@ async def list_devices(db: Session = Depends(get_db), current_user: User = Depen
             "device_type": device.device_type,
             "location_id": device.location_id,
             "registered_at": device.registered_at,
-            "last_active_at": device.last_active_at
+            "last_active_at": last_active_at,
+            "online_status": device_heartbeats.status(device.device_status, last_active_at),
         })
     print(f"[devices] User {current_user.email} accessed device list: {len(device_list)} devices found")
 
-    return {"devices": device_list}
\ No newline at end of file
+    return {"devices": device_list}
+
+@router.post("/heartbeat")
+async def device_heartbeat(device: DevicePrincipal = Depends(get_current_device)):
+    # authenticating already recorded the activity, there is nothing left to do per request
+    return {"device_id": device.id, "received_at": utcnow()}
+
+async def get_managed_device(db: AsyncSession, device_id: int, current_user: User):
+    device = await db.get(Device, device_id)
+    if not device:
+        return None
+    location = await db.get(Location, device.location_id)
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id))
+    if not org_user:
+        return None
+    return device
+
+@router.post("/{device_id}/reset-pairing")
+async def reset_device_pairing(device_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Revoke the current token and hand out a fresh pairing code so the slot can be re-paired
+    device = await get_managed_device(db, device_id, current_user)
+    if not device:
+        return {"error": "Device not found"}
+    if device.device_status == "decommissioned":
+        return {"error": "Device is decommissioned"}
+
+    revoked_hash = device.device_token_hash
+    device.device_status = "unpaired"
+    device.hardware_id = None
+    device.device_token = None
+    device.device_token_hash = None
+    device.pairing_code = generate_pairing_code()
+
+    revoke_device_token(db, device.location_id, revoked_hash)
+    await db.commit()
+
+    return {"device_id": device.id, "device_name": device.device_name, "pairing_code": device.pairing_code}
+
+@router.post("/{device_id}/decommission")
+async def decommission_device(device_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    device = await get_managed_device(db, device_id, current_user)
+    if not device:
+        return {"error": "Device not found"}
+
+    revoked_hash = device.device_token_hash
+    device.device_status = "decommissioned"
+    device.device_token = None
+    device.device_token_hash = None
+
+    revoke_device_token(db, device.location_id, revoked_hash)
+    await db.commit()
+
+    return {"device_id": device.id, "device_status": device.device_status}
@@ -1,75 +1,251 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+import asyncio
+from typing import Optional
 
-from app.auth.device_bearer import EitherBearer
-from app.dependencies import get_db
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.sse import EventSourceResponse, ServerSentEvent
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.device_bearer import DevicePrincipal
+from app.conditional import conditional, make_etag
+from app.dependencies import get_auth_context, get_current_device, get_db
+from app.events import RESYNC, order_events, publish_after_commit
+from app.heartbeats import DEVICE_STREAM_HEARTBEAT_SECONDS, device_heartbeats
+from app.order_board import order_board
+from app.routers.orders import lock_order, serialize_order
+from app.sales_rollup import record_status_change
+from app.versions import bump_orders_version
 from ..schema import CreateOrderSchema, UpdateOrderStatusSchema, AddOrderItemSchema
-from app.models import User, Device, Location, OrganizationUser, Order, OrderItem
+from app.models import User, Location, OrganizationUser, Order, OrderItem
 
 router = APIRouter(prefix="/displays", tags=["displays"])
 
-@router.get("/orders", dependencies=[Depends(EitherBearer)])
-async def get_kitchen_orders(db: Session = Depends(get_db), auth=Depends(EitherBearer)):
+
+def display_filter(device_type: str):
+    """SQL filter for the orders a display shows."""
+    if device_type == "KitchenDisplay":
+        return Order.status == "preparing"
+    return Order.status != "open"
+
+def display_shows(device_type: str, status: str) -> bool:
+    """Same as display_filter, for orders already in memory."""
+    if device_type == "KitchenDisplay":
+        return status == "preparing"
+    return status != "open"
+
+def display_updates(device_type: str, visible: set, order_event: dict) -> list[ServerSentEvent]:
+    """
+    Turn an order event into what one display needs to see, given the ids it shows.
+    Orders entering the filter are sent whole, orders leaving it as a removal.
+    """
+    if "order" in order_event:
+        order = order_event["order"]
+        if display_shows(device_type, order["status"]):
+            visible.add(order["id"])
+            return [ServerSentEvent(event="order", data={"type": order_event["type"], "order": order})]
+        if order["id"] in visible:
+            visible.discard(order["id"])
+            return [ServerSentEvent(event="order_removed", data={"id": order["id"]})]
+        return []
+    if order_event["order_id"] in visible:
+        return [ServerSentEvent(event="order_item", data=order_event)]
+    return []
+
+async def get_display_device(device: DevicePrincipal = Depends(get_current_device)) -> DevicePrincipal:
+    if device.device_type not in ("KitchenDisplay", "CustomerDisplay"):
+        raise HTTPException(status_code=403, detail="Device type not allowed")
+    return device
+
+async def display_orders_etag(request: Request, db: AsyncSession = Depends(get_db), auth=Depends(get_auth_context)) -> Optional[str]:
+    # long polls carry their own cursor, and the org-wide user view has no single version
+    if auth["type"] != "device" or "since" in request.query_params:
+        return None
+    device: DevicePrincipal = auth["data"]
+    if device.device_type not in ("KitchenDisplay", "CustomerDisplay"):
+        return None
+    # the board's version goes with the board's orders, even when it lags the DB a moment
+    version = order_board.version(device.location_id)
+    if version is None:
+        version = await db.scalar(select(Location.orders_version).where(Location.id == device.location_id))
+        if version is None:
+            return None
+    return make_etag("orders", device.location_id, device.device_type, version)
+
+async def long_poll_display_orders(db: AsyncSession, device: DevicePrincipal, since: int, wait: float) -> dict:
+    """
+    Orders that changed at the device's location since version `since`, waiting up
+    to `wait` seconds for a change first. Changed orders the display no longer shows
+    come back in `removed`. `since=0`, or a cursor from before a DB restore, gets
+    everything the display shows with `full: true`.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    # subscribe before reading the version so a change in between still wakes us
+    with order_events.subscribe(device.location_id) as subscription:
+        while True:
+            version = await db.scalar(select(Location.orders_version).where(Location.id == device.location_id))
+            if version is None:
+                raise HTTPException(status_code=403, detail="Device not associated with a valid location")
+            remaining = deadline - loop.time()
+            if version != since or remaining <= 0:
+                break
+            # don't hold a pooled connection while parked
+            await db.close()
+            try:
+                await asyncio.wait_for(subscription.get(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    full = since == 0 or since > version
+    orders, removed = [], []
+    if full:
+        orders = (await db.scalars(select(Order).where(
+            (Order.location_id == device.location_id) & display_filter(device.device_type)
+        ))).all()
+    elif version != since:
+        for order in (await db.scalars(select(Order).where(
+            Order.location_id == device.location_id, Order.version > since
+        ))).all():
+            if display_shows(device.device_type, order.status):
+                orders.append(order)
+            else:
+                removed.append(order.id)
+    await db.close()
+
+    return {
+        "kitchen_orders": [
+            {"id": order.id, "location_id": order.location_id, "status": order.status, "version": order.version}
+            for order in orders
+        ],
+        "removed": removed,
+        "cursor": version,
+        "full": full,
+    }
+
+@router.get("/orders", dependencies=[Depends(conditional(display_orders_etag))])
+async def get_kitchen_orders(
+    db: AsyncSession = Depends(get_db),
+    auth=Depends(get_auth_context),
+    since: Optional[int] = Query(default=None, ge=0, description="orders_version cursor from the previous response, devices only"),
+    wait: float = Query(default=0, ge=0, le=30, description="seconds to hold the request open waiting for a change"),
+):
     if auth["type"] == "user":
         current_user: User = auth["data"]
         
-        org_user = db.query(OrganizationUser).filter(
+        org_user = await db.scalar(select(OrganizationUser).where(
             OrganizationUser.user_id == current_user.id
-        ).first()
+        ))
         if not org_user:
             raise HTTPException(status_code=403, detail="User not authorized")
 
-        orders = db.query(Order).filter(Order.location_id.in_(
-            db.query(Location.id).filter(Location.organization_id == org_user.organization_id)
-        )).all()
+        orders = (await db.scalars(select(Order).where(Order.location_id.in_(
+            select(Location.id).where(Location.organization_id == org_user.organization_id)
+        )))).all()
 
         order_list = [{"id": order.id, "location_id": order.location_id, "status": order.status} for order in orders]
 
         return {"kitchen_orders": order_list}
     if auth["type"] == "device":
-        device: Device = auth["data"]
-        
-            
-        location = db.query(Location).filter(Location.id == device.location_id).first()
-        if not location:
-            raise HTTPException(status_code=403, detail="Device not associated with a valid location")
-        if device.device_type == "KitchenDisplay":
-            orders = db.query(Order).filter(
-                (Order.location_id == location.id) & (Order.status == "preparing")
-            ).all()
-        elif device.device_type == "CustomerDisplay":
-            orders = db.query(Order).filter(
-                (Order.location_id == location.id) & (Order.status != "open")
-            ).all()
-        else:
+        device: DevicePrincipal = auth["data"]
+        if device.device_type not in ("KitchenDisplay", "CustomerDisplay"):
             raise HTTPException(status_code=403, detail="Device type not allowed")
-        order_list = [{"id": order.id, "location_id": order.location_id, "status": order.status} for order in orders]
+
+        if since is not None:
+            return await long_poll_display_orders(db, device, since, wait)
+
+        # served from memory once the board is warm, no DB round trip on the poll path
+        orders = order_board.orders(device.location_id, lambda status: display_shows(device.device_type, status))
+        if orders is None:
+            location = await db.get(Location, device.location_id)
+            if not location:
+                raise HTTPException(status_code=403, detail="Device not associated with a valid location")
+            orders = [
+                {"id": order.id, "location_id": order.location_id, "status": order.status}
+                for order in (await db.scalars(select(Order).where(
+                    (Order.location_id == location.id) & display_filter(device.device_type)
+                ))).all()
+            ]
+        order_list = [{"id": order["id"], "location_id": order["location_id"], "status": order["status"]} for order in orders]
 
         return {"kitchen_orders": order_list}
     else:
         raise HTTPException(status_code=401, detail="Not authenticated as user")
 
+async def load_display_orders(db: AsyncSession, device: DevicePrincipal) -> list[dict]:
+    try:
+        orders = order_board.orders(device.location_id, lambda status: display_shows(device.device_type, status))
+        if orders is not None:
+            return orders
+
+        orders = (await db.scalars(select(Order).where(
+            (Order.location_id == device.location_id) & display_filter(device.device_type)
+        ))).all()
+        items = {}
+        if orders:
+            for item in (await db.scalars(select(OrderItem).where(OrderItem.order_id.in_([o.id for o in orders])))).all():
+                items.setdefault(item.order_id, []).append(item)
+        return [serialize_order(order, items.get(order.id, [])) for order in orders]
+    finally:
+        # streams are long lived, don't hold a pooled connection between snapshots. Authentication
+        # may have checked one out (device token cache miss) even when the board answers.
+        await db.close()
+
+# live feed for displays: a snapshot of what the display shows, then incremental order events
+@router.get("/orders/stream", response_class=EventSourceResponse)
+async def stream_display_orders(db: AsyncSession = Depends(get_db), device: DevicePrincipal = Depends(get_display_device)):
+    # subscribe before reading the snapshot so nothing committed in between is missed
+    with order_events.subscribe(device.location_id) as subscription:
+        orders = await load_display_orders(db, device)
+        visible = {order["id"] for order in orders}
+        yield ServerSentEvent(event="snapshot", data={"orders": orders})
+        loop = asyncio.get_running_loop()
+        next_heartbeat = loop.time() + DEVICE_STREAM_HEARTBEAT_SECONDS
+        while True:
+            try:
+                order_event = await asyncio.wait_for(subscription.get(), max(next_heartbeat - loop.time(), 0))
+            except asyncio.TimeoutError:
+                order_event = None
+            if loop.time() >= next_heartbeat:
+                # the stream authenticated once, keep the display from showing up as offline
+                device_heartbeats.record(device.id)
+                next_heartbeat = loop.time() + DEVICE_STREAM_HEARTBEAT_SECONDS
+            if order_event is None:
+                continue
+            if order_event is RESYNC:
+                # we fell behind and events were dropped, start over from the DB
+                orders = await load_display_orders(db, device)
+                visible = {order["id"] for order in orders}
+                yield ServerSentEvent(event="snapshot", data={"orders": orders})
+                continue
+            for update in display_updates(device.device_type, visible, order_event):
+                yield update
+
 # endpoint for devices to move order to 'ready' status
-@router.put("/orders/{order_id}/ready", dependencies=[Depends(EitherBearer)])
-async def mark_order_ready(order_id: int, db: Session = Depends(get_db), auth=Depends(EitherBearer)):
+@router.put("/orders/{order_id}/ready")
+async def mark_order_ready(order_id: int, db: AsyncSession = Depends(get_db), auth=Depends(get_auth_context)):
     if auth["type"] != "device":
         raise HTTPException(status_code=403, detail="Only devices can mark orders as ready")
 
-    device: Device = auth["data"]
+    device: DevicePrincipal = auth["data"]
     if device.device_type != "KitchenDisplay":
         raise HTTPException(status_code=403, detail="Device type not allowed")
-    location = db.query(Location).filter(Location.id == device.location_id).first()
+    location = await db.get(Location, device.location_id)
     if not location:
         raise HTTPException(status_code=403, detail="Device not associated with a valid location")
 
-    order = db.query(Order).filter(
+    order = await db.scalar(select(Order).where(
         (Order.id == order_id) & (Order.location_id == location.id)
-    ).first()
+    ))
     if not order:
         raise HTTPException(status_code=404, detail="Order not found for this location")
 
-    order.status = "ready"
-    db.commit()
-    db.refresh(order)
+    version = await bump_orders_version(db, location.id)
+    order = await lock_order(db, order)
+    order.version = version
+    old_status, order.status = order.status, "ready"
+    items = (await db.scalars(select(OrderItem).where(OrderItem.order_id == order.id))).all()
+    await record_status_change(db, order, old_status, items)
+    publish_after_commit(db, location.id, {"type": "order_status_changed", "order": serialize_order(order, items)})
+    await db.commit()
 
     return {"message": "Order marked as ready", "order": {"id": order.id, "status": order.status}}
\ No newline at end of file
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from fastapi.params import Depends
+
+from app.analytics import analytics_cache
+from app.auth.device_bearer import device_token_cache
+from app.database import pool_stats
+from app.events import device_events, order_events
+from app.heartbeats import device_heartbeats
+from app.licensing import license_service
+from app.menu_cache import menu_cache
+from app.order_board import order_board
+from app.dependencies import get_operator
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+# Per-process operational metrics. Every uvicorn worker keeps its own caches,
+# so scrape each worker (or pod) separately. Only OPERATOR_EMAILS may read them.
+@router.get("/metrics", dependencies=[Depends(get_operator)])
+async def get_metrics():
+    return {
+        "db_pool": pool_stats(),
+        "device_token_cache": device_token_cache.stats(),
+        "order_events": order_events.stats(),
+        "device_events": device_events.stats(),
+        "order_board": order_board.stats(),
+        "menu_cache": menu_cache.stats(),
+        "analytics_cache": analytics_cache.stats(),
+        "device_heartbeats": device_heartbeats.stats(),
+        "license_service": license_service.stats(),
+    }
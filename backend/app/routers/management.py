@@ -1,43 +1,100 @@
-from fastapi import APIRouter, Body, HTTPException, Request
+from datetime import date, datetime, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Body, HTTPException, Query, Request
 from fastapi.params import Depends
-from sqlalchemy import Date, cast
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth.device_bearer import EitherBearer
-from app.auth.auth_bearer import JWTBearer
 from app.dependencies import get_current_user, get_db
+from app.analytics import product_mix
+from app.menu_io import MEDIA_TYPES
+from app.order_export import export_orders
+from app.revenue import MAX_RANGE_DAYS, managed_locations, revenue_report
 from ..schema import CreateOrderSchema, UpdateOrderStatusSchema, AddOrderItemSchema
 from app.models import User, Device, Location, OrganizationUser, Order, OrderItem
 
 router = APIRouter(prefix="/management", tags=["management"])
 
+def date_range(start: Optional[date], end: Optional[date]) -> tuple[date, date]:
+    start = start or datetime.now(timezone.utc).date()
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' is before 'from'")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {MAX_RANGE_DAYS} days")
+    return start, end
+
 #endpoint to see todays revenue
-@router.get("/revenue/today", dependencies=[Depends(JWTBearer())])
-async def get_todays_revenue(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    org_user = db.query(OrganizationUser).filter(
-        OrganizationUser.user_id == current_user.id
-    ).first()
-    if not org_user:
+@router.get("/revenue/today")
+async def get_todays_revenue(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    locations = await managed_locations(db, current_user.id)
+    if not locations:
         raise HTTPException(status_code=403, detail="User not authorized")
 
-    from datetime import datetime, timedelta
+    today = datetime.now(timezone.utc).date()
+    rows = await revenue_report(db, locations, today, today, "location")
 
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
+    return {"date": today, "total_revenue": sum(row["revenue"] for row in rows)}
 
-    orders = db.query(Order).filter(
-        Order.location_id.in_(
-            db.query(Location.id).filter(Location.organization_id == org_user.organization_id)
-        ),
-        cast(Order.created_at, Date) == today_start.date(),  # Compare dates only
-        Order.status == "ready"
-    ).all()
-    
-    #no total amount for orders so we need to sum up order items
-    for order in orders:
-        order.total_amount = sum(item.quantity * item.price for item in db.query(OrderItem).filter(OrderItem.order_id == order.id).all())
+# revenue between two local dates (inclusive) across the caller's locations, in one GROUP BY
+@router.get("/revenue")
+async def get_revenue(
+    start: Optional[date] = Query(default=None, alias="from", description="first local day, defaults to today"),
+    end: Optional[date] = Query(default=None, alias="to", description="last local day, inclusive, defaults to from"),
+    group_by: Literal["location", "hour", "day", "product"] = Query(default="location"),
+    location_id: Optional[list[int]] = Query(default=None, description="only these locations"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    start, end = date_range(start, end)
+    locations = await managed_locations(db, current_user.id, location_id)
+    if not locations:
+        raise HTTPException(status_code=403, detail="User not authorized")
+    rows = await revenue_report(db, locations, start, end, group_by)
 
+    return {
+        "from": start,
+        "to": end,
+        "group_by": group_by,
+        "total_revenue": sum(row["revenue"] for row in rows),
+        "rows": rows,
+    }
 
-    total_revenue = sum(order.total_amount for order in orders)
+# top sellers, attach rates and average ticket per location and day part, see app.analytics
+@router.get("/analytics/product-mix")
+async def get_product_mix(
+    start: Optional[date] = Query(default=None, alias="from", description="first local day, defaults to today"),
+    end: Optional[date] = Query(default=None, alias="to", description="last local day, inclusive, defaults to from"),
+    location_id: Optional[list[int]] = Query(default=None, description="only these locations"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    start, end = date_range(start, end)
+    locations = await managed_locations(db, current_user.id, location_id)
+    if not locations:
+        raise HTTPException(status_code=403, detail="User not authorized")
+
+    return {"from": start, "to": end, "locations": await product_mix(db, locations, start, end)}
+
+# every order with its line items between two local dates (inclusive), streamed for accounting
+@router.get("/export/orders")
+async def export_order_history(
+    start: Optional[date] = Query(default=None, alias="from", description="first local day, defaults to today"),
+    end: Optional[date] = Query(default=None, alias="to", description="last local day, inclusive, defaults to from"),
+    fmt: Literal["csv", "ndjson"] = Query(default="csv", alias="format"),
+    location_id: Optional[list[int]] = Query(default=None, description="only these locations"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    start, end = date_range(start, end)
+    locations = await managed_locations(db, current_user.id, location_id)
+    if not locations:
+        raise HTTPException(status_code=403, detail="User not authorized")
 
-    return {"date": today_start.date(), "total_revenue": total_revenue}
\ No newline at end of file
+    return StreamingResponse(
+        export_orders(db, locations, start, end, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="orders-{start}-{end}.{fmt}"'},
+    )
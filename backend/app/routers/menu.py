@@ -1,28 +1,63 @@
-from fastapi import APIRouter, Body
+import json
+from typing import Literal
+
+from fastapi import APIRouter, Body, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.params import Depends
 from keystone import LicenseValidationError, LicenseValidator
 
-from app.auth.auth_bearer import JWTBearer
+from app.conditional import conditional, make_etag
 from app.dependencies import get_current_user
+from app.events import menu_events, publish_after_commit
+from app.menu_cache import menu_cache
+from app.menu_io import MEDIA_TYPES, MenuImport, MenuImportError, export_products, import_format, read_records
+from app.versions import bump_menu_version
 
 from ..schema import LocationSchema, OrganizationSchema, OrganizationUserSchema, CreateProductSchema
 from ..database import get_db
 from app.models import Location, Organization, OrganizationUser, Product, User, License
 
-from sqlalchemy.orm import Session
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/menu", tags=["menu"])
 
+
+async def get_member_location(location_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)) -> Optional[Location]:
+    """The location if the current user belongs to its organization, else None."""
+    return await db.scalar(
+        select(Location)
+        .join(OrganizationUser, OrganizationUser.organization_id == Location.organization_id)
+        .where(Location.id == location_id, OrganizationUser.user_id == current_user.id)
+    )
+
+async def menu_etag(location: Optional[Location] = Depends(get_member_location)) -> Optional[str]:
+    if location is None:
+        return None
+    return make_etag("menu", location.id, location.menu_version)
+
+async def menu_changed(db: AsyncSession, location_id: int) -> None:
+    """Bump the menu version, and have every worker drop its cached menu once the write commits."""
+    version = await bump_menu_version(db, location_id)
+    publish_after_commit(db, location_id, {"type": "menu_changed", "version": version}, bus=menu_events)
+
+async def build_menu(db: AsyncSession, location_id: int) -> bytes:
+    products = (await db.scalars(select(Product).where(Product.Location_id == location_id))).all()
+    product_list = [{"id": product.id, "name": product.name, "description": product.description, "price": product.price} for product in products]
+    return json.dumps({"menu": product_list}, separators=(",", ":")).encode()
+
 #CRUD operations for menu will go here
 
-@router.post("/", dependencies=[Depends(JWTBearer())])
-async def create_menu_product(db: Session = Depends(get_db), current_user: User = Depends(get_current_user), product_data: CreateProductSchema = Body(...)):
+@router.post("/")
+async def create_menu_product(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user), product_data: CreateProductSchema = Body(...)):
     # Implementation for creating a menu product
-    location = db.query(Location).filter(Location.id == product_data.location_id).first()
+    location = await db.get(Location, product_data.location_id)
     if not location:
         return {"error": "Location not found"}
 
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id).first()
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "User not authorized for this location"}
 
@@ -33,62 +68,105 @@ async def create_menu_product(db: Session = Depends(get_db), current_user: User
         price=product_data.price
     )
     db.add(new_product)
-    db.commit()
-    db.refresh(new_product)
+    await menu_changed(db, location.id)
+    await db.commit()
+    await db.refresh(new_product)
 
     return {"message": "Menu product created", "product_data": new_product}
 
 
-@router.get("/{location_id}", dependencies=[Depends(JWTBearer())])
-async def get_menu(location_id:int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/{location_id}", dependencies=[Depends(conditional(menu_etag))])
+async def get_menu(location_id:int, response: Response, db: AsyncSession = Depends(get_db), location: Optional[Location] = Depends(get_member_location)):
     # Implementation for retrieving menu products for a location
-    location = db.query(Location).filter(Location.id == location_id).first()
     if not location:
-        return {"error": "Location not found"}
-
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id).first()
-    if not org_user:
+        if not await db.get(Location, location_id):
+            return {"error": "Location not found"}
         return {"error": "User not authorized for this location"}
 
-    products = db.query(Product).filter(Product.Location_id == location.id).all()
-    product_list = [{"id": product.id, "name": product.name, "description": product.description, "price": product.price} for product in products]
-
-    return {"menu": product_list}
+    body = await menu_cache.get_or_build(location.id, location.menu_version, lambda: build_menu(db, location.id))
+    # a returned Response skips FastAPI's header merge, carry the ETag over by hand
+    return Response(content=body, media_type="application/json", headers=response.headers)
 
-@router.put("/{product_id}", dependencies=[Depends(JWTBearer())])
-async def update_menu_product(product_id:int, db: Session = Depends(get_db), current_user = Depends(get_current_user), product_data: CreateProductSchema = Body(...)):
+@router.put("/{product_id}")
+async def update_menu_product(product_id:int, db: AsyncSession = Depends(get_db), current_user = Depends(get_current_user), product_data: CreateProductSchema = Body(...)):
     # Implementation for updating a menu product
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         return {"error": "Product not found"}
 
-    location = db.query(Location).filter(Location.id == product.Location_id).first()
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id).first()
+    location = await db.get(Location, product.Location_id)
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "User not authorized to update this product"}
 
     product.name = product_data.name
     product.description = product_data.description
     product.price = product_data.price
+    await menu_changed(db, location.id)
 
-    db.commit()
-    db.refresh(product)
+    await db.commit()
+    await db.refresh(product)
 
     return {"message": "Menu product updated", "product_data": product}
 
-@router.delete("/{product_id}", dependencies=[Depends(JWTBearer())])
-async def delete_menu_product(product_id:int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/{product_id}")
+async def delete_menu_product(product_id:int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Implementation for deleting a menu product
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         return {"error": "Product not found"}
 
-    location = db.query(Location).filter(Location.id == product.Location_id).first()
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id).first()
+    location = await db.get(Location, product.Location_id)
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == location.organization_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "User not authorized to delete this product"}
 
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await menu_changed(db, location.id)
+    await db.commit()
 
-    return {"message": "Menu product deleted"}
\ No newline at end of file
+    return {"message": "Menu product deleted"}
+
+# bulk upsert for onboarding: streamed CSV (header row with name, price and optionally id, description) or NDJSON
+@router.post("/{location_id}/import")
+async def import_menu(location_id: int, request: Request, db: AsyncSession = Depends(get_db), location: Optional[Location] = Depends(get_member_location)):
+    if not location:
+        if not await db.get(Location, location_id):
+            return {"error": "Location not found"}
+        return {"error": "User not authorized for this location"}
+
+    fmt = import_format(request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson")
+
+    menu_import = MenuImport(db, location.id)
+    try:
+        async for row_number, record in read_records(request.stream(), fmt):
+            await menu_import.add(row_number, record)
+        await menu_import.flush()
+    except MenuImportError as exc:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
+    # last, so the location row isn't locked against order writes while the body uploads
+    await menu_changed(db, location.id)
+    await db.commit()
+
+    return {"message": "Menu imported", **menu_import.result()}
+
+@router.get("/{location_id}/export")
+async def export_menu(
+    location_id: int,
+    fmt: Literal["csv", "ndjson"] = Query(default="csv", alias="format"),
+    db: AsyncSession = Depends(get_db),
+    location: Optional[Location] = Depends(get_member_location),
+):
+    if not location:
+        if not await db.get(Location, location_id):
+            return {"error": "Location not found"}
+        return {"error": "User not authorized for this location"}
+
+    return StreamingResponse(
+        export_products(db, location.id, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="menu-{location.id}.{fmt}"'},
+    )
@@ -1,220 +1,314 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-
-from app.auth.device_bearer import EitherBearer
-from app.dependencies import get_db
-from ..schema import CreateOrderSchema, UpdateOrderStatusSchema, AddOrderItemSchema
-from app.models import User, Device, Location, OrganizationUser, Order, OrderItem
+from typing import Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.device_bearer import DevicePrincipal
+from app.dependencies import get_auth_context, get_db
+from app.events import publish_after_commit
+from app.idempotency import idempotency_scope, request_fingerprint, run_idempotent
+from app.order_totals import apply_item_delta
+from app.sales_rollup import record_item_change, record_status_change
+from app.stock import return_stock, take_stock
+from app.versions import bump_orders_version
+from ..schema import CreateOrderSchema, UpdateOrderStatusSchema, AddOrderItemSchema, UpdateOrderItemSchema
+from app.models import User, Location, OrganizationUser, Order, OrderItem, Product
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
 
-
-""" JWT_SECRET = config("secret")
-JWT_ALGORITHM = config("algorithm")
-
-async def EitherBearer(request: Request, db: Session = Depends(get_db)):
-    # JWT first
-    try:
-        print("Trying JWTBearer")
-        token: str = await JWTBearer()(request)
-        try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            user_id = payload.get("user_id")  # adjust depending on your JWT payload
-            if not user_id:
-                raise HTTPException(status_code=401, detail="Invalid JWT payload")
-        except jwt.PyJWTError:
-            raise HTTPException(status_code=401, detail="Invalid token")
-
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-
-        return {"type": "user", "data": user}
-
-    except HTTPException:
-        pass
-
-    # Device
-    try:
-        print("Trying DeviceBearer")
-        device: Device = await DeviceBearer()(request)
+async def get_order_location(db: AsyncSession, auth: dict, location_id: int) -> Location:
+    """Load the location an order is placed at and check the caller may take orders there."""
+    if auth["type"] == "device":
+        device: DevicePrincipal = auth["data"]
         if device.device_type != "POS":
             raise HTTPException(status_code=403, detail="Device type not allowed")
-        return {"type": "device", "data": device}
-    except HTTPException:
-        pass
-
-    raise HTTPException(status_code=401, detail="Not authenticated") """
-
+    location = await db.get(Location, location_id)
+    if not location:
+        raise HTTPException(status_code=404, detail="Location not found")
 
-@router.post("/")
-async def create_order(
-    auth=Depends(EitherBearer),
-    db: Session = Depends(get_db),
-    order_data: CreateOrderSchema = Body(...)
-):
     if auth["type"] == "user":
-        
         current_user: User = auth["data"]
-
-        location = db.query(Location).filter(Location.id == order_data.location_id).first()
-        if not location:
-            raise HTTPException(status_code=404, detail="Location not found")
-
-        org_user = db.query(OrganizationUser).filter(
+        org_user = await db.scalar(select(OrganizationUser).where(
             OrganizationUser.organization_id == location.organization_id,
             OrganizationUser.user_id == current_user.id
-        ).first()
+        ))
         if not org_user:
             raise HTTPException(status_code=403, detail="User not authorized for this location")
     elif auth["type"] == "device":
-        device: Device = auth["data"]
-        if device.device_type != "POS":
-            raise HTTPException(status_code=403, detail="Device type not allowed")
-        location = db.query(Location).filter(Location.id == order_data.location_id).first()
-        if not location:
-            raise HTTPException(status_code=404, detail="Location not found")
         if device.location_id != location.id:
             raise HTTPException(status_code=403, detail="Device not authorized for this location")
     else:
         raise HTTPException(status_code=403, detail="Not authorized")
-    new_order = Order(location_id=order_data.location_id, status="open")
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-    return {"message": "Order created", "order_id": new_order.id}
+    return location
 
 
-@router.get("/{order_id}")
-async def get_order(
-    order_id: int,
-    auth=Depends(EitherBearer),
-    db: Session = Depends(get_db)
-):
+async def get_authorized_order(db: AsyncSession, auth: dict, order_id: int) -> Order:
+    """Load an order the caller can see: users through their organizations, POS devices at their location."""
     if auth["type"] == "user":
         current_user: User = auth["data"]
-        org_user = db.query(OrganizationUser).filter(
-            OrganizationUser.organization_id == current_user.organization_id,
-            OrganizationUser.user_id == current_user.id
-        ).first()
-        if not org_user:
-            raise HTTPException(status_code=403, detail="User not authorized")
-
-        order = db.query(Order).filter(Order.id == order_id).first()
+        # membership is checked in the same query as the lookup
+        order = await db.scalar(
+            select(Order)
+            .join(Location, Location.id == Order.location_id)
+            .join(OrganizationUser, OrganizationUser.organization_id == Location.organization_id)
+            .where(Order.id == order_id, OrganizationUser.user_id == current_user.id)
+        )
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
-
-        return {"order": {"id": order.id, "location_id": order.location_id, "status": order.status}}
-
     elif auth["type"] == "device":
-        device: Device = auth["data"]
+        device: DevicePrincipal = auth["data"]
         if device.device_type != "POS":
             raise HTTPException(status_code=403, detail="Device type not allowed")
-        order = db.query(Order).filter(Order.id == order_id, Order.location_id == device.location_id).first()
+        order = await db.scalar(select(Order).where(Order.id == order_id, Order.location_id == device.location_id))
         if not order:
             raise HTTPException(status_code=404, detail="Order not found or device not allowed")
+    else:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return order
+
+
+async def lock_order(db: AsyncSession, order: Order) -> Order:
+    """Re-read the order after bump_orders_version, so its status is what concurrent writers left, not what we loaded."""
+    return await db.scalar(
+        select(Order).where(Order.id == order.id).with_for_update().execution_options(populate_existing=True)
+    )
+
 
-        return {"order": {"id": order.id, "location_id": order.location_id, "status": order.status}}
+def serialize_order(order: Order, items: list[OrderItem]) -> dict:
+    return {
+        "id": order.id,
+        "location_id": order.location_id,
+        "status": order.status,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "subtotal": order.subtotal,
+        "total_amount": order.total_amount,
+        "item_count": order.item_count,
+        "version": order.version,
+        "items": [serialize_item(item) for item in items],
+    }
+
+
+async def take_order_stock(db: AsyncSession, quantities: dict[int, int]) -> None:
+    """Take stock for order lines, after the location's version bump so every write path locks in the same order."""
+    short = await take_stock(db, quantities)
+    if short:
+        raise HTTPException(status_code=409, detail=f"Out of stock: {short}")
+
+
+def serialize_item(item: OrderItem) -> dict:
+    return {"id": item.id, "product_id": item.product_id, "quantity": item.quantity, "price": item.price}
+
+
+@router.post("/")
+async def create_order(
+    request: Request,
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db),
+    order_data: CreateOrderSchema = Body(...),
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
+):
+    async def handler():
+        location = await get_order_location(db, auth, order_data.location_id)
+
+        # price every line from this location's menu in one query
+        product_ids = {line.product_id for line in order_data.items}
+        prices = {}
+        if product_ids:
+            prices = dict((await db.execute(
+                select(Product.id, Product.price).where(Product.id.in_(product_ids), Product.Location_id == location.id)
+            )).all())
+        unknown = sorted(product_ids - prices.keys())
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Products not on this location's menu: {unknown}")
+
+        # order and items go in one transaction: flush for the order id, then a
+        # single multi-row INSERT for the lines
+        subtotal = sum(line.quantity * prices[line.product_id] for line in order_data.items)
+        new_order = Order(
+            location_id=location.id,
+            status="open",
+            subtotal=subtotal,
+            total_amount=subtotal,
+            item_count=sum(line.quantity for line in order_data.items),
+            version=await bump_orders_version(db, location.id),
+        )
+        db.add(new_order)
+        await db.flush()
+        items = []
+        if order_data.items:
+            items = (await db.scalars(insert(OrderItem).returning(OrderItem, sort_by_parameter_order=True), [
+                {"order_id": new_order.id, "product_id": line.product_id, "quantity": line.quantity, "price": prices[line.product_id]}
+                for line in order_data.items
+            ])).all()
+        quantities = {}
+        for line in order_data.items:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+        await take_order_stock(db, quantities)
+        order = serialize_order(new_order, items)
+        publish_after_commit(db, location.id, {"type": "order_created", "order": order})
+        return {"message": "Order created", "order_id": new_order.id, "order": order}
+
+    return await run_idempotent(
+        db, idempotency_scope(auth), idempotency_key,
+        request_fingerprint(request.method, request.url.path, order_data), handler,
+    )
+
+
+@router.get("/{order_id}")
+async def get_order(
+    order_id: int,
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db)
+):
+    order = await get_authorized_order(db, auth, order_id)
+    return {"order": {
+        "id": order.id,
+        "location_id": order.location_id,
+        "status": order.status,
+        "subtotal": order.subtotal,
+        "total_amount": order.total_amount,
+        "item_count": order.item_count,
+    }}
 
 
 @router.put("/{order_id}/status")
 async def update_order_status(
     order_id: int,
     status_data: UpdateOrderStatusSchema = Body(...),
-    auth=Depends(EitherBearer),
-    db: Session = Depends(get_db)
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db)
 ):
     if auth["type"] != "user":
         raise HTTPException(status_code=403, detail="Device cannot update orders")
-    current_user: User = auth["data"]
-
-    org_user = db.query(OrganizationUser).filter(
-        OrganizationUser.organization_id == current_user.organization_id,
-        OrganizationUser.user_id == current_user.id
-    ).first()
-    if not org_user:
-        raise HTTPException(status_code=403, detail="User not authorized")
-
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    order.status = status_data.status
-    db.commit()
-    db.refresh(order)
+    order = await get_authorized_order(db, auth, order_id)
+
+    version = await bump_orders_version(db, order.location_id)
+    order = await lock_order(db, order)
+    order.version = version
+    old_status, order.status = order.status, status_data.status
+    items = (await db.scalars(select(OrderItem).where(OrderItem.order_id == order.id))).all()
+    await record_status_change(db, order, old_status, items)
+    publish_after_commit(db, order.location_id, {"type": "order_status_changed", "order": serialize_order(order, items)})
+    await db.commit()
     return {"message": "Order status updated", "order": {"id": order.id, "status": order.status}}
 
 
 @router.post("/{order_id}/items")
 async def add_order_item(
     order_id: int,
+    request: Request,
     item_data: AddOrderItemSchema = Body(...),
-    auth=Depends(EitherBearer),
-    db: Session = Depends(get_db)
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
 ):
-    if auth["type"] == "user":
-        current_user: User = auth["data"]
-
-        org_user = db.query(OrganizationUser).filter(
-            OrganizationUser.organization_id == current_user.organization_id,
-            OrganizationUser.user_id == current_user.id
-        ).first()
-        if not org_user:
-            raise HTTPException(status_code=403, detail="User not authorized")
+    async def handler():
+        order = await get_authorized_order(db, auth, order_id)
+        price = await db.scalar(select(Product.price).where(
+            Product.id == item_data.product_id, Product.Location_id == order.location_id
+        ))
+        if price is None:
+            raise HTTPException(status_code=400, detail="Product not on this location's menu")
+
+        new_order_item = OrderItem(
+            order_id=order.id,
+            product_id=item_data.product_id,
+            quantity=item_data.quantity,
+            price=price
+        )
+        version = await bump_orders_version(db, order.location_id)
+        order = await lock_order(db, order)
+        await take_order_stock(db, {item_data.product_id: item_data.quantity})
+        db.add(new_order_item)
+        await db.flush()
+        totals = await apply_item_delta(db, order.id, item_data.quantity * price, item_data.quantity, version)
+        await record_item_change(db, order, item_data.product_id, item_data.quantity, item_data.quantity * price)
+        publish_after_commit(db, order.location_id, {
+            "type": "order_item_added", "order_id": order.id, "item": serialize_item(new_order_item), "totals": totals,
+        })
+        return {"message": "Order item added", "order_id": order.id, "item_id": new_order_item.id, **totals}
+
+    return await run_idempotent(
+        db, idempotency_scope(auth), idempotency_key,
+        request_fingerprint(request.method, request.url.path, item_data), handler,
+    )
 
-        order = db.query(Order).filter(Order.id == order_id).first()
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
-    elif auth["type"] == "device":
-        device: Device = auth["data"]
-        if device.device_type != "POS":
-            raise HTTPException(status_code=403, detail="Device type not allowed")
-        order = db.query(Order).filter(Order.id == order_id, Order.location_id == device.location_id).first()
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found or device not allowed")
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
 
-    new_order_item = OrderItem(
-        order_id=order.id,
-        product_id=item_data.product_id,
-        quantity=item_data.quantity,
-        price=item_data.price
+@router.patch("/{order_id}/items/{item_id}")
+async def update_order_item(
+    order_id: int,
+    item_id: int,
+    item_data: UpdateOrderItemSchema = Body(...),
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db)
+):
+    order = await get_authorized_order(db, auth, order_id)
+    version = await bump_orders_version(db, order.location_id)
+    order = await lock_order(db, order)
+    # read under the location lock, so the delta is against the quantity a concurrent PATCH left
+    item = await db.scalar(
+        select(OrderItem)
+        .where(OrderItem.id == item_id, OrderItem.order_id == order.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
     )
-    db.add(new_order_item)
-    db.commit()
-    db.refresh(new_order_item)
-    return {"message": "Order item added", "order_id": order.id}
+    if not item:
+        raise HTTPException(status_code=404, detail="Order item not found")
+
+    quantity_delta = item_data.quantity - item.quantity
+    if quantity_delta > 0:
+        await take_order_stock(db, {item.product_id: quantity_delta})
+    else:
+        await return_stock(db, {item.product_id: -quantity_delta})
+    item.quantity = item_data.quantity
+    await db.flush()
+    totals = await apply_item_delta(db, order.id, quantity_delta * item.price, quantity_delta, version)
+    await record_item_change(db, order, item.product_id, quantity_delta, quantity_delta * item.price)
+    publish_after_commit(db, order.location_id, {
+        "type": "order_item_updated", "order_id": order.id, "item": serialize_item(item), "totals": totals,
+    })
+    await db.commit()
+    return {"message": "Order item updated", "order_id": order.id, "item_id": item.id, **totals}
+
+
+@router.delete("/{order_id}/items/{item_id}")
+async def remove_order_item(
+    order_id: int,
+    item_id: int,
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db)
+):
+    order = await get_authorized_order(db, auth, order_id)
+    version = await bump_orders_version(db, order.location_id)
+    order = await lock_order(db, order)
+    removed = (await db.execute(
+        delete(OrderItem)
+        .where(OrderItem.id == item_id, OrderItem.order_id == order.id)
+        .returning(OrderItem.product_id, OrderItem.quantity, OrderItem.price)
+    )).one_or_none()
+    if not removed:
+        raise HTTPException(status_code=404, detail="Order item not found")
+
+    await return_stock(db, {removed.product_id: removed.quantity})
+    totals = await apply_item_delta(db, order.id, -removed.quantity * removed.price, -removed.quantity, version)
+    await record_item_change(db, order, removed.product_id, -removed.quantity, -removed.quantity * removed.price)
+    publish_after_commit(db, order.location_id, {
+        "type": "order_item_removed", "order_id": order.id, "item": {"id": item_id}, "totals": totals,
+    })
+    await db.commit()
+    return {"message": "Order item removed", "order_id": order.id, "item_id": item_id, **totals}
 
 
 @router.get("/{order_id}/items")
 async def get_order_items(
     order_id: int,
-    auth=Depends(EitherBearer),
-    db: Session = Depends(get_db)
+    auth=Depends(get_auth_context),
+    db: AsyncSession = Depends(get_db)
 ):
-    if auth["type"] == "user":
-        current_user: User = auth["data"]
-        org_user = db.query(OrganizationUser).filter(
-            OrganizationUser.organization_id == current_user.organization_id,
-            OrganizationUser.user_id == current_user.id
-        ).first()
-        if not org_user:
-            raise HTTPException(status_code=403, detail="User not authorized")
-
-        order = db.query(Order).filter(Order.id == order_id).first()
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
-
-    elif auth["type"] == "device":
-        device: Device = auth["data"]
-        if device.device_type != "POS":
-            raise HTTPException(status_code=403, detail="Device type not allowed")
-        order = db.query(Order).filter(Order.id == order_id, Order.location_id == device.location_id).first()
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found or device not allowed")
+    order = await get_authorized_order(db, auth, order_id)
 
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    order_items = (await db.scalars(select(OrderItem).where(OrderItem.order_id == order.id))).all()
     items_list = [{"id": item.id, "product_id": item.product_id, "quantity": item.quantity} for item in order_items]
     return {"order_id": order.id, "items": items_list}
@@ -1,20 +1,21 @@
 from fastapi import APIRouter, Body, Request
 from fastapi.params import Depends
-from keystone import LicenseValidationError, LicenseValidator
+from keystone import LicenseValidationError
 
-from app.auth.auth_bearer import JWTBearer
 from app.dependencies import get_current_user
+from app.licensing import LicenseUnavailable, license_service
 
 from ..schema import LocationSchema, OrganizationSchema, OrganizationUserSchema
 from ..database import get_db
 from app.models import Location, Organization, OrganizationUser, User, License
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/organization", tags=["organization"])
 
-@router.post("/create", dependencies=[Depends(JWTBearer())])
-async def create_organization(request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), organization: OrganizationSchema = Body(...)):
+@router.post("/create")
+async def create_organization(request: Request, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user), organization: OrganizationSchema = Body(...)):
     # debug: log incoming authorization header
     try:
         auth_header = request.headers.get('authorization')
@@ -26,8 +27,8 @@ async def create_organization(request: Request, db: Session = Depends(get_db), c
     )
 
     db.add(new_organization)
-    db.commit()
-    db.refresh(new_organization)
+    await db.commit()
+    await db.refresh(new_organization)
 
     new_organization_user = OrganizationUser(
         organization_id=new_organization.id,
@@ -37,32 +38,32 @@ async def create_organization(request: Request, db: Session = Depends(get_db), c
     )
 
     db.add(new_organization_user)
-    db.commit()
-    db.refresh(new_organization_user)
+    await db.commit()
+    await db.refresh(new_organization_user)
 
     return {"organization_id": new_organization.id, "name": new_organization.name}
 
-@router.get("/my", dependencies=[Depends(JWTBearer())])
-async def get_my_organizations(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    org_users = db.query(OrganizationUser).filter(OrganizationUser.user_id == current_user.id).all()
+@router.get("/my")
+async def get_my_organizations(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    org_users = (await db.scalars(select(OrganizationUser).where(OrganizationUser.user_id == current_user.id))).all()
     organizations = []
     for org_user in org_users:
-        organization = db.query(Organization).filter(Organization.id == org_user.organization_id).first()
+        organization = await db.get(Organization, org_user.organization_id)
         if organization:
             organizations.append({"organization_id": organization.id, "name": organization.name, "role": org_user.role, "status": org_user.status})
     return {"organizations": organizations}
 
-@router.get("/{org_id}", dependencies=[Depends(JWTBearer())])
-async def get_organization(org_id: int, db: Session = Depends(get_db)):
-    organization = db.query(Organization).filter(Organization.id == org_id).first()
+@router.get("/{org_id}", dependencies=[Depends(get_current_user)])
+async def get_organization(org_id: int, db: AsyncSession = Depends(get_db)):
+    organization = await db.get(Organization, org_id)
     if organization:
         return {"organization_id": organization.id, "name": organization.name, "created_at": organization.created_at}
     return {"error": "Organization not found"}
 
-@router.post("/{org_id}/add_location", dependencies=[Depends(JWTBearer())])
-async def add_location(org_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user), location: LocationSchema = Body(...)):
+@router.post("/{org_id}/add_location")
+async def add_location(org_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user), location: LocationSchema = Body(...)):
     # Check if current user is part of the organization
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id).first()
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "You are not a member of this organization"}
 
@@ -74,55 +75,53 @@ async def add_location(org_id: int, db: Session = Depends(get_db), current_user:
     )
 
     db.add(new_location)
-    db.commit()
-    db.refresh(new_location)
+    await db.commit()
+    await db.refresh(new_location)
 
     return {"location_id": new_location.id, "name": new_location.name}
 
-@router.get("/{org_id}/locations", dependencies=[Depends(JWTBearer())])
-async def get_organization_locations(org_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/{org_id}/locations")
+async def get_organization_locations(org_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Check if current user is part of the organization
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id).first()
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "You are not a member of this organization"}
 
-    locations = db.query(Location).filter(Location.organization_id == org_id).all()
+    locations = (await db.scalars(select(Location).where(Location.organization_id == org_id))).all()
     location_list = []
     for location in locations:
         location_list.append({"location_id": location.id, "name": location.name, "address": location.address, "timezone": location.timezone})
 
     return {"locations": location_list}
 
-@router.post("/{org_id}/{location_id}", dependencies=[Depends(JWTBearer())])
-async def set_location_license(org_id: int, location_id: int, license_key: str = Body(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.post("/{org_id}/{location_id}")
+async def set_location_license(org_id: int, location_id: int, license_key: str = Body(...), db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Check if current user is part of the organization
-    org_user = db.query(OrganizationUser).filter(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id).first()
+    org_user = await db.scalar(select(OrganizationUser).where(OrganizationUser.organization_id == org_id, OrganizationUser.user_id == current_user.id))
     if not org_user:
         return {"error": "You are not a member of this organization"}
 
-    location = db.query(Location).filter(Location.id == location_id, Location.organization_id == org_id).first()
+    location = await db.scalar(select(Location).where(Location.id == location_id, Location.organization_id == org_id))
     if not location:
         return {"error": "Location not found in this organization"}
 
-    validator = LicenseValidator()
     try:
-        info = validator.get_license_info(license_key)
-        
-        if not info:
-            print(f"License key '{license_key}' not found")
-            return
-        
+        info = await license_service.get(license_key)
     except LicenseValidationError as e:
-        print(f"Error: {e}")
-    if not info.is_valid or info.is_expired:
+        return {"error": f"License validation error: {str(e)}"}
+    except LicenseUnavailable:
+        return {"error": "License service unavailable, try again shortly"}
+    if not info:
+        return {"error": "License key not found"}
+    if not info.usable:
         return {"error": "Invalid or expired license key"}
     #check license validity and features and seats here
     new_license = License(
         location_id=location.id,
         license_key=license_key)
     db.add(new_license)
-    db.commit()
-    db.refresh(location)
+    await db.commit()
+    await db.refresh(location)
 
     return {"location_id": location.id, "name": location.name, "license_info": info}
 
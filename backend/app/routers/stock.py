@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Body, Depends, HTTPException
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.conditional import conditional, make_etag
+from app.dependencies import get_auth_context, get_current_user, get_db
+from app.routers.menu import menu_changed
+from app.routers.orders import get_order_location
+from app.stock import eighty_sixed
+from ..schema import SetStockSchema
+from app.models import Location, OrganizationUser, Product, StockItem, User
+
+router = APIRouter(prefix="/stock", tags=["stock"])
+
+
+async def get_stock_location(location_id: int, db: AsyncSession = Depends(get_db), auth=Depends(get_auth_context)) -> Location:
+    # whoever can take orders at the location can see what's run out
+    return await get_order_location(db, auth, location_id)
+
+async def eighty_six_etag(location: Location = Depends(get_stock_location)) -> str:
+    # orders take stock and bump orders_version, setting stock bumps menu_version
+    return make_etag("86", location.id, location.orders_version, location.menu_version)
+
+async def stock_levels(db: AsyncSession, location_id: int) -> list[dict]:
+    rows = (await db.execute(
+        select(Product.id, Product.name, StockItem.quantity)
+        .join(StockItem, StockItem.product_id == Product.id)
+        .where(Product.Location_id == location_id)
+        .order_by(Product.id)
+    )).all()
+    return [{"product_id": row.id, "name": row.name, "quantity": row.quantity} for row in rows]
+
+
+# the "86 list": tracked products that have run out, cheap to poll with If-None-Match
+@router.get("/{location_id}/86", dependencies=[Depends(conditional(eighty_six_etag))])
+async def get_eighty_sixed(db: AsyncSession = Depends(get_db), location: Location = Depends(get_stock_location)):
+    return {"location_id": location.id, "products": await eighty_sixed(db, location.id)}
+
+@router.get("/{location_id}")
+async def get_stock(location_id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    location = await get_order_location(db, {"type": "user", "data": current_user}, location_id)
+    return {"location_id": location.id, "items": await stock_levels(db, location.id)}
+
+@router.put("/{location_id}")
+async def set_stock(location_id: int, stock_data: SetStockSchema = Body(...), db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    location = await get_order_location(db, {"type": "user", "data": current_user}, location_id)
+
+    levels = {item.product_id: item.quantity for item in stock_data.items}
+    products = set((await db.scalars(
+        select(Product.id).where(Product.id.in_(levels), Product.Location_id == location.id)
+    )).all())
+    unknown = sorted(levels.keys() - products)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Products not on this location's menu: {unknown}")
+
+    tracked = set((await db.scalars(select(StockItem.product_id).where(StockItem.product_id.in_(levels)))).all())
+    untrack = [product_id for product_id, quantity in levels.items() if quantity is None and product_id in tracked]
+    updates = [{"product_id": product_id, "quantity": quantity} for product_id, quantity in levels.items() if quantity is not None and product_id in tracked]
+    inserts = [{"product_id": product_id, "quantity": quantity} for product_id, quantity in levels.items() if quantity is not None and product_id not in tracked]
+    # location row first, the same lock order as the order write paths
+    await menu_changed(db, location.id)
+    if untrack:
+        await db.execute(delete(StockItem).where(StockItem.product_id.in_(untrack)))
+    if updates:
+        # absolute levels from a count, stock taken by orders meanwhile is overwritten on purpose
+        stock_items = StockItem.__table__
+        await db.execute(
+            update(stock_items).where(stock_items.c.product_id == bindparam("b_product_id")).values(quantity=bindparam("b_quantity")),
+            [{"b_product_id": values["product_id"], "b_quantity": values["quantity"]} for values in updates],
+        )
+    if inserts:
+        await db.execute(insert(StockItem), inserts)
+    await db.commit()
+
+    return {"message": "Stock updated", "items": await stock_levels(db, location.id)}
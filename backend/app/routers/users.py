@@ -1,42 +1,62 @@
 from fastapi import APIRouter, Body
 from fastapi.params import Depends
 
-from app.auth.auth_bearer import JWTBearer
 from app.auth.auth_handler import sign_jwt
-from ..schema import UserSchema, UserLoginSchema
+from app.auth.passwords import hash_password, needs_rehash, verify_password
+from app.auth.refresh_tokens import hash_refresh_token, issue_refresh_token, revoke_token_family, rotate_refresh_token
+from ..schema import RefreshTokenSchema, UserSchema, UserLoginSchema
 from ..database import get_db
-from app.models import User
+from app.models import RefreshToken, User
 from ..dependencies import get_current_user
 
-from sqlalchemy.orm import Session
-
-import bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 @router.post("/signup")
-async def create_user(db: Session = Depends(get_db), user: UserSchema = Body(...)):
+async def create_user(db: AsyncSession = Depends(get_db), user: UserSchema = Body(...)):
     new_user = User(
     fullname=user.fullname,
     email=user.email,
-    password=bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())#user.password  # hash later
+    password=await hash_password(user.password)
     )
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return sign_jwt(new_user.id)
+    await db.flush()
+    refresh_token = issue_refresh_token(db, new_user.id)
+    await db.commit()
+    return sign_jwt(new_user.id, refresh_token)
 
 @router.post("/login")
-async def user_login(db: Session = Depends(get_db), user: UserLoginSchema = Body(...)):
+async def user_login(db: AsyncSession = Depends(get_db), user: UserLoginSchema = Body(...)):
     # check user in db
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user and bcrypt.checkpw(user.password.encode('utf-8'), db_user.password):
-        return sign_jwt(db_user.id)
+    db_user = await db.scalar(select(User).where(User.email == user.email))
+    if db_user and await verify_password(user.password, db_user.password):
+        # upgrade hashes made with an older BCRYPT_ROUNDS setting while we have the plaintext
+        if needs_rehash(db_user.password):
+            db_user.password = await hash_password(user.password)
+        refresh_token = issue_refresh_token(db, db_user.id)
+        await db.commit()
+        return sign_jwt(db_user.id, refresh_token)
     return {
         "error": "Wrong login details!"
     }
 
-@router.get("/me", dependencies=[Depends(JWTBearer())])
-async def read_users_me(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.post("/refresh")
+async def refresh_access_token(db: AsyncSession = Depends(get_db), body: RefreshTokenSchema = Body(...)):
+    # no password check here, just one indexed lookup by token hash
+    user_id, refresh_token = await rotate_refresh_token(db, body.refresh_token)
+    return sign_jwt(user_id, refresh_token)
+
+@router.post("/logout")
+async def user_logout(db: AsyncSession = Depends(get_db), body: RefreshTokenSchema = Body(...)):
+    stored = await db.scalar(select(RefreshToken).where(RefreshToken.token_hash == hash_refresh_token(body.refresh_token)))
+    if stored:
+        await revoke_token_family(db, stored.family_id)
+        await db.commit()
+    return {"message": "Logged out"}
+
+@router.get("/me")
+async def read_users_me(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     return {"id": current_user.id, "fullname": current_user.fullname, "email": current_user.email}#.fullname, "email": current_user.email}
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Hourly sales rollup behind the management reports.
+
+Every order that counts as revenue (REVENUE_STATUSES) adds to
+sales_rollup in the same transaction that changes it: once into the location's
+hour for the whole order (product_id 0) and once per product on it. Leaving the
+counted statuses subtracts it again, and item changes on a counted order apply
+their delta. Reports then read O(hours x products) rows instead of the orders.
+
+`python -m app.cli rebuild-sales-rollup` recomputes the table from the orders.
+"""
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, insert, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import DateTime
+
+from app.models import Order, OrderItem, SalesRollup
+
+
+# an order counts once it has been served, and stays counted once paid
+REVENUE_STATUSES = ("ready", "paid")
+ORDER_TOTALS = 0
+BUCKET_KEY = ("location_id", "hour_start", "product_id")
+
+
+class utc_hour(FunctionElement):
+    """A UTC timestamp truncated to its hour, stored the way hour_start() values are."""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(utc_hour, "postgresql")
+def _compile_pg(element, compiler, **kw):
+    # truncated on the UTC clock whatever the session's TimeZone is
+    return f"date_trunc('hour', {compiler.process(element.clauses, **kw)} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+@compiles(utc_hour)
+def _compile_default(element, compiler, **kw):
+    # matches SQLAlchemy's own SQLite datetime format so rebuilt and upserted keys compare equal
+    return f"strftime('%Y-%m-%d %H:00:00.000000', {compiler.process(element.clauses, **kw)})"
+
+
+def counted(status: Optional[str]) -> bool:
+    return status in REVENUE_STATUSES
+
+def hour_start(created_at: datetime) -> datetime:
+    if created_at.tzinfo is None:
+        # SQLite hands timestamps back naive, they are UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+async def add_to_rollup(db: AsyncSession, rows: Iterable[dict]) -> None:
+    """Add the counters in `rows` to their buckets, creating buckets as needed, in one upsert."""
+    merged: dict[tuple, dict] = {}
+    for row in rows:
+        key = tuple(row[column] for column in BUCKET_KEY)
+        bucket = merged.setdefault(key, {**dict(zip(BUCKET_KEY, key)), "order_count": 0, "quantity": 0, "revenue": 0})
+        for column in ("order_count", "quantity", "revenue"):
+            bucket[column] += row.get(column, 0)
+    if not merged:
+        return
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    # sorted, so concurrent upserts touch shared buckets in the same order
+    stmt = dialect_insert(SalesRollup).values([merged[key] for key in sorted(merged)])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=list(BUCKET_KEY),
+        set_={column: getattr(SalesRollup, column) + stmt.excluded[column] for column in ("order_count", "quantity", "revenue")},
+    ))
+
+def order_rows(order: Order, items: Iterable[OrderItem], sign: int = 1) -> list[dict]:
+    """An order's contribution to the rollup, negated with sign=-1."""
+    hour = hour_start(order.created_at)
+    rows = [{
+        "location_id": order.location_id, "hour_start": hour, "product_id": ORDER_TOTALS,
+        "order_count": sign, "quantity": sign * order.item_count, "revenue": sign * order.total_amount,
+    }]
+    for item in items:
+        rows.append({
+            "location_id": order.location_id, "hour_start": hour, "product_id": item.product_id,
+            "quantity": sign * item.quantity, "revenue": sign * item.quantity * item.price,
+        })
+    return rows
+
+async def record_status_change(db: AsyncSession, order: Order, old_status: Optional[str], items: Iterable[OrderItem]) -> None:
+    """Call after setting order.status, with every item of the order."""
+    if counted(old_status) == counted(order.status):
+        return
+    await add_to_rollup(db, order_rows(order, items, 1 if counted(order.status) else -1))
+
+async def record_item_change(db: AsyncSession, order: Order, product_id: int, quantity: int, amount: int) -> None:
+    """Call when lines of an order change by `quantity` units worth `amount`."""
+    if not counted(order.status) or not quantity:
+        return
+    hour = hour_start(order.created_at)
+    await add_to_rollup(db, [
+        {"location_id": order.location_id, "hour_start": hour, "product_id": ORDER_TOTALS, "quantity": quantity, "revenue": amount},
+        {"location_id": order.location_id, "hour_start": hour, "product_id": product_id, "quantity": quantity, "revenue": amount},
+    ])
+
+async def rebuild_sales_rollup(db: AsyncSession, location_ids: Optional[list[int]] = None) -> int:
+    """Recompute the rollup (for some locations, or all) from the orders and return the rows written. The caller commits."""
+    if db.bind.dialect.name == "postgresql":
+        # waits out transactions mid-upsert and holds new ones off until we commit, so none is counted twice
+        await db.execute(text("LOCK TABLE sales_rollup IN EXCLUSIVE MODE"))
+    scope = Order.status.in_(REVENUE_STATUSES)
+    clear = delete(SalesRollup)
+    if location_ids:
+        scope = scope & Order.location_id.in_(location_ids)
+        clear = clear.where(SalesRollup.location_id.in_(location_ids))
+    await db.execute(clear)
+
+    columns = ["location_id", "hour_start", "product_id", "order_count", "quantity", "revenue"]
+    hour = utc_hour(Order.created_at)
+    orders = await db.execute(insert(SalesRollup).from_select(columns, (
+        select(Order.location_id, hour, literal(ORDER_TOTALS), func.count(Order.id), func.sum(Order.item_count), func.sum(Order.total_amount))
+        .where(scope)
+        .group_by(Order.location_id, hour)
+    )))
+    products = await db.execute(insert(SalesRollup).from_select(columns, (
+        select(Order.location_id, hour, OrderItem.product_id, literal(0), func.sum(OrderItem.quantity), func.sum(OrderItem.quantity * OrderItem.price))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(scope)
+        .group_by(Order.location_id, hour, OrderItem.product_id)
+    )))
+    return orders.rowcount + products.rowcount
@@ -1,4 +1,7 @@
-from pydantic import BaseModel, Field, EmailStr
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from pydantic import BaseModel, Field, EmailStr, field_validator
 
 
 class PostSchema(BaseModel):
@@ -40,6 +43,16 @@ class UserLoginSchema(BaseModel):
             }
         }
 
+class RefreshTokenSchema(BaseModel):
+    refresh_token: str = Field(...)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "refresh_token": "3q2-7wX0l9cP1mYfVtq8Z6m1sNvYQ2aJ0u8rKp5dE4c"
+            }
+        }
+
 class OrganizationSchema(BaseModel):
     name: str = Field(...)
     address: str = Field(default="")
@@ -138,9 +151,55 @@ class CreateProductSchema(BaseModel):
                 }
         }
 
+class ImportProductRowSchema(BaseModel):
+    # rows with an id update that product, rows without one are matched by name
+    id: Optional[int] = Field(default=None)
+    name: str = Field(..., min_length=1)
+    description: Optional[str] = Field(default=None)
+    # Product.price is an integer column, fractional prices are a row error rather than silently truncated
+    price: int = Field(..., ge=0)
+
+    @field_validator("price", mode="before")
+    @classmethod
+    def whole_price(cls, value):
+        # CSV cells arrive as strings, read "2.0" as 2 and "2.5" like the number 2.5
+        if isinstance(value, str):
+            try:
+                value = Decimal(value.strip())
+            except InvalidOperation:
+                return value
+        if isinstance(value, (Decimal, float)) and Decimal(value).is_finite():
+            if value != int(value):
+                raise ValueError("price must be a whole number, got a fractional value")
+            return int(value)
+        return value
+
+class StockLevelSchema(BaseModel):
+    product_id: int = Field(...)
+    # None stops tracking the product, it can then always be ordered
+    quantity: Optional[int] = Field(default=None, ge=0)
+
+class SetStockSchema(BaseModel):
+    items: list[StockLevelSchema] = Field(..., max_length=1000)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "items": [
+                    {"product_id": 1, "quantity": 40},
+                    {"product_id": 2, "quantity": None}
+                ]
+            }
+        }
+
+class OrderLineSchema(BaseModel):
+    product_id: int = Field(...)
+    quantity: int = Field(default=1, gt=0)
+
 class CreateOrderSchema(BaseModel):
     location_id: int = Field(...)
-    items: list[dict] = Field(...)
+    # priced from the menu on the server, not by the client
+    items: list[OrderLineSchema] = Field(default_factory=list, max_length=200)
 
     class Config:
         json_schema_extra = {
@@ -165,14 +224,24 @@ class UpdateOrderStatusSchema(BaseModel):
 
 class AddOrderItemSchema(BaseModel):
     product_id: int = Field(...)
-    quantity: int = Field(...)
-    price: float = Field(...)
+    quantity: int = Field(..., gt=0)
+    # ignored, lines are priced from the menu like in CreateOrderSchema
+    price: Optional[float] = Field(default=None, deprecated=True)
 
     class Config:
         json_schema_extra = {
             "example": {
                 "product_id": 2,
-                "quantity": 3,
-                "price": 5.99
+                "quantity": 3
+            }
+        }
+
+class UpdateOrderItemSchema(BaseModel):
+    quantity: int = Field(..., gt=0)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "quantity": 2
             }
         }
@@ -0,0 +1,63 @@
+"""
+Stock levels for products that track them.
+
+A product is tracked once it has a stock_items row; products without one are
+never out of stock. Stock is taken with a single conditional UPDATE, so two
+terminals selling the last portion can't both succeed and nothing is read and
+written back in between. The row locks it takes are held only until the
+order's transaction commits a moment later.
+"""
+from sqlalchemy import case, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Product, StockItem
+
+
+def _per_product(quantities: dict[int, int]):
+    return case(quantities, value=StockItem.product_id)
+
+async def take_stock(db: AsyncSession, quantities: dict[int, int]) -> list[int]:
+    """
+    Take `quantities` (product_id -> count) from stock in one statement and return
+    the tracked products that don't have enough, in which case nothing usable was
+    taken and the caller must roll back.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return []
+    needed = _per_product(quantities)
+    taken = set((await db.scalars(
+        update(StockItem)
+        .where(StockItem.product_id.in_(quantities), StockItem.quantity >= needed)
+        .values(quantity=StockItem.quantity - needed)
+        .returning(StockItem.product_id)
+        .execution_options(synchronize_session=False)
+    )).all())
+    if len(taken) == len(quantities):
+        return []
+    # the rest are either short or not tracked at all
+    return sorted((await db.scalars(
+        select(StockItem.product_id).where(StockItem.product_id.in_(quantities.keys() - taken))
+    )).all())
+
+async def return_stock(db: AsyncSession, quantities: dict[int, int]) -> None:
+    """Put `quantities` back, for items taken off an order. Untracked products are skipped."""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    await db.execute(
+        update(StockItem)
+        .where(StockItem.product_id.in_(quantities))
+        .values(quantity=StockItem.quantity + _per_product(quantities))
+        .execution_options(synchronize_session=False)
+    )
+
+async def eighty_sixed(db: AsyncSession, location_id: int) -> list[dict]:
+    """Tracked products at the location that have run out."""
+    rows = (await db.execute(
+        select(Product.id, Product.name)
+        .join(StockItem, StockItem.product_id == Product.id)
+        .where(Product.Location_id == location_id, StockItem.quantity <= 0)
+        .order_by(Product.id)
+    )).all()
+    return [{"product_id": row.id, "name": row.name} for row in rows]
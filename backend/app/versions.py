@@ -0,0 +1,29 @@
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Location
+
+
+async def bump_orders_version(db: AsyncSession, location_id: int) -> int:
+    """
+    Advance the location's order change counter and return the new value. The
+    caller stamps it on the changed order and commits. Call it before touching
+    order rows so every write path locks the location row first.
+    """
+    return await db.scalar(
+        update(Location)
+        .where(Location.id == location_id)
+        .values(orders_version=Location.orders_version + 1)
+        .returning(Location.orders_version)
+        .execution_options(synchronize_session=False)
+    )
+
+async def bump_menu_version(db: AsyncSession, location_id: int) -> int:
+    """Advance the location's menu change counter, which invalidates cached menus and their ETags."""
+    return await db.scalar(
+        update(Location)
+        .where(Location.id == location_id)
+        .values(menu_version=Location.menu_version + 1)
+        .returning(Location.menu_version)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,114 @@
+"""
+Product-mix analytics over a synthetic year of order lines: the vectorized
+NumPy path in app.analytics vs the same metrics in plain Python loops over rows.
+
+Lines are generated directly as the columnar extract app.analytics reads from
+the database (location, order, product, quantity, price, epoch seconds), so
+this times the computation only. Baskets hold 1-6 lines drawn from a skewed
+product popularity, spread over a year and a few timezones. The Python baseline
+runs on the first --baseline-lines lines and is scaled up linearly, which
+flatters it (its dicts only grow from there).
+
+Run from backend/:  python -m benchmarks.bench_analytics [--lines 5000000] [--locations 20] [--products 150] [--baseline-lines 500000]
+"""
+import argparse
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timezone
+from itertools import combinations
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.analytics import DAY_PART_OF_HOUR, basket_metrics, local_hours
+
+ZONES = ("UTC", "Europe/London", "America/New_York", "America/Los_Angeles", "Asia/Kolkata")
+START, END = date(2025, 1, 1), date(2025, 12, 31)
+
+
+def synthetic_lines(n_lines: int, n_locations: int, n_products: int, seed: int = 7) -> tuple[dict, list]:
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 7, size=n_lines // 3)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), n_lines) + 1]
+    n_orders = len(sizes)
+    order_location = rng.integers(1, n_locations + 1, size=n_orders)
+    lower = int(datetime(2025, 1, 1, 12, tzinfo=timezone.utc).timestamp())
+    order_ts = lower + rng.integers(0, 364 * 86400, size=n_orders)
+
+    order_id = np.repeat(np.arange(1, n_orders + 1), sizes)[:n_lines]
+    location_id = order_location[order_id - 1]
+    # products are per location, a handful of bestsellers and a long tail
+    popularity = 1 / np.arange(1, n_products + 1)
+    product = rng.choice(n_products, size=len(order_id), p=popularity / popularity.sum())
+    lines = {
+        "location_id": location_id.astype(np.int32),
+        "order_id": order_id.astype(np.int32),
+        "product_id": ((location_id - 1) * n_products + product + 1).astype(np.int32),
+        "quantity": rng.integers(1, 4, size=len(order_id)).astype(np.int32),
+        "price": (100 + product * 25).astype(np.int32),
+        "ts": order_ts[order_id - 1].astype(np.int64),
+    }
+    locations = [SimpleNamespace(id=i, timezone=ZONES[i % len(ZONES)]) for i in range(1, n_locations + 1)]
+    return lines, locations
+
+
+def python_baseline(lines: dict, hours: np.ndarray, n: int) -> None:
+    """The same metrics the way a loop over ORM rows would compute them."""
+    rows = zip(*(lines[name][:n].tolist() for name in ("location_id", "order_id", "product_id", "quantity", "price")), DAY_PART_OF_HOUR[hours[:n]].tolist())
+    tickets = defaultdict(lambda: [0, set()])
+    sellers = defaultdict(Counter)
+    baskets = defaultdict(set)
+    for location_id, order_id, product_id, quantity, price, part in rows:
+        ticket = tickets[location_id, part]
+        ticket[0] += quantity * price
+        ticket[1].add(order_id)
+        sellers[location_id, part][product_id] += quantity
+        sellers[location_id, None][product_id] += quantity
+        baskets[location_id, order_id].add(product_id)
+    orders_with = defaultdict(Counter)
+    pairs = defaultdict(Counter)
+    for (location_id, _order_id), products in baskets.items():
+        orders_with[location_id].update(products)
+        pairs[location_id].update(combinations(sorted(products), 2))
+    {key: revenue / len(orders) for key, (revenue, orders) in tickets.items()}
+    {key: counter.most_common(10) for key, counter in sellers.items()}
+    {
+        location_id: sorted(((count, count / orders_with[location_id][a], a, b) for (a, b), count in counter.items()), reverse=True)[:10]
+        for location_id, counter in pairs.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=5_000_000)
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--products", type=int, default=150, help="per location")
+    parser.add_argument("--baseline-lines", type=int, default=500_000, help="0 to skip the Python baseline")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    lines, locations = synthetic_lines(args.lines, args.locations, args.products)
+    print(f"{len(lines['order_id']):,} lines, {int(lines['order_id'][-1]):,} orders, "
+          f"{args.locations} locations x {args.products} products (generated in {time.perf_counter() - started:.1f} s)")
+    print(f"extract arrays: {sum(column.nbytes for column in lines.values()) / 2**20:.0f} MiB")
+
+    started = time.perf_counter()
+    hours = local_hours(lines["location_id"], lines["ts"], locations, START, END)
+    hours_s = time.perf_counter() - started
+    started = time.perf_counter()
+    metrics = basket_metrics(lines, hours)
+    metrics_s = time.perf_counter() - started
+    print(f"{'numpy':<10}{'local hours s':>16}{hours_s:>8.2f}{'metrics s':>12}{metrics_s:>8.2f}{'total s':>10}{hours_s + metrics_s:>8.2f}")
+    assert len(metrics) == args.locations
+
+    if args.baseline_lines:
+        n = min(args.baseline_lines, len(lines["order_id"]))
+        started = time.perf_counter()
+        python_baseline(lines, hours, n)
+        elapsed = time.perf_counter() - started
+        scaled = elapsed * len(lines["order_id"]) / n
+        print(f"{'python':<10}{f'{n:,} lines s':>16}{elapsed:>8.2f}{'scaled s':>12}{scaled:>8.2f}{'speedup':>10}{scaled / (hours_s + metrics_s):>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Concurrent-request throughput of the old blocking Session pattern vs AsyncSession.
+
+Both apps serve the same query from inside an `async def` handler. The query
+calls a `sleep_ms()` SQL function registered on every SQLite connection, which
+stands in for the time a real query spends waiting on Postgres. The "sync" app
+uses a regular Session like the routers did before, which blocks the event loop
+for the duration of every query. The "async" app uses AsyncSession like the
+routers do now. While the query load runs, a trivial /ping endpoint is hit on a
+fixed schedule to show how long an unrelated request (e.g. another POS) waits.
+
+Run from backend/:  python -m benchmarks.bench_db_concurrency [--requests 200] [--concurrency 20] [--query-ms 20]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+SLOW_QUERY = text("SELECT sleep_ms(:ms)")
+
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+    return ms
+
+
+def build_sync_app(url: str, query_ms: int) -> FastAPI:
+    engine = create_engine(url, pool_size=20, connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(bind=engine)
+
+    @event.listens_for(engine, "connect")
+    def _register(dbapi_connection, _record):
+        dbapi_connection.create_function("sleep_ms", 1, _sleep_ms)
+
+    app = FastAPI()
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @app.get("/work")
+    async def work(db: Session = Depends(get_db)):
+        return {"slept_ms": db.execute(SLOW_QUERY, {"ms": query_ms}).scalar()}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def build_async_app(url: str, query_ms: int) -> FastAPI:
+    engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"), pool_size=20)
+    SessionLocal = async_sessionmaker(engine)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _register(dbapi_connection, _record):
+        dbapi_connection.run_async(lambda conn: conn.create_function("sleep_ms", 1, _sleep_ms))
+
+    app = FastAPI()
+
+    async def get_db():
+        async with SessionLocal() as db:
+            yield db
+
+    @app.get("/work")
+    async def work(db: AsyncSession = Depends(get_db)):
+        return {"slept_ms": (await db.execute(SLOW_QUERY, {"ms": query_ms})).scalar()}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+async def run_load(app: FastAPI, requests: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/work")  # warm up the pool
+
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                await client.get("/work")
+
+        ping_latencies = []
+
+        async def pinger(stop: asyncio.Event):
+            # latency is measured from when the ping was due, so time spent
+            # waiting for a blocked event loop to wake us up counts too
+            while not stop.is_set():
+                due = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+                await client.get("/ping")
+                ping_latencies.append(time.perf_counter() - due)
+
+        stop = asyncio.Event()
+        ping_task = asyncio.create_task(pinger(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ping_task
+
+    return {
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed,
+        "ping_p50_ms": statistics.median(ping_latencies) * 1000,
+        "ping_max_ms": max(ping_latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-ms", type=int, default=20, help="simulated database time per query")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_db_")
+    url = f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}"
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.query_ms} ms per query")
+    print(f"{'mode':<8}{'elapsed s':>12}{'req/s':>10}{'ping p50 ms':>14}{'ping max ms':>14}")
+    for mode, build in (("sync", build_sync_app), ("async", build_async_app)):
+        result = asyncio.run(run_load(build(url, args.query_ms), args.requests, args.concurrency))
+        print(
+            f"{mode:<8}{result['elapsed_s']:>12.2f}{result['throughput_rps']:>10.1f}"
+            f"{result['ping_p50_ms']:>14.1f}{result['ping_max_ms']:>14.1f}"
+        )
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,4 +8,5 @@ class LicenseValidator:
         class _Info:
             is_valid = True
             is_expired = False
+            features = {"pos_terminal": True, "kitchen_display": True, "customer_screen": True}
         return _Info()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import tempfile
 import shutil
@@ -6,13 +7,16 @@ import shutil
 os.environ.setdefault("db_url", "sqlite:///./test_db.db")
 os.environ.setdefault("secret", "testsecret")
 os.environ.setdefault("algorithm", "HS256")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")  # keep password hashing cheap in tests
 
 from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 import importlib
 
+from app import database
 from app.api import app
 from app.database import Base, get_db
 
@@ -29,21 +33,17 @@ def _create_temp_db():
     return tmpdir, engine, TestingSessionLocal
 
 
-def override_get_db_factory(TestingSessionLocal):
-    def _override_get_db():
-        db = TestingSessionLocal()
-        try:
+def override_get_db_factory(AsyncTestingSessionLocal):
+    async def _override_get_db():
+        async with AsyncTestingSessionLocal() as db:
             yield db
-        finally:
-            db.close()
     return _override_get_db
 
 
 @pytest.fixture(scope="module")
-def client(request):
-    # create temp DB and override dependency
+def session_factory(request):
+    # create temp DB shared by the client and by tests that need to seed rows directly
     tmpdir, engine, TestingSessionLocal = _create_temp_db()
-    app.dependency_overrides[get_db] = override_get_db_factory(TestingSessionLocal)
 
     # finalizer to guarantee teardown even if tests fail
     def _teardown():
@@ -56,6 +56,21 @@ def client(request):
                 pass
 
     request.addfinalizer(_teardown)
+    return TestingSessionLocal
+
+
+@pytest.fixture(scope="module")
+def client(session_factory):
+    # the app talks to the same sqlite file through aiosqlite, tests seed it through the sync session
+    async_engine = create_async_engine(session_factory.kw["bind"].url.set(drivername="sqlite+aiosqlite"))
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    app.dependency_overrides[get_db] = override_get_db_factory(AsyncTestingSessionLocal)
+    # background work (order board warm-up and reconcile) opens its own sessions, pool_stats() reads the engine
+    original_session_factory, original_engine = database.AsyncSessionLocal, database.async_engine
+    database.AsyncSessionLocal, database.async_engine = AsyncTestingSessionLocal, async_engine
 
     with TestClient(app) as c:
         yield c
+
+    database.AsyncSessionLocal, database.async_engine = original_session_factory, original_engine
+    asyncio.run(async_engine.dispose())
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+from app.analytics import analytics_cache
+from app.models import Location, Order, OrderItem, Organization, Product
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_product_mix(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Mix User", "email": "productmix@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "MixOrg"}, headers=headers).json()["organization_id"]
+
+    db = session_factory()
+    other_org = Organization(name="MixNotMine")
+    db.add(other_org)
+    db.flush()
+    cafe = Location(organization_id=org_id, name="Cafe", timezone="America/New_York")
+    elsewhere = Location(organization_id=other_org.id, name="Elsewhere", timezone="UTC")
+    db.add_all([cafe, elsewhere])
+    db.flush()
+    coffee = Product(Location_id=cafe.id, name="Coffee", description="", price=3)
+    muffin = Product(Location_id=cafe.id, name="Muffin", description="", price=4)
+    soup = Product(Location_id=cafe.id, name="Soup", description="", price=6)
+    db.add_all([coffee, muffin, soup])
+    db.flush()
+
+    def order(location, created_at, *lines, status="paid"):
+        o = Order(location_id=location.id, status=status, created_at=created_at)
+        db.add(o)
+        db.flush()
+        db.add_all([OrderItem(order_id=o.id, product_id=product.id, quantity=quantity, price=product.price) for product, quantity in lines])
+
+    # 12:00-14:00 UTC is breakfast in New York (UTC-4), 17:00 UTC is lunch
+    order(cafe, _utc(2026, 7, 1, 12), (coffee, 2), (muffin, 1))
+    order(cafe, _utc(2026, 7, 1, 13), (coffee, 1), (muffin, 1), (coffee, 1))
+    order(cafe, _utc(2026, 7, 1, 14), (coffee, 1))
+    order(cafe, _utc(2026, 7, 1, 17), (soup, 1), (coffee, 1))
+    order(cafe, _utc(2026, 7, 1, 18), (soup, 5), status="open")  # not sold
+    order(cafe, _utc(2026, 7, 2, 5), (soup, 1))  # 01:00 on July 2nd in New York
+    order(elsewhere, _utc(2026, 7, 1, 12), (coffee, 9))
+    db.commit()
+    cafe_id, ids = cafe.id, {"coffee": coffee.id, "muffin": muffin.id, "soup": soup.id}
+    db.close()
+    analytics_cache.clear()
+
+    r = client.get("/management/analytics/product-mix", params={"from": "2026-07-01"}, headers=headers)
+    assert r.status_code == 200
+    [mix] = r.json()["locations"]
+    assert (mix["location_id"], mix["orders"], mix["revenue"], mix["average_ticket"]) == (cafe_id, 4, 32, 8.0)
+    assert [(s["name"], s["quantity"], s["revenue"]) for s in mix["top_sellers"]] == [("Coffee", 6, 18), ("Muffin", 2, 8), ("Soup", 1, 6)]
+    assert [(p["day_part"], p["orders"], p["revenue"], p["average_ticket"]) for p in mix["day_parts"]] == [
+        ("breakfast", 3, 23, 7.67), ("lunch", 1, 9, 9.0),
+    ]
+    assert [s["name"] for s in mix["day_parts"][1]["top_sellers"]] == ["Soup", "Coffee"]  # same quantity, soup earned more
+    # muffins were always bought with coffee, coffee came with a muffin in 2 of its 4 orders
+    attach = {(a["name"], a["with_name"]): (a["orders"], a["attach_rate"]) for a in mix["attach"]}
+    assert attach == {
+        ("Coffee", "Muffin"): (2, 0.5), ("Muffin", "Coffee"): (2, 1.0),
+        ("Coffee", "Soup"): (1, 0.25), ("Soup", "Coffee"): (1, 1.0),
+    }
+    assert mix["attach"][0]["product_id"] == ids["muffin"]
+
+    # served from the cache the second time
+    hits = analytics_cache.hits
+    assert client.get("/management/analytics/product-mix", params={"from": "2026-07-01"}, headers=headers).json()["locations"] == [mix]
+    assert analytics_cache.hits == hits + 1
+
+    # a day without sales
+    [quiet] = client.get("/management/analytics/product-mix", params={"from": "2026-06-01"}, headers=headers).json()["locations"]
+    assert (quiet["orders"], quiet["average_ticket"], quiet["top_sellers"], quiet["attach"]) == (0, None, [], [])
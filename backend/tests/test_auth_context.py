@@ -0,0 +1,46 @@
+from app.auth.device_bearer import hash_device_token
+from app.models import Device
+
+
+def _signup_with_location(client, email):
+    r = client.post("/user/signup", json={"fullname": "Auth User", "email": email, "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "AuthOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "AuthLoc", "address": "1 Auth St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    return headers, location_id
+
+
+def test_user_and_device_tokens(client, session_factory):
+    headers, location_id = _signup_with_location(client, "auth@example.com")
+
+    r = client.get("/user/me", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["email"] == "auth@example.com"
+
+    db = session_factory()
+    db.add(Device(
+        location_id=location_id,
+        device_name="KDS 1",
+        device_status="paired",
+        device_type="KitchenDisplay",
+        pairing_code="AUTHKDS1",
+        device_token_hash=hash_device_token("dev_kitchen-token"),
+    ))
+    db.commit()
+    db.close()
+
+    # kitchen displays authenticate with their device token, no JWT involved
+    r2 = client.get("/displays/orders", headers={"Authorization": "Bearer dev_kitchen-token"})
+    assert r2.status_code == 200
+    assert r2.json() == {"kitchen_orders": []}
+
+    # device tokens are not accepted on user-only routes
+    r3 = client.get("/user/me", headers={"Authorization": "Bearer dev_kitchen-token"})
+    assert r3.status_code == 403
+
+
+def test_rejects_bad_tokens(client):
+    assert client.get("/user/me").status_code == 403
+    assert client.get("/user/me", headers={"Authorization": "Bearer not-a-jwt"}).status_code == 403
+    assert client.get("/displays/orders", headers={"Authorization": "Bearer dev_unknown"}).status_code == 401
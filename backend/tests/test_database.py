@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database
+from app.database import InstrumentedAsyncPool, pool_stats
+
+
+def test_pool_checkout_timeout_is_counted(tmp_path, monkeypatch):
+    # one connection and no overflow: a second checkout has to wait, and gives up after pool_timeout
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/pool.sqlite",
+        poolclass=InstrumentedAsyncPool, pool_size=1, max_overflow=0, pool_timeout=0.1,
+    )
+    monkeypatch.setattr(database, "async_engine", engine)
+
+    async def scenario():
+        before = pool_stats()
+        async with engine.connect() as held:
+            await held.execute(text("SELECT 1"))
+            assert pool_stats()["checked_out"] == 1
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+            during = pool_stats()
+        after = pool_stats()
+        await engine.dispose()
+        return before, during, after
+
+    before, during, after = asyncio.run(scenario())
+    assert (during["pool_size"], during["max_overflow"], during["overflow"]) == (1, 0, 0)
+    assert during["checked_out"] == 1 and during["timeouts"] == before["timeouts"] + 1
+    # the failed checkout waited out the timeout, and that wait is in the histogram
+    assert during["wait_seconds"]["count"] == before["wait_seconds"]["count"] + 2
+    assert during["wait_seconds"]["max"] >= 0.1
+    assert after["checked_out"] == 0 and after["checked_in"] == 1 and after["timeouts"] == during["timeouts"]
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import dependencies
+from app.events import MemoryBackend, OrderEventBus, device_events
+from app.heartbeats import device_heartbeats
+from app.models import Device
+
+
+def test_device_token_revocation(client, session_factory, monkeypatch):
+    r = client.post("/user/signup", json={"fullname": "Device Owner", "email": "devices@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "DeviceOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "DeviceLoc", "address": "1 Device St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    db = session_factory()
+    slot = Device(location_id=location_id, device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRKDS1")
+    db.add(slot)
+    db.commit()
+    device_id = slot.id
+    db.close()
+
+    r2 = client.post("/devices/pair", json={"pairing_code": "PAIRKDS1", "hardware_id": "HW-KDS-1"})
+    device_token = r2.json()["device_token"]
+    device_headers = {"Authorization": f"Bearer {device_token}"}
+
+    # only the hash is persisted
+    db = session_factory()
+    assert db.query(Device).filter(Device.id == device_id).first().device_token is None
+    db.close()
+
+    # first call misses the cache, second one is served from it
+    assert client.get("/displays/orders", headers=device_headers).status_code == 200
+    assert client.get("/displays/orders", headers=device_headers).status_code == 200
+    # metrics are for operators, not for anybody with an account
+    assert client.get("/internal/metrics", headers=headers).status_code == 403
+    assert client.get("/internal/metrics", headers=device_headers).status_code == 403
+    monkeypatch.setattr(dependencies, "OPERATOR_EMAILS", ["devices@example.com"])
+    stats = client.get("/internal/metrics", headers=headers).json()["device_token_cache"]
+    assert stats["hits"] >= 1
+
+    # re-pairing revokes the old token right away
+    r3 = client.post(f"/devices/{device_id}/reset-pairing", headers=headers)
+    new_code = r3.json()["pairing_code"]
+    assert client.get("/displays/orders", headers=device_headers).status_code == 401
+
+    r4 = client.post("/devices/pair", json={"pairing_code": new_code, "hardware_id": "HW-KDS-1"})
+    new_headers = {"Authorization": f"Bearer {r4.json()['device_token']}"}
+    assert client.get("/displays/orders", headers=new_headers).status_code == 200
+
+    # and so does decommissioning
+    r5 = client.post(f"/devices/{device_id}/decommission", headers=headers)
+    assert r5.json()["device_status"] == "decommissioned"
+    assert client.get("/displays/orders", headers=new_headers).status_code == 401
+
+
+def test_device_token_revocation_reaches_other_workers(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Worker Owner", "email": "workers@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "WorkerOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "WorkerLoc", "address": "1 Worker St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    db = session_factory()
+    slot = Device(location_id=location_id, device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRWRK1")
+    db.add(slot)
+    db.commit()
+    device_id = slot.id
+    db.close()
+    device_token = client.post("/devices/pair", json={"pairing_code": "PAIRWRK1", "hardware_id": "HW-WRK-1"}).json()["device_token"]
+    device_headers = {"Authorization": f"Bearer {device_token}"}
+    assert client.get("/displays/orders", headers=device_headers).status_code == 200
+
+    # another worker on the same channel decommissions the device: the DB row changes behind this
+    # worker's cache, which keeps accepting the token until the revocation arrives on device_events
+    other_worker = OrderEventBus(MemoryBackend(device_events.backend.broker))
+    client.portal.call(other_worker.start)
+    db = session_factory()
+    device = db.get(Device, device_id)
+    token_hash, device.device_status, device.device_token_hash = device.device_token_hash, "decommissioned", None
+    db.commit()
+    db.close()
+    assert client.get("/displays/orders", headers=device_headers).status_code == 200
+
+    other_worker.publish(location_id, {"type": "device_token_revoked", "token_hash": token_hash})
+    client.portal.call(other_worker.stop)
+    assert client.get("/displays/orders", headers=device_headers).status_code == 401
+
+
+def test_device_heartbeats(client, session_factory, monkeypatch):
+    r = client.post("/user/signup", json={"fullname": "Fleet Owner", "email": "fleet@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    # devices of every organization the user belongs to are listed
+    location_ids = []
+    for name in ("FleetOrgA", "FleetOrgB"):
+        org_id = client.post("/organization/create", json={"name": name}, headers=headers).json()["organization_id"]
+        location_payload = {"name": name + "Loc", "address": "1 Fleet St", "timezone": "UTC"}
+        location_ids.append(client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"])
+
+    db = session_factory()
+    db.add_all([
+        Device(location_id=location_ids[0], device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRFLT1"),
+        Device(location_id=location_ids[1], device_name="Till", device_status="unpaired", device_type="POS", pairing_code="PAIRFLT2"),
+    ])
+    db.commit()
+    db.close()
+    kds = client.post("/devices/pair", json={"pairing_code": "PAIRFLT1", "hardware_id": "HW-FLT-1"}).json()
+    kds_headers = {"Authorization": f"Bearer {kds['device_token']}"}
+
+    def fleet():
+        return {d["device_name"]: d for d in client.get("/devices/", headers=headers).json()["devices"]}
+
+    # pairing counts as activity, the never-paired till is offline
+    assert {name: d["online_status"] for name, d in fleet().items()} == {"KDS": "online", "Till": "offline"}
+
+    # a KDS that went quiet a while ago
+    client.portal.call(device_heartbeats.flush)
+    an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+    db = session_factory()
+    db.query(Device).filter(Device.id == kds["device_id"]).update({"last_active_at": an_hour_ago})
+    db.commit()
+    db.close()
+    assert fleet()["KDS"]["online_status"] == "offline"
+
+    # device requests are only recorded in memory...
+    writes = []
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("UPDATE DEVICES"):
+            writes.append(statement)
+    event.listen(Engine, "before_cursor_execute", _count)
+    try:
+        for _ in range(5):
+            assert client.post("/devices/heartbeat", headers=kds_headers).json()["device_id"] == kds["device_id"]
+        assert client.get("/displays/orders", headers=kds_headers).status_code == 200
+        assert writes == []
+        assert fleet()["KDS"]["online_status"] == "online"
+
+        # ...and written behind in one UPDATE
+        assert client.portal.call(device_heartbeats.flush) == 1
+        assert len(writes) == 1
+    finally:
+        event.remove(Engine, "before_cursor_execute", _count)
+    db = session_factory()
+    stored = db.query(Device).filter(Device.id == kds["device_id"]).one().last_active_at
+    db.close()
+    assert stored.replace(tzinfo=timezone.utc) > an_hour_ago + timedelta(minutes=59)
+    monkeypatch.setattr(dependencies, "OPERATOR_EMAILS", ["fleet@example.com"])
+    assert client.get("/internal/metrics", headers=headers).json()["device_heartbeats"]["pending"] == 0
+
+    assert client.post("/devices/heartbeat", headers=headers).status_code == 403
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from app import database
+from app.api import app
+from app.events import RESYNC, order_events
+from app.heartbeats import device_heartbeats
+from app.models import Device, Order
+from app.routers import displays
+from app.routers.displays import display_updates
+
+
+class SSEStream:
+    """Reads an SSE endpoint event by event, straight through the ASGI app (the test clients buffer whole bodies)."""
+
+    def __init__(self, path: str, headers: dict):
+        self.path, self.headers = path, headers
+        self._chunks: asyncio.Queue = asyncio.Queue()
+        self._disconnect = asyncio.Event()
+        self._buffer = ""
+
+    async def __aenter__(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": self.path, "raw_path": self.path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(key.lower().encode(), value.encode()) for key, value in self.headers.items()],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        self._task = asyncio.create_task(app(scope, self._receive, self._send))
+        start = await asyncio.wait_for(self._chunks.get(), 5)
+        self.status = start["status"]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._disconnect.set()
+        await asyncio.wait_for(asyncio.gather(self._task, return_exceptions=True), 5)
+
+    async def _receive(self):
+        await self._disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        await self._chunks.put(message)
+
+    async def next_event(self, timeout: float = 5) -> tuple[str, dict]:
+        while "\n\n" not in self._buffer:
+            message = await asyncio.wait_for(self._chunks.get(), timeout)
+            self._buffer += message.get("body", b"").decode()
+        block, self._buffer = self._buffer.split("\n\n", 1)
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if not fields:
+            # keep-alive comment
+            return await self.next_event(timeout)
+        return fields.get("event", "message"), json.loads(fields["data"])
+
+
+def _pair_display(client, session_factory, location_id, device_type, code):
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name=device_type, device_status="unpaired", device_type=device_type, pairing_code=code))
+    db.commit()
+    db.close()
+    paired = client.post("/devices/pair", json={"pairing_code": code, "hardware_id": "HW-" + code}).json()
+    return paired["device_id"], {"Authorization": f"Bearer {paired['device_token']}"}
+
+
+def test_display_updates_follow_the_filter():
+    visible = set()
+    created = {"type": "order_created", "order": {"id": 1, "status": "open"}}
+    preparing = {"type": "order_status_changed", "order": {"id": 1, "status": "preparing"}}
+    ready = {"type": "order_status_changed", "order": {"id": 1, "status": "ready"}}
+    item = {"type": "order_item_added", "order_id": 1, "item": {"id": 7}, "totals": {}}
+
+    assert display_updates("KitchenDisplay", visible, created) == []
+    assert display_updates("KitchenDisplay", visible, item) == []
+    assert [e.event for e in display_updates("KitchenDisplay", visible, preparing)] == ["order"]
+    assert [e.event for e in display_updates("KitchenDisplay", visible, item)] == ["order_item"]
+    assert [e.event for e in display_updates("KitchenDisplay", visible, ready)] == ["order_removed"]
+    assert visible == set()
+
+    # the customer display keeps showing the order once it leaves "open"
+    customer = set()
+    assert display_updates("CustomerDisplay", customer, preparing)[0].event == "order"
+    assert display_updates("CustomerDisplay", customer, ready)[0].event == "order"
+
+
+def test_order_writes_publish_events(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Display User", "email": "displays@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "DisplayOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "DisplayLoc", "address": "1 Display St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Fries", "description": "Fries", "price": 3}, headers=headers)
+    product_id = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name="POS", device_status="unpaired", device_type="POS", pairing_code="PAIRPOS9"))
+    db.commit()
+    db.close()
+    pos_token = client.post("/devices/pair", json={"pairing_code": "PAIRPOS9", "hardware_id": "HW-POS-9"}).json()["device_token"]
+
+    # the stream is for displays only
+    assert client.get("/displays/orders/stream", headers=headers).status_code == 403
+    assert client.get("/displays/orders/stream", headers={"Authorization": f"Bearer {pos_token}"}).status_code == 403
+
+    with order_events.subscribe(location_id) as queue:
+        order_id = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": product_id}]}, headers=headers).json()["order_id"]
+        client.post(f"/orders/{order_id}/items", json={"product_id": product_id, "quantity": 1}, headers=headers)
+        client.put(f"/orders/{order_id}/status", json={"status": "preparing"}, headers=headers)
+        # rejected writes publish nothing
+        client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": 9999}]}, headers=headers)
+
+        events = []
+        while (order_event := queue.get_nowait()) is not None:
+            events.append(order_event)
+
+    assert [e["type"] for e in events] == ["order_created", "order_item_added", "order_status_changed"]
+    assert events[2]["order"]["status"] == "preparing"
+    assert len(events[2]["order"]["items"]) == 2
+    assert order_events.subscriber_count() == 0
+
+
+def test_display_long_poll(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Poll User", "email": "poll@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "PollOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "PollLoc", "address": "1 Poll St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRPOLL"))
+    db.commit()
+    db.close()
+    kds = {"Authorization": "Bearer " + client.post("/devices/pair", json={"pairing_code": "PAIRPOLL", "hardware_id": "HW-POLL"}).json()["device_token"]}
+
+    first = client.post("/orders/", json={"location_id": location_id}, headers=headers).json()["order_id"]
+    client.put(f"/orders/{first}/status", json={"status": "preparing"}, headers=headers)
+
+    snapshot = client.get("/displays/orders?since=0", headers=kds).json()
+    assert snapshot["full"] and [o["id"] for o in snapshot["kitchen_orders"]] == [first]
+    cursor = snapshot["cursor"]
+
+    # nothing changed: an empty delta with the same cursor once the wait runs out
+    idle = client.get(f"/displays/orders?since={cursor}&wait=0.2", headers=kds).json()
+    assert (idle["kitchen_orders"], idle["removed"], idle["cursor"]) == ([], [], cursor)
+
+    # a parked request returns as soon as something changes
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        parked = pool.submit(client.get, f"/displays/orders?since={cursor}&wait=10", headers=kds)
+        time.sleep(0.3)
+        started = time.monotonic()
+        second = client.post("/orders/", json={"location_id": location_id}, headers=headers).json()["order_id"]
+        delta = parked.result().json()
+    assert time.monotonic() - started < 5
+    # the new order isn't preparing, so the kitchen is told to drop it
+    assert (delta["kitchen_orders"], delta["removed"]) == ([], [second])
+    assert delta["cursor"] > cursor
+
+    client.put(f"/orders/{second}/status", json={"status": "preparing"}, headers=headers)
+    client.put(f"/orders/{first}/status", json={"status": "ready"}, headers=headers)
+    delta2 = client.get(f"/displays/orders?since={delta['cursor']}", headers=kds).json()
+    assert [o["id"] for o in delta2["kitchen_orders"]] == [second]
+    assert delta2["removed"] == [first]
+    assert not delta2["full"]
+
+
+def test_display_stream_holds_no_connection(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Stream User", "email": "streampool@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "StreamPoolOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "StreamPoolLoc", "address": "1 Stream St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    # freshly paired, so authenticating the stream misses the device token cache and goes to the DB
+    _, kds = _pair_display(client, session_factory, location_id, "KitchenDisplay", "PAIRSTRM")
+
+    async def scenario():
+        async with SSEStream("/displays/orders/stream", kds) as stream:
+            assert stream.status == 200
+            assert (await stream.next_event())[0] == "snapshot"
+            return database.pool_stats()["checked_out"]
+
+    assert client.portal.call(scenario) == 0
+
+
+def test_display_stream_keeps_the_device_online(client, session_factory, monkeypatch):
+    r = client.post("/user/signup", json={"fullname": "Online User", "email": "online@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "OnlineOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "OnlineLoc", "address": "1 Online St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    device_id, kds = _pair_display(client, session_factory, location_id, "KitchenDisplay", "PAIRONLN")
+    monkeypatch.setattr(displays, "DEVICE_STREAM_HEARTBEAT_SECONDS", 0.05)
+
+    async def scenario():
+        async with SSEStream("/displays/orders/stream", kds) as stream:
+            await stream.next_event()
+            # what authenticating recorded is written, the open stream has to record on its own from here
+            await device_heartbeats.flush()
+            assert device_heartbeats.last_active_at(device_id, None) is None
+            await asyncio.sleep(0.2)
+            seen = device_heartbeats.last_active_at(device_id, None)
+        return seen
+
+    seen = client.portal.call(scenario)
+    assert seen is not None and device_heartbeats.status("paired", seen) == "online"
+
+
+def test_display_stream(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Live User", "email": "live@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "LiveOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "LiveLoc", "address": "1 Live St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Soup", "description": "Soup", "price": 4}, headers=headers)
+    product_id = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+    _, kds = _pair_display(client, session_factory, location_id, "KitchenDisplay", "PAIRLIVE")
+    first = client.post("/orders/", json={"location_id": location_id}, headers=headers).json()["order_id"]
+    client.put(f"/orders/{first}/status", json={"status": "preparing"}, headers=headers)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            async with SSEStream("/displays/orders/stream", kds) as stream:
+                event, data = await stream.next_event()
+                assert event == "snapshot" and [o["id"] for o in data["orders"]] == [first]
+
+                # a new order is open, which the kitchen doesn't show: its order_created goes by
+                # without a message and the first one the display gets is the move to preparing
+                created = await http.post("/orders/", json={"location_id": location_id, "items": [{"product_id": product_id}]}, headers=headers)
+                second = created.json()["order_id"]
+                await http.put(f"/orders/{second}/status", json={"status": "preparing"}, headers=headers)
+                event, data = await stream.next_event()
+                assert event == "order" and data["type"] == "order_status_changed"
+                assert data["order"]["id"] == second and len(data["order"]["items"]) == 1
+
+                await http.post(f"/orders/{second}/items", json={"product_id": product_id, "quantity": 2}, headers=headers)
+                event, data = await stream.next_event()
+                assert event == "order_item" and data["order_id"] == second and data["item"]["quantity"] == 2
+
+                # a change that never made it onto the bus shows up once the display is told to resync
+                await http.put(f"/orders/{first}/status", json={"status": "ready"}, headers=headers)
+                assert (await stream.next_event())[0] == "order_removed"
+                db = session_factory()
+                db.get(Order, second).status = "ready"
+                db.commit()
+                db.close()
+                order_events.publish(location_id, RESYNC)
+                event, data = await stream.next_event()
+                assert event == "snapshot" and data["orders"] == []
+        return order_events.subscriber_count()
+
+    assert client.portal.call(scenario) == 0
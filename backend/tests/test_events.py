@@ -0,0 +1,199 @@
+import asyncio
+import os
+
+import asyncpg
+import pytest
+
+from app.events import RESYNC, MemoryBackend, MemoryBroker, OrderEventBus, PostgresBackend
+
+
+ORDER_EVENTS_PG_URL = os.environ.get("ORDER_EVENTS_PG_URL")
+
+
+def _order(order_id, status):
+    return {"type": "order_status_changed", "order": {"id": order_id, "status": status}}
+
+def _item(order_id, item_id):
+    return {"type": "order_item_added", "order_id": order_id, "item": {"id": item_id}, "totals": {}}
+
+def _drain(subscription):
+    events = []
+    while (order_event := subscription.get_nowait()) is not None:
+        events.append(order_event)
+    return events
+
+
+def test_slow_subscribers_coalesce_then_resync():
+    async def scenario():
+        bus = OrderEventBus(queue_size=3)
+        await bus.start()
+        with bus.subscribe(1) as slow, bus.subscribe(2) as other:
+            bus.publish(1, _order(10, "open"))
+            bus.publish(1, _item(10, 1))
+            bus.publish(1, _order(11, "open"))
+            # full: the new snapshot of order 10 replaces both queued events for it
+            bus.publish(1, _order(10, "preparing"))
+            assert _drain(slow) == [_order(11, "open"), _order(10, "preparing")]
+
+            for order_id in range(20, 24):
+                bus.publish(1, _order(order_id, "open"))
+            # nothing to coalesce, the backlog is dropped and the subscriber resyncs
+            assert _drain(slow) == [RESYNC]
+            assert _drain(other) == []
+
+            stats = bus.stats()
+            assert (stats["coalesced"], stats["dropped"], stats["subscribers"]) == (2, 4, 2)
+        await bus.stop()
+        assert bus.subscriber_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_buses_on_a_shared_broker_fan_out():
+    # two workers sharing a channel, like PostgresBackend across pods
+    async def scenario():
+        broker = MemoryBroker()
+        worker_a, worker_b = OrderEventBus(MemoryBackend(broker)), OrderEventBus(MemoryBackend(broker))
+        await worker_a.start()
+        await worker_b.start()
+        with worker_b.subscribe(5) as subscription:
+            worker_a.publish(5, _order(1, "open"))
+            assert await asyncio.wait_for(subscription.get(), 1) == _order(1, "open")
+        await worker_a.stop()
+        await worker_b.stop()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not ORDER_EVENTS_PG_URL, reason="set ORDER_EVENTS_PG_URL to a Postgres DSN to run")
+def test_postgres_backend_fan_out():
+    async def scenario():
+        worker_a, worker_b = OrderEventBus(PostgresBackend(ORDER_EVENTS_PG_URL)), OrderEventBus(PostgresBackend(ORDER_EVENTS_PG_URL))
+        await worker_a.start()
+        await worker_b.start()
+        with worker_b.subscribe(5) as subscription:
+            worker_a.publish(5, _order(1, "open"))
+            worker_a.publish(5, {"type": "order_created", "order": {"id": 2, "status": "open", "note": "x" * 9000}})
+            assert await asyncio.wait_for(subscription.get(), 5) == _order(1, "open")
+            # too big for NOTIFY, subscribers are told to reload instead
+            assert await asyncio.wait_for(subscription.get(), 5) is RESYNC
+
+            # the listener's backend is killed: worker_b reconnects, resyncs and hears worker_a again
+            killer = await asyncpg.connect(ORDER_EVENTS_PG_URL)
+            await killer.execute("SELECT pg_terminate_backend($1)", worker_b.backend._listener.get_server_pid())
+            await killer.close()
+            assert await asyncio.wait_for(subscription.get(), 10) is RESYNC
+            assert worker_b.stats()["reconnects"] == 1
+            worker_a.publish(5, _order(3, "open"))
+            assert await asyncio.wait_for(subscription.get(), 5) == _order(3, "open")
+        await worker_a.stop()
+        await worker_b.stop()
+
+    asyncio.run(scenario())
+
+
+class FakePostgres:
+    """Just enough of asyncpg and a server for PostgresBackend: LISTEN/NOTIFY, dropped connections, refused connects."""
+
+    def __init__(self):
+        self.connections = []
+        self.refuse = 0
+
+    async def connect(self, dsn):
+        if self.refuse:
+            self.refuse -= 1
+            raise ConnectionRefusedError("server is restarting")
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def drop_all(self):
+        for connection in list(self.connections):
+            connection.lose()
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.channels = {}
+        self.termination_listeners = []
+        self.closed = False
+        self.hung = False
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    async def add_listener(self, channel, callback):
+        self.channels[channel] = callback
+
+    async def execute(self, query, *args):
+        if self.closed:
+            raise asyncpg.exceptions.ConnectionDoesNotExistError("connection was closed")
+        if self.hung:
+            await asyncio.Event().wait()
+        if query.startswith("SELECT pg_notify"):
+            channel, payload = args
+            for connection in self.server.connections:
+                if channel in connection.channels:
+                    connection.channels[channel](connection, 1, channel, payload)
+
+    def is_closed(self):
+        return self.closed
+
+    def lose(self):
+        self.closed = True
+        self.server.connections.remove(self)
+        for callback in list(self.termination_listeners):
+            callback(self)
+
+    async def close(self):
+        if not self.closed:
+            self.lose()
+
+    def terminate(self):
+        if not self.closed:
+            self.lose()
+
+
+def test_postgres_backend_reconnects_and_resyncs(monkeypatch):
+    server = FakePostgres()
+    monkeypatch.setattr(asyncpg, "connect", server.connect)
+
+    async def scenario():
+        backend = PostgresBackend("postgresql://fake", healthcheck_seconds=0.05, reconnect_min_seconds=0.01, reconnect_max_seconds=0.05)
+        worker_a, worker_b = OrderEventBus(PostgresBackend("postgresql://fake")), OrderEventBus(backend)
+        seen = []
+        worker_b.add_listener(lambda location_id, order_event: seen.append((location_id, order_event)))
+        await worker_a.start()
+        await worker_b.start()
+        with worker_b.subscribe(5) as subscription, worker_b.subscribe(6) as other:
+            worker_a.publish(5, _order(1, "open"))
+            assert await asyncio.wait_for(subscription.get(), 1) == _order(1, "open")
+
+            # the server goes away and refuses the first reconnect attempts
+            server.refuse = 4
+            server.drop_all()
+            # published while nobody is connected, held until worker_a is back
+            worker_a.publish(5, _order(2, "open"))
+            # every location of every worker resyncs, listeners get it for all locations at once
+            assert await asyncio.wait_for(subscription.get(), 2) is RESYNC
+            assert await asyncio.wait_for(other.get(), 2) is RESYNC
+            assert (None, RESYNC) in seen
+            assert await asyncio.wait_for(subscription.get(), 2) == _order(2, "open")
+            assert worker_a.stats()["reconnects"] == worker_b.stats()["reconnects"] == 1
+
+            worker_a.publish(6, _order(3, "open"))
+            assert await asyncio.wait_for(other.get(), 1) == _order(3, "open")
+
+            # a peer that stops answering without closing the socket fails the health check
+            backend._listener.hung = True
+            assert await asyncio.wait_for(other.get(), 2) is RESYNC
+            assert worker_b.stats()["reconnects"] == 2
+        await worker_a.stop()
+        await worker_b.stop()
+        assert server.connections == []
+
+    asyncio.run(scenario())
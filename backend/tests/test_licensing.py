@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+from keystone import LicenseValidationError
+
+from app.licensing import CircuitBreaker, LicenseService, LicenseUnavailable, license_service
+from app.models import License
+
+
+class FakeValidator:
+    """Stands in for Keystone: answers from a dict, or fails / hangs when told to."""
+
+    def __init__(self, licenses):
+        self.licenses = licenses
+        self.calls = []
+        self.failing = False
+        self.delay = 0
+
+    async def get_license_info(self, license_key):
+        self.calls.append(license_key)
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise ConnectionError("keystone is down")
+        if license_key == "MALFORMED":
+            raise LicenseValidationError("malformed key")
+        return self.licenses.get(license_key)
+
+
+class Info:
+    def __init__(self, features, is_valid=True, is_expired=False):
+        self.features, self.is_valid, self.is_expired = features, is_valid, is_expired
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _service(validator, clock, **kwargs):
+    return LicenseService(
+        validator=validator, ttl=60, negative_ttl=10, stale_seconds=3600, timeout=0.05,
+        breaker=CircuitBreaker(failures=2, reset_seconds=30, clock=clock), clock=clock, **kwargs,
+    )
+
+
+def test_license_cache_and_breaker():
+    clock = Clock()
+    validator = FakeValidator({"GOOD": Info({"pos_terminal": True})})
+    service = _service(validator, clock)
+
+    async def scenario():
+        # concurrent misses share one call, then the answer is cached
+        first, second = await asyncio.gather(service.get("GOOD"), service.get("GOOD"))
+        assert first.allows("pos_terminal") and not first.allows("kitchen_display")
+        assert await service.get("GOOD") is first
+        assert validator.calls == ["GOOD"]
+
+        # unknown keys are cached too, for the shorter negative TTL
+        assert await service.get("UNKNOWN") is None
+        assert await service.get("UNKNOWN") is None
+        assert validator.calls.count("UNKNOWN") == 1
+        clock.now += 11
+        assert await service.get("UNKNOWN") is None
+        assert validator.calls.count("UNKNOWN") == 2
+
+        # rejected keys are an answer, not an outage
+        with pytest.raises(LicenseValidationError):
+            await service.get("MALFORMED")
+        assert service.breaker.state == "closed"
+
+        # past the TTL the cached answer is served at once while it revalidates behind
+        clock.now += 60
+        validator.licenses["GOOD"] = Info({"pos_terminal": True, "kitchen_display": True})
+        assert not (await service.get("GOOD")).allows("kitchen_display")
+        await asyncio.sleep(0.01)
+        assert (await service.get("GOOD")).allows("kitchen_display")
+
+        # Keystone goes down (hangs past the timeout): stale answers keep coming from the cache
+        validator.delay = 1
+        clock.now += 61
+        started = time.monotonic()
+        assert (await service.get("GOOD")).allows("kitchen_display")
+        await asyncio.sleep(0.1)
+        with pytest.raises(LicenseUnavailable):
+            await service.get("NEW")
+        assert time.monotonic() - started < 0.5
+        assert service.breaker.state == "open"
+
+        # while open nobody waits on it at all
+        calls = len(validator.calls)
+        with pytest.raises(LicenseUnavailable):
+            await service.get("NEW")
+        assert (await service.get("GOOD")).allows("pos_terminal")
+        assert len(validator.calls) == calls
+
+        # after the reset period one trial call closes it again
+        validator.delay = 0
+        clock.now += 31
+        validator.licenses["NEW"] = Info({})
+        assert (await service.get("NEW")).usable
+        assert service.breaker.state == "closed"
+
+    asyncio.run(scenario())
+    stats = service.stats()
+    assert stats["breaker_opened"] == 1 and stats["rejected"] == 1 and stats["stale_hits"] == 3
+
+
+def test_device_registration_uses_the_license_service(client, session_factory, monkeypatch):
+    r = client.post("/user/signup", json={"fullname": "License Owner", "email": "licensing@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "LicenseOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "LicenseLoc", "address": "1 License St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    validator = FakeValidator({
+        "KEY-POS-ONLY": Info({"pos_terminal": True, "kitchen_display": False}),
+        "KEY-EXPIRED": Info({"pos_terminal": True}, is_expired=True),
+    })
+    monkeypatch.setattr(license_service, "validator", validator)
+    license_service.clear()
+
+    def register(device_type):
+        payload = {"location_id": location_id, "device_name": device_type, "device_type": device_type}
+        return client.post("/devices/register", json=payload, headers=headers).json()
+
+    assert register("POS") == {"error": "No license found for this location"}
+    assert client.post(f"/organization/{org_id}/{location_id}", json="KEY-EXPIRED", headers=headers).json() == {"error": "Invalid or expired license key"}
+    assert client.post(f"/organization/{org_id}/{location_id}", json="NO-SUCH-KEY", headers=headers).json() == {"error": "License key not found"}
+    r = client.post(f"/organization/{org_id}/{location_id}", json="KEY-POS-ONLY", headers=headers).json()
+    assert r["license_info"]["features"]["pos_terminal"] is True
+
+    # the license is found by its location and its features come from the cache
+    assert "pairing_code" in register("POS")
+    assert register("KitchenDisplay") == {"error": "License does not allow Kitchen Displays"}
+    assert register("POS")["device_name"] == "POS"
+    assert validator.calls.count("KEY-POS-ONLY") == 1
+
+    db = session_factory()
+    assert db.query(License).filter(License.location_id == location_id).one().license_key == "KEY-POS-ONLY"
+    db.close()
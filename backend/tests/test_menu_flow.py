@@ -1,3 +1,10 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.events import menu_events
+from app.menu_cache import MenuCache, menu_cache
+
+
 def test_menu_create_and_get(client):
     # signup and create org + location
     signup = {"fullname": "Menu User", "email": "menu@example.com", "password": "pass1234"}
@@ -25,4 +32,83 @@ def test_menu_create_and_get(client):
     assert r5.status_code == 200
     menu = r5.json()
     assert isinstance(menu.get("menu"), list)
-    assert any(item["name"] == "Coffee" for item in menu.get("menu"))
\ No newline at end of file
+    assert any(item["name"] == "Coffee" for item in menu.get("menu"))
+
+def test_menu_conditional_get(client):
+    r = client.post("/user/signup", json={"fullname": "Etag User", "email": "etag@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "EtagOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "EtagLoc", "address": "1 Etag St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Tea", "description": "Hot drink", "price": 2}, headers=headers)
+
+    first = client.get(f"/menu/{location_id}", headers=headers)
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    unchanged = client.get(f"/menu/{location_id}", headers={**headers, "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["ETag"] == etag
+
+    # any menu write moves the tag
+    product_id = first.json()["menu"][0]["id"]
+    client.put(f"/menu/{product_id}", json={"location_id": location_id, "name": "Tea", "description": "Hot drink", "price": 3}, headers=headers)
+    changed = client.get(f"/menu/{location_id}", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["menu"][0]["price"] == 3
+
+    # no tag for someone outside the organization, and no 304 either
+    other = client.post("/user/signup", json={"fullname": "Other", "email": "etag-other@example.com", "password": "pass1234"})
+    outsider = {"Authorization": f"Bearer {other.json()['access_token']}", "If-None-Match": changed.headers["ETag"]}
+    denied = client.get(f"/menu/{location_id}", headers=outsider)
+    assert denied.json() == {"error": "User not authorized for this location"}
+    assert "ETag" not in denied.headers
+
+
+def test_menu_cache(client):
+    r = client.post("/user/signup", json={"fullname": "Cache User", "email": "menucache@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "CacheOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "CacheLoc", "address": "1 Cache St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Soup", "description": "Warm", "price": 4}, headers=headers)
+
+    first = client.get(f"/menu/{location_id}", headers=headers).json()
+    rebuilds = menu_cache.rebuilds
+    statements = []
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", _count)
+    try:
+        assert client.get(f"/menu/{location_id}", headers=headers).json() == first
+    finally:
+        event.remove(Engine, "before_cursor_execute", _count)
+    # only the membership check, the products come from the cache
+    assert menu_cache.rebuilds == rebuilds
+    assert not any("FROM products" in statement for statement in statements)
+
+    # a write drops the cached menu on every worker, here the app's and a second cache on the same bus
+    other_worker = MenuCache()
+    other_worker.set(location_id, 1, b"{}")
+    menu_events.add_listener(other_worker.on_menu_event)
+    try:
+        client.post("/menu/", json={"location_id": location_id, "name": "Bread", "description": "Fresh", "price": 1}, headers=headers)
+    finally:
+        menu_events.remove_listener(other_worker.on_menu_event)
+    assert other_worker.stats()["size"] == 0
+    assert [item["name"] for item in client.get(f"/menu/{location_id}", headers=headers).json()["menu"]] == ["Soup", "Bread"]
+    assert menu_cache.rebuilds == rebuilds + 1
+
+
+def test_menu_cache_keeps_the_newest_version():
+    cache = MenuCache(maxsize=2)
+    cache.set(1, 2, b"new")
+    cache.set(1, 1, b"old")
+    assert cache.get(1, 2) == b"new"
+    assert cache.get(1, 1) is None
+    cache.set(2, 1, b"a")
+    cache.set(3, 1, b"b")
+    assert cache.get(1, 2) is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,84 @@
+import asyncio
+import csv
+import io
+import json
+
+from app.menu_io import read_records
+
+
+def _setup(client, email):
+    r = client.post("/user/signup", json={"fullname": "Import User", "email": email, "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "ImportOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "ImportLoc", "address": "1 Import St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    return headers, location_id
+
+
+def test_csv_records_span_chunks_and_quoted_newlines():
+    body = 'name,price,description\r\nTea,2,"hot\nand ""fresh"""\r\n\r\nCake,,sweet\n'.encode()
+
+    async def chunks():
+        for i in range(0, len(body), 5):
+            yield body[i:i + 5]
+
+    async def collect():
+        return [record async for record in read_records(chunks(), "csv")]
+
+    assert asyncio.run(collect()) == [
+        (1, {"name": "Tea", "price": "2", "description": 'hot\nand "fresh"'}),
+        (2, {"name": "Cake", "description": "sweet"}),
+    ]
+
+
+def test_menu_import_and_export(client):
+    headers, location_id = _setup(client, "import@example.com")
+    body = "name,price,description\nTea,2,Hot\nCake,abc,Sweet\nScone,3,\nTea,2.5,Hotter\nTea,5,Hotter\n"
+    r = client.post(f"/menu/{location_id}/import", content=body, headers={**headers, "Content-Type": "text/csv"})
+    result = r.json()
+    assert (result["inserted"], result["updated"], result["error_count"]) == (2, 0, 2)
+    assert [e["row"] for e in result["errors"]] == [2, 4]
+    # prices are whole numbers like the column they go into
+    assert all("price" in e["error"] for e in result["errors"]) and "fractional" in result["errors"][1]["error"]
+
+    menu = {item["name"]: item for item in client.get(f"/menu/{location_id}", headers=headers).json()["menu"]}
+    assert menu["Tea"]["price"] == 5 and menu["Tea"]["description"] == "Hotter"
+
+    # NDJSON upserts by id, or by name when there's no id
+    rows = [
+        {"id": menu["Scone"]["id"], "name": "Scone", "price": 4},
+        {"name": "Tea", "price": 3, "description": "Hot"},
+        {"id": 999999, "name": "Ghost", "price": 1},
+        "not an object",
+    ]
+    body = "\n".join(json.dumps(row) for row in rows) + "\n{broken\n"
+    r = client.post(f"/menu/{location_id}/import", content=body, headers={**headers, "Content-Type": "application/x-ndjson"})
+    result = r.json()
+    assert (result["inserted"], result["updated"], result["error_count"]) == (0, 2, 3)
+    assert [e["row"] for e in result["errors"]] == [4, 5, 3]
+
+    exported = client.get(f"/menu/{location_id}/export", headers=headers)
+    assert exported.headers["content-type"].startswith("text/csv")
+    assert list(csv.DictReader(io.StringIO(exported.text))) == [
+        {"id": str(menu["Tea"]["id"]), "name": "Tea", "description": "Hot", "price": "3"},
+        {"id": str(menu["Scone"]["id"]), "name": "Scone", "description": "", "price": "4"},
+    ]
+    lines = client.get(f"/menu/{location_id}/export?format=ndjson", headers=headers).text.splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["Tea", "Scone"]
+
+    assert client.post(f"/menu/{location_id}/import", content="x", headers={**headers, "Content-Type": "text/plain"}).status_code == 415
+    assert client.post(f"/menu/{location_id}/import", content="sku\n1\n", headers={**headers, "Content-Type": "text/csv"}).status_code == 400
+
+
+def test_menu_import_batches(client, monkeypatch):
+    monkeypatch.setattr("app.menu_io.MENU_IMPORT_BATCH_SIZE", 50)
+    monkeypatch.setattr("app.menu_io.MENU_EXPORT_BATCH_SIZE", 50)
+    headers, location_id = _setup(client, "import-batches@example.com")
+    body = "name,price\n" + "".join(f"Item {i},{i}\n" for i in range(1, 121)) + "Item 7,70\n"
+    result = client.post(f"/menu/{location_id}/import", content=body, headers={**headers, "Content-Type": "text/csv"}).json()
+    # the repeat of Item 7 lands in a later batch and updates the row inserted earlier
+    assert (result["inserted"], result["updated"], result["error_count"]) == (120, 1, 0)
+
+    lines = client.get(f"/menu/{location_id}/export?format=ndjson", headers=headers).text.splitlines()
+    assert len(lines) == 120
+    assert json.loads(lines[6]) == {"id": json.loads(lines[6])["id"], "name": "Item 7", "description": None, "price": 70}
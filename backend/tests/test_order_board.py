@@ -0,0 +1,80 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.models import Device, Order
+from app.order_board import OrderBoard, order_board
+
+
+def _order(order_id, status, items=()):
+    return {"id": order_id, "location_id": 1, "status": status, "subtotal": 0, "total_amount": 0, "item_count": 0, "items": list(items)}
+
+
+def test_board_applies_order_events():
+    board = OrderBoard()
+    board.ready = True
+    board.apply(1, {"type": "order_created", "order": _order(1, "open")})
+    board.apply(1, {"type": "order_item_added", "order_id": 1, "item": {"id": 5, "quantity": 2}, "totals": {"subtotal": 6, "item_count": 2}})
+    board.apply(1, {"type": "order_item_updated", "order_id": 1, "item": {"id": 5, "quantity": 1}, "totals": {"subtotal": 3, "item_count": 1}})
+    board.apply(1, {"type": "order_status_changed", "order": {**_order(2, "preparing")}})
+
+    [order] = board.orders(1, lambda status: status == "open")
+    assert order["items"] == [{"id": 5, "quantity": 1}]
+    assert (order["subtotal"], order["item_count"]) == (3, 1)
+    assert [o["id"] for o in board.orders(1, lambda status: True)] == [1, 2]
+
+    board.apply(1, {"type": "order_item_removed", "order_id": 1, "item": {"id": 5}, "totals": {"subtotal": 0, "item_count": 0}})
+    board.apply(1, {"type": "order_status_changed", "order": _order(2, "paid")})
+    assert [(o["id"], o["items"]) for o in board.orders(1, lambda status: True)] == [(1, [])]
+
+    # a location told to resync is served from the DB until the next reconcile
+    board.apply(1, {"type": "resync"})
+    assert board.orders(1, lambda status: True) is None
+    assert board.orders(2, lambda status: True) == []
+
+
+def test_displays_served_from_the_board(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Board User", "email": "board@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "BoardOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "BoardLoc", "address": "1 Board St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRBRD1"))
+    db.commit()
+    db.close()
+    kds = {"Authorization": "Bearer " + client.post("/devices/pair", json={"pairing_code": "PAIRBRD1", "hardware_id": "HW-BRD-1"}).json()["device_token"]}
+
+    assert order_board.ready
+    first = client.post("/orders/", json={"location_id": location_id}, headers=headers).json()["order_id"]
+    second = client.post("/orders/", json={"location_id": location_id}, headers=headers).json()["order_id"]
+    client.put(f"/orders/{first}/status", json={"status": "preparing"}, headers=headers)
+    client.put(f"/orders/{second}/status", json={"status": "preparing"}, headers=headers)
+    client.get("/displays/orders", headers=kds)  # caches the device token
+
+    statements = []
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", _count)
+    try:
+        response = client.get("/displays/orders", headers=kds)
+        # the ETag comes from the board too
+        assert client.get("/displays/orders", headers={**kds, "If-None-Match": response.headers["ETag"]}).status_code == 304
+    finally:
+        event.remove(Engine, "before_cursor_execute", _count)
+    assert [o["id"] for o in response.json()["kitchen_orders"]] == [first, second]
+    assert statements == []
+
+    client.put(f"/orders/{second}/status", json={"status": "ready"}, headers=headers)
+    changed = client.get("/displays/orders", headers={**kds, "If-None-Match": response.headers["ETag"]})
+    assert [o["id"] for o in changed.json()["kitchen_orders"]] == [first]
+    client.put(f"/orders/{second}/status", json={"status": "preparing"}, headers=headers)
+
+    # a write that bypassed the app is picked up by the next reconcile
+    db = session_factory()
+    db.get(Order, second).status = "paid"
+    db.commit()
+    db.close()
+    assert len(client.get("/displays/orders", headers=kds).json()["kitchen_orders"]) == 2
+    assert client.portal.call(order_board.reconcile) == 1
+    assert [o["id"] for o in client.get("/displays/orders", headers=kds).json()["kitchen_orders"]] == [first]
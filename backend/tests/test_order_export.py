@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from app import order_export
+from app.models import Location, Order, OrderItem, Organization, Product
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_order_export(client, session_factory, monkeypatch):
+    r = client.post("/user/signup", json={"fullname": "Export User", "email": "orderexport@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "ExportOrg"}, headers=headers).json()["organization_id"]
+
+    db = session_factory()
+    other_org = Organization(name="ExportNotMine")
+    db.add(other_org)
+    db.flush()
+    london = Location(organization_id=org_id, name="London", timezone="UTC")
+    new_york = Location(organization_id=org_id, name="New York", timezone="America/New_York")
+    elsewhere = Location(organization_id=other_org.id, name="Elsewhere", timezone="UTC")
+    db.add_all([london, new_york, elsewhere])
+    db.flush()
+    tea = Product(Location_id=london.id, name="Tea, black", description="", price=2)
+    cake = Product(Location_id=london.id, name="Cake", description="", price=5)
+    bagel = Product(Location_id=new_york.id, name="Bagel", description="", price=4)
+    db.add_all([tea, cake, bagel])
+    db.flush()
+
+    def order(location, created_at, *lines, status="paid"):
+        total = sum(quantity * product.price for product, quantity in lines)
+        o = Order(location_id=location.id, status=status, created_at=created_at,
+                  subtotal=total, total_amount=total, item_count=sum(quantity for _, quantity in lines))
+        db.add(o)
+        db.flush()
+        db.add_all([OrderItem(order_id=o.id, product_id=product.id, quantity=quantity, price=product.price) for product, quantity in lines])
+        return o
+
+    first = order(london, _utc(2026, 7, 1, 9), (tea, 2), (cake, 1))
+    empty = order(london, _utc(2026, 7, 1, 10), status="open")
+    order(london, _utc(2026, 7, 2, 9), (tea, 1))  # outside the range
+    # 01:00 UTC on July 2nd is still July 1st in New York
+    late = order(new_york, _utc(2026, 7, 2, 1), (bagel, 3))
+    order(elsewhere, _utc(2026, 7, 1, 12), (tea, 1))
+    db.commit()
+    london_id, new_york_id = london.id, new_york.id
+    first_id, empty_id, late_id = first.id, empty.id, late.id
+    db.close()
+
+    # tiny batches, so orders straddle the cursor's batches
+    monkeypatch.setattr(order_export, "ORDER_EXPORT_BATCH_SIZE", 1)
+    params = {"from": "2026-07-01", "to": "2026-07-01"}
+
+    r = client.get("/management/export/orders", params=params, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/csv")
+    assert r.headers["content-disposition"] == 'attachment; filename="orders-2026-07-01-2026-07-01.csv"'
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [(int(row["order_id"]), row["product_name"], row["line_total"]) for row in rows] == [
+        (first_id, "Tea, black", "4"), (first_id, "Cake", "5"), (empty_id, "", ""), (late_id, "Bagel", "12"),
+    ]
+    assert rows[0]["created_at"] == "2026-07-01T09:00:00+00:00"
+    assert rows[-1]["location_name"] == "New York"
+    assert rows[-1]["local_time"] == "2026-07-01T21:00:00"
+
+    r = client.get("/management/export/orders", params={**params, "format": "ndjson"}, headers=headers)
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    orders = [json.loads(line) for line in r.text.splitlines()]
+    assert [(o["order_id"], o["location_id"], o["total_amount"]) for o in orders] == [
+        (first_id, london_id, 9), (empty_id, london_id, 0), (late_id, new_york_id, 12),
+    ]
+    assert [item["product_name"] for item in orders[0]["items"]] == ["Tea, black", "Cake"]
+    assert orders[1]["items"] == []
+
+    only_new_york = client.get("/management/export/orders", params={**params, "format": "ndjson", "location_id": new_york_id}, headers=headers)
+    assert [json.loads(line)["order_id"] for line in only_new_york.text.splitlines()] == [late_id]
+
+    assert client.get("/management/export/orders", params={"from": "2026-07-02", "to": "2026-07-01"}, headers=headers).status_code == 400
+    r = client.post("/user/signup", json={"fullname": "Stranger", "email": "exportstranger@example.com", "password": "pass1234"})
+    stranger = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    assert client.get("/management/export/orders", params=params, headers=stranger).status_code == 403
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.idempotency import idempotency_cache
+from app.models import Order, OrderItem
+
+
+def test_create_order_with_items(client):
+    r = client.post("/user/signup", json={"fullname": "Order User", "email": "orders@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "OrderOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "OrderLoc", "address": "1 Order St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    for name, price in (("Latte", 4), ("Bagel", 3)):
+        client.post("/menu/", json={"location_id": location_id, "name": name, "description": name, "price": price}, headers=headers)
+    menu = {p["name"]: p["id"] for p in client.get(f"/menu/{location_id}", headers=headers).json()["menu"]}
+
+    statements = []
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", _count)
+    try:
+        r2 = client.post("/orders/", json={"location_id": location_id, "items": [
+            {"product_id": menu["Latte"], "quantity": 2},
+            {"product_id": menu["Bagel"]},
+        ]}, headers=headers)
+    finally:
+        event.remove(Engine, "before_cursor_execute", _count)
+    assert r2.status_code == 200
+    order = r2.json()["order"]
+    assert order["status"] == "open"
+    # prices come from the menu, not the client
+    assert [(i["quantity"], i["price"]) for i in order["items"]] == [(2, 4), (1, 3)]
+    assert (order["subtotal"], order["total_amount"], order["item_count"]) == (11, 11, 3)
+    # auth, location, membership, prices, location version bump, order insert, the items insert,
+    # one stock update and, as these products aren't tracked, the lookup that tells them from sold out ones.
+    # Items come back in request order: Postgres does that in one INSERT, SQLite (no sentinel to sort
+    # RETURNING by) one INSERT per line.
+    item_inserts = [statement for statement in statements if statement.startswith("INSERT INTO order_items")]
+    assert len(item_inserts) == 2
+    assert len(statements) <= 8 + len(item_inserts)
+
+    r3 = client.get(f"/orders/{order['id']}/items", headers=headers)
+    assert len(r3.json()["items"]) == 2
+
+    # a product from another location is rejected and nothing is written
+    r4 = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": 9999}]}, headers=headers)
+    assert r4.status_code == 400
+
+    # other users can't see the order
+    r5 = client.post("/user/signup", json={"fullname": "Other", "email": "other-orders@example.com", "password": "pass1234"})
+    other = {"Authorization": f"Bearer {r5.json()['access_token']}"}
+    assert client.get(f"/orders/{order['id']}", headers=other).status_code == 404
+
+
+def test_idempotent_order_writes(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Retry User", "email": "retry@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "RetryOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "RetryLoc", "address": "1 Retry St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Tea", "description": "Tea", "price": 2}, headers=headers)
+    product_id = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+
+    payload = {"location_id": location_id, "items": [{"product_id": product_id, "quantity": 1}]}
+    keyed = {**headers, "Idempotency-Key": "ticket-1"}
+
+    # concurrent retries of the same ticket collapse into one order
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda _: client.post("/orders/", json=payload, headers=keyed), range(4)))
+    assert {r.status_code for r in responses} == {200}
+    assert len({r.json()["order_id"] for r in responses}) == 1
+    assert sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses) == 3
+    order_id = responses[0].json()["order_id"]
+
+    db = session_factory()
+    assert db.query(Order).filter(Order.location_id == location_id).count() == 1
+    db.close()
+
+    # a later retry is replayed from the store, even after the in-process cache is gone
+    idempotency_cache.clear()
+    r2 = client.post("/orders/", json=payload, headers=keyed)
+    assert r2.headers["Idempotent-Replayed"] == "true"
+    assert r2.json() == responses[0].json()
+
+    # reusing the key for a different request is rejected
+    r3 = client.post("/orders/", json={**payload, "items": []}, headers=keyed)
+    assert r3.status_code == 422
+
+    item = {"product_id": product_id, "quantity": 1, "price": 2}
+    item_headers = {**headers, "Idempotency-Key": "line-1"}
+    first = client.post(f"/orders/{order_id}/items", json=item, headers=item_headers)
+    again = client.post(f"/orders/{order_id}/items", json=item, headers=item_headers)
+    assert first.json()["item_id"] == again.json()["item_id"]
+    assert len(client.get(f"/orders/{order_id}/items", headers=headers).json()["items"]) == 2
+
+
+def test_order_totals_follow_item_changes(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Totals User", "email": "totals@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "TotalsOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "TotalsLoc", "address": "1 Totals St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Soup", "description": "Soup", "price": 5}, headers=headers)
+    product_id = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+
+    order_id = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": product_id}]}, headers=headers).json()["order_id"]
+    # the client price is ignored, the menu price wins
+    added = client.post(f"/orders/{order_id}/items", json={"product_id": product_id, "quantity": 2, "price": 1}, headers=headers).json()
+    assert (added["subtotal"], added["item_count"]) == (15, 3)
+
+    updated = client.patch(f"/orders/{order_id}/items/{added['item_id']}", json={"quantity": 4}, headers=headers).json()
+    assert (updated["subtotal"], updated["total_amount"], updated["item_count"]) == (25, 25, 5)
+
+    removed = client.delete(f"/orders/{order_id}/items/{added['item_id']}", headers=headers).json()
+    assert (removed["subtotal"], removed["item_count"]) == (5, 1)
+    assert client.delete(f"/orders/{order_id}/items/{added['item_id']}", headers=headers).status_code == 404
+
+    order = client.get(f"/orders/{order_id}", headers=headers).json()["order"]
+    assert (order["subtotal"], order["total_amount"], order["item_count"]) == (5, 5, 1)
+
+    # revenue reads the stored totals
+    client.put(f"/orders/{order_id}/status", json={"status": "ready"}, headers=headers)
+    assert client.get("/management/revenue/today", headers=headers).json()["total_revenue"] == 5
+
+    db = session_factory()
+    stored = db.get(Order, order_id)
+    assert sum(item.quantity * item.price for item in db.query(OrderItem).filter(OrderItem.order_id == order_id)) == stored.subtotal
+    db.close()
@@ -0,0 +1,178 @@
+"""
+Query-plan regression tests for the hot access paths.
+
+Each statement below mirrors a query the routers run on every request. The test
+compiles it with literal values, asks the database for its plan and fails if any
+table is read with a full scan. The schema is built by the alembic migrations
+(what production runs, not create_all), seeded with a representative mix of rows
+(most orders paid, a few active per location) and ANALYZEd, so the planner
+decides on realistic statistics. Runs against a scratch sqlite file by default;
+set QUERY_PLAN_DB_URL to an empty scratch Postgres database to check the
+Postgres plans as well. Everything is rolled back afterwards.
+"""
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, insert, select, text
+
+from app.models import Device, License, Location, Order, OrderItem, Organization, OrganizationUser, Product, RefreshToken, SalesRollup, StockItem, User
+
+
+QUERY_PLAN_DB_URL = os.environ.get("QUERY_PLAN_DB_URL")
+
+_today = datetime(2025, 1, 1, tzinfo=timezone.utc)
+_org_locations = select(Location.id).where(Location.organization_id == 1)
+
+HOT_QUERIES = {
+    "kitchen display orders": select(Order).where(Order.location_id == 1, Order.status == "preparing"),
+    "customer display orders": select(Order).where(Order.location_id == 1, Order.status != "open"),
+    "org display orders": select(Order).where(Order.location_id.in_(_org_locations)),
+    "order by id for device": select(Order).where(Order.id == 1, Order.location_id == 1),
+    "order items": select(OrderItem).where(OrderItem.order_id == 1),
+    "menu products": select(Product).where(Product.Location_id == 1),
+    "menu import match": select(Product.id, Product.name).where(Product.Location_id == 1, Product.id.in_([1, 2]) | Product.name.in_(["Tea", "Cake"])),
+    "membership check": select(OrganizationUser).where(OrganizationUser.organization_id == 1, OrganizationUser.user_id == 1),
+    "user organizations": select(OrganizationUser).where(OrganizationUser.user_id == 1),
+    "org locations": select(Location).where(Location.organization_id == 1),
+    "device by token hash": select(Device).where(Device.device_token_hash == "ab" * 32, Device.device_status == "paired"),
+    "device by pairing code": select(Device).where(Device.pairing_code == "PAIR0001"),
+    "org devices": select(Device).where(Device.location_id.in_(_org_locations)),
+    "location license": select(License).where(License.location_id == 1),
+    "login": select(User).where(User.email == "someone@example.com"),
+    "refresh token": select(RefreshToken).where(RefreshToken.token_hash == "cd" * 32),
+    "display long-poll delta": select(Order).where(Order.location_id == 1, Order.version > 100),
+    "location orders version": select(Location.orders_version).where(Location.id == 1),
+    "order board active orders": select(Order).where(Order.status != "paid"),
+    "order board active items": select(OrderItem).where(OrderItem.order_id.in_(select(Order.id).where(Order.status != "paid"))),
+    "stock levels by product": select(StockItem).where(StockItem.product_id.in_([1, 2])),
+    "86 list": select(Product.id, Product.name).join(StockItem, StockItem.product_id == Product.id).where(Product.Location_id == 1, StockItem.quantity <= 0),
+    "revenue from the rollup": select(SalesRollup).where(
+        SalesRollup.location_id.in_([1, 2]),
+        SalesRollup.hour_start >= _today,
+        SalesRollup.hour_start < _today + timedelta(days=1),
+        SalesRollup.product_id == 0,
+    ),
+    "orders export range": select(Order, OrderItem)
+    .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+    .where(Order.location_id == 1, Order.created_at >= _today, Order.created_at < _today + timedelta(days=366)),
+    "revenue today": select(Order).where(
+        Order.location_id.in_(_org_locations),
+        Order.created_at >= _today,
+        Order.created_at < _today + timedelta(days=1),
+        Order.status == "ready",
+    ),
+}
+
+
+ALEMBIC_SCRIPTS = Path(__file__).resolve().parents[1] / "alembic"
+
+SEED_ORGANIZATIONS = 50
+SEED_LOCATIONS_PER_ORGANIZATION = 4
+SEED_PRODUCTS_PER_LOCATION = 40
+SEED_ORDERS = 20000
+SEED_USERS = 2000
+
+
+def _seed(conn) -> None:
+    rng = random.Random(8)
+    n_locations = SEED_ORGANIZATIONS * SEED_LOCATIONS_PER_ORGANIZATION
+    n_products = n_locations * SEED_PRODUCTS_PER_LOCATION
+    conn.execute(insert(User), [
+        {"id": i, "fullname": f"User {i}", "email": f"user{i}@example.com", "password": b"x"} for i in range(1, SEED_USERS + 1)
+    ])
+    conn.execute(insert(RefreshToken), [
+        {"user_id": rng.randint(1, SEED_USERS), "token_hash": f"{i:064x}", "family_id": f"{i // 3:032x}", "expires_at": 1_700_000_000 + i}
+        for i in range(1, 3 * SEED_USERS + 1)
+    ])
+    conn.execute(insert(Organization), [{"id": i, "name": f"Org {i}"} for i in range(1, SEED_ORGANIZATIONS + 1)])
+    conn.execute(insert(OrganizationUser), [
+        {"user_id": user_id, "organization_id": (user_id - 1) % SEED_ORGANIZATIONS + 1, "role": "staff", "status": "active"}
+        for user_id in range(1, SEED_USERS + 1)
+    ])
+    conn.execute(insert(Location), [
+        {"id": i, "organization_id": (i - 1) // SEED_LOCATIONS_PER_ORGANIZATION + 1, "name": f"Location {i}", "orders_version": 1000}
+        for i in range(1, n_locations + 1)
+    ])
+    conn.execute(insert(License), [{"location_id": i, "license_key": f"KEY-{i}"} for i in range(1, n_locations + 1)])
+    conn.execute(insert(Device), [
+        {
+            "location_id": (i - 1) // 5 + 1, "device_name": f"Device {i}", "device_status": "paired",
+            "device_type": ("POS", "KitchenDisplay", "CustomerDisplay")[i % 3], "pairing_code": f"PAIR{i:06d}",
+            "hardware_id": f"HW-{i}", "device_token_hash": f"{i:064x}",
+        }
+        for i in range(1, 5 * n_locations + 1)
+    ])
+    conn.execute(insert(Product), [
+        {"id": i, "Location_id": (i - 1) // SEED_PRODUCTS_PER_LOCATION + 1, "name": f"Product {i}", "price": rng.randint(100, 2000)}
+        for i in range(1, n_products + 1)
+    ])
+    conn.execute(insert(StockItem), [{"product_id": i, "quantity": rng.randint(0, 50)} for i in range(1, n_products + 1, 2)])
+
+    # a year of history, almost all of it paid
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    orders, items = [], []
+    for order_id in range(1, SEED_ORDERS + 1):
+        location_id = rng.randint(1, n_locations)
+        status = rng.choices(("paid", "ready", "preparing", "open"), weights=(95, 2, 2, 1))[0]
+        orders.append({
+            "id": order_id, "location_id": location_id, "status": status, "version": order_id,
+            "created_at": start + timedelta(seconds=rng.randint(0, 365 * 86400)),
+        })
+        first_product = (location_id - 1) * SEED_PRODUCTS_PER_LOCATION + 1
+        for product_id in rng.sample(range(first_product, first_product + SEED_PRODUCTS_PER_LOCATION), rng.randint(1, 4)):
+            items.append({"order_id": order_id, "product_id": product_id, "quantity": rng.randint(1, 3), "price": 500})
+    conn.execute(insert(Order), orders)
+    conn.execute(insert(OrderItem), items)
+    conn.execute(insert(SalesRollup), [
+        {"location_id": location_id, "hour_start": start + timedelta(hours=hour), "product_id": product_id, "order_count": 1, "quantity": 1, "revenue": 500}
+        for location_id in range(1, 21)
+        for hour in range(0, 24 * 60, 3)
+        for product_id in (0, (location_id - 1) * SEED_PRODUCTS_PER_LOCATION + 1)
+    ])
+
+
+@pytest.fixture(scope="module")
+def plan_conn():
+    tmpdir = None
+    url = QUERY_PLAN_DB_URL
+    if not url:
+        tmpdir = tempfile.TemporaryDirectory(prefix="query_plans_")
+        url = f"sqlite:///{tmpdir.name}/plans.sqlite"
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        # no ini file, so env.py leaves the test run's logging alone
+        config = Config()
+        config.set_main_option("script_location", str(ALEMBIC_SCRIPTS))
+        config.attributes["connection"] = conn
+        command.upgrade(config, "head")
+        _seed(conn)
+        conn.execute(text("ANALYZE"))
+        yield conn
+        conn.rollback()
+    engine.dispose()
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+def _full_scans(conn, sql: str) -> list[str]:
+    if conn.dialect.name == "postgresql":
+        # the seeded tables that hold a row or two per location are still cheaper to seq scan,
+        # we want to know if an index exists for them at all
+        conn.execute(text("SET enable_seqscan = off"))
+        plan = [row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql)]
+        return [line for line in plan if "Seq Scan" in line]
+    plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+    return [line for line in plan if line.startswith("SCAN") and "USING" not in line]
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(plan_conn, name):
+    sql = str(HOT_QUERIES[name].compile(dialect=plan_conn.dialect, compile_kwargs={"literal_binds": True}))
+    scans = _full_scans(plan_conn, sql)
+    assert not scans, f"{name} does a full table scan: {scans}\n{sql}"
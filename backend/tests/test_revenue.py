@@ -0,0 +1,252 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import httpx
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from app import database
+from app.api import app
+from app.models import Device, Location, Order, OrderItem, Organization, OrganizationUser, Product, SalesRollup, User
+from app.revenue import utc_bounds
+from app.sales_rollup import rebuild_sales_rollup
+
+
+def test_local_day_bounds():
+    # New York is UTC-4 in summer, UTC-5 in winter
+    assert utc_bounds("America/New_York", date(2026, 7, 1), date(2026, 7, 1)) == (
+        datetime(2026, 7, 1, 4, tzinfo=timezone.utc), datetime(2026, 7, 2, 4, tzinfo=timezone.utc),
+    )
+    assert utc_bounds("America/New_York", date(2026, 1, 1), date(2026, 1, 31))[1] == datetime(2026, 2, 1, 5, tzinfo=timezone.utc)
+    assert utc_bounds("Not/AZone", date(2026, 1, 1), date(2026, 1, 1))[0] == datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def _rebuild(client):
+    # orders seeded straight into the DB skip the rollup, as old orders did before it existed
+    async def rebuild():
+        async with database.AsyncSessionLocal() as db:
+            await rebuild_sales_rollup(db)
+            await db.commit()
+    client.portal.call(rebuild)
+
+
+def test_revenue_report(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Revenue User", "email": "revenue@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    first_org = client.post("/organization/create", json={"name": "RevenueOrg"}, headers=headers).json()["organization_id"]
+
+    db = session_factory()
+    user = db.query(User).filter_by(email="revenue@example.com").one()
+    # a second organization of the same user, and one of somebody else's
+    second_org, other_org = Organization(name="RevenueOrg2"), Organization(name="NotMine")
+    db.add_all([second_org, other_org])
+    db.flush()
+    db.add(OrganizationUser(organization_id=second_org.id, user_id=user.id, role="owner"))
+    utc = Location(organization_id=first_org, name="London", timezone="UTC")
+    new_york = Location(organization_id=second_org.id, name="New York", timezone="America/New_York")
+    elsewhere = Location(organization_id=other_org.id, name="Elsewhere", timezone="UTC")
+    db.add_all([utc, new_york, elsewhere])
+    db.flush()
+    coffee = Product(Location_id=utc.id, name="Coffee", description="", price=3)
+    bagel = Product(Location_id=new_york.id, name="Bagel", description="", price=4)
+    db.add_all([coffee, bagel])
+    db.flush()
+
+    def order(location, product, quantity, created_at, status="paid"):
+        o = Order(location_id=location.id, status=status, created_at=created_at,
+                  subtotal=quantity * product.price, total_amount=quantity * product.price, item_count=quantity)
+        db.add(o)
+        db.flush()
+        db.add(OrderItem(order_id=o.id, product_id=product.id, quantity=quantity, price=product.price))
+
+    order(utc, coffee, 1, _utc(2026, 7, 1, 9))
+    order(utc, coffee, 2, _utc(2026, 7, 1, 9, 30), status="ready")
+    order(utc, coffee, 5, _utc(2026, 7, 1, 10), status="open")  # not sold yet
+    order(utc, coffee, 1, _utc(2026, 7, 2, 0, 30))  # the next day in London
+    # 01:00 UTC on July 2nd is still July 1st, 21:00 in New York
+    order(new_york, bagel, 1, _utc(2026, 7, 2, 1))
+    order(new_york, bagel, 3, _utc(2026, 7, 1, 3))  # June 30th in New York
+    order(elsewhere, coffee, 10, _utc(2026, 7, 1, 12))
+    db.commit()
+    utc_id, new_york_id = utc.id, new_york.id
+    db.close()
+    _rebuild(client)
+
+    def revenue(**params):
+        return client.get("/management/revenue", params={"from": "2026-07-01", **params}, headers=headers).json()
+
+    by_location = revenue()
+    assert by_location["rows"] == [
+        {"location_id": utc_id, "name": "London", "revenue": 9, "orders": 2},
+        {"location_id": new_york_id, "name": "New York", "revenue": 4, "orders": 1},
+    ]
+    assert by_location["total_revenue"] == 13
+
+    assert [(row["location_id"], row["day"], row["revenue"]) for row in revenue(to="2026-07-02", group_by="day")["rows"]] == [
+        (utc_id, "2026-07-01", 9), (utc_id, "2026-07-02", 3), (new_york_id, "2026-07-01", 4),
+    ]
+    assert [(row["hour"], row["orders"]) for row in revenue(group_by="hour", location_id=[new_york_id])["rows"]] == [("2026-07-01T21:00", 1)]
+    assert [(row["name"], row["quantity"], row["revenue"]) for row in revenue(group_by="product")["rows"]] == [("Coffee", 3, 9), ("Bagel", 1, 4)]
+
+    assert client.get("/management/revenue", params={"from": "2026-07-02", "to": "2026-07-01"}, headers=headers).status_code == 400
+    assert client.get("/management/revenue", params={"group_by": "week"}, headers=headers).status_code == 422
+
+
+def test_revenue_query_budget(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Budget User", "email": "revenue-budget@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "BudgetOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "BudgetLoc", "address": "1 Budget St", "timezone": "Europe/Berlin"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    def statements_for(group_by):
+        statements = []
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(Engine, "before_cursor_execute", _count)
+        try:
+            assert client.get("/management/revenue", params={"from": "2026-03-01", "to": "2026-03-31", "group_by": group_by}, headers=headers).status_code == 200
+        finally:
+            event.remove(Engine, "before_cursor_execute", _count)
+        # the token's user lookup isn't part of the report
+        return [statement for statement in statements if not statement.lstrip().startswith("SELECT users.")]
+
+    def add_orders(count):
+        db = session_factory()
+        for i in range(count):
+            db.add(Order(location_id=location_id, status="paid", created_at=_utc(2026, 3, 1 + i % 28, i % 24), subtotal=1, total_amount=1, item_count=1))
+        db.commit()
+        db.close()
+        _rebuild(client)
+
+    add_orders(3)
+    few = {group_by: len(statements_for(group_by)) for group_by in ("location", "hour", "day", "product")}
+    add_orders(200)
+    many = {group_by: len(statements_for(group_by)) for group_by in ("location", "hour", "day", "product")}
+    # the caller's locations, then one aggregate, however many orders there are
+    assert few == many == {"location": 2, "hour": 2, "day": 2, "product": 2}
+    report = client.get("/management/revenue", params={"from": "2026-03-01", "to": "2026-03-31"}, headers=headers).json()
+    assert report["rows"][0]["orders"] == 203
+
+
+def test_rollup_follows_order_changes(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Rollup User", "email": "rollup@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "RollupOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "RollupLoc", "address": "1 Rollup St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    for name, price in (("Toast", 2), ("Juice", 3)):
+        client.post("/menu/", json={"location_id": location_id, "name": name, "description": name, "price": price}, headers=headers)
+    menu = {item["name"]: item["id"] for item in client.get(f"/menu/{location_id}", headers=headers).json()["menu"]}
+
+    def order(*lines):
+        return client.post("/orders/", json={"location_id": location_id, "items": [
+            {"product_id": menu[name], "quantity": quantity} for name, quantity in lines
+        ]}, headers=headers).json()["order_id"]
+
+    def status(order_id, new_status):
+        client.put(f"/orders/{order_id}/status", json={"status": new_status}, headers=headers)
+
+    def report(group_by="location"):
+        return client.get("/management/revenue", params={"group_by": group_by, "location_id": location_id}, headers=headers).json()["rows"]
+
+    def rollup_rows():
+        db = session_factory()
+        rows = sorted((row.hour_start, row.product_id, row.order_count, row.quantity, row.revenue)
+                      for row in db.query(SalesRollup).filter_by(location_id=location_id) if row.order_count or row.quantity)
+        db.close()
+        return rows
+
+    first, second, third = order(("Toast", 2)), order(("Juice", 1), ("Toast", 1)), order(("Juice", 4))
+    assert report() == []
+    status(first, "preparing")
+    status(first, "ready")
+    status(second, "ready")
+    status(second, "paid")  # still counted, not twice
+    status(third, "ready")
+    status(third, "preparing")  # back in the kitchen, not revenue any more
+    # lines changed on a sold order move its buckets too
+    client.post(f"/orders/{first}/items", json={"product_id": menu["Juice"], "quantity": 1}, headers=headers)
+
+    assert [(row["revenue"], row["orders"]) for row in report()] == [(12, 2)]
+    assert [(row["name"], row["quantity"], row["revenue"]) for row in report("product")] == [("Toast", 3, 6), ("Juice", 2, 6)]
+
+    # a rebuild from the orders lands on the same numbers
+    incremental = rollup_rows()
+    _rebuild(client)
+    assert rollup_rows() == incremental
+
+
+def test_off_the_hour_zones_read_the_orders(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Kolkata User", "email": "kolkata@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "KolkataOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "Kolkata", "address": "1 Park St", "timezone": "Asia/Kolkata"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+
+    db = session_factory()
+    # 18:45 UTC is 00:15 the next day in Kolkata, so the 18:00 UTC hour straddles two local days
+    for created_at in (_utc(2026, 5, 1, 18, 15), _utc(2026, 5, 1, 18, 45)):
+        db.add(Order(location_id=location_id, status="paid", created_at=created_at, subtotal=1, total_amount=1, item_count=1))
+    db.commit()
+    db.close()
+    _rebuild(client)
+
+    rows = client.get("/management/revenue", params={"from": "2026-05-01", "to": "2026-05-02", "group_by": "day"}, headers=headers).json()["rows"]
+    assert [(row["day"], row["orders"]) for row in rows] == [("2026-05-01", 1), ("2026-05-02", 1)]
+
+
+def test_racing_status_changes_count_once(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Race User", "email": "statusrace@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "RaceOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "RaceLoc", "address": "1 Race St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Wrap", "description": "Wrap", "price": 5}, headers=headers)
+    wrap = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name="KDS", device_status="unpaired", device_type="KitchenDisplay", pairing_code="PAIRRACE"))
+    db.commit()
+    db.close()
+    kds = {"Authorization": "Bearer " + client.post("/devices/pair", json={"pairing_code": "PAIRRACE", "hardware_id": "HW-RACE"}).json()["device_token"]}
+
+    def new_order(status):
+        order_id = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": wrap, "quantity": 2}]}, headers=headers).json()["order_id"]
+        if status != "open":
+            client.put(f"/orders/{order_id}/status", json={"status": status}, headers=headers)
+        return order_id
+
+    preparing = [new_order("preparing") for _ in range(3)]
+    open_orders = [new_order("open") for _ in range(3)]
+
+    async def race():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+            requests = []
+            for order_id in preparing:
+                # the kitchen marks it ready while the till takes payment
+                requests += [
+                    ac.put(f"/displays/orders/{order_id}/ready", headers=kds),
+                    ac.put(f"/orders/{order_id}/status", json={"status": "paid"}, headers=headers),
+                ]
+            for order_id in open_orders:
+                requests += [
+                    ac.post(f"/orders/{order_id}/items", json={"product_id": wrap, "quantity": 1}, headers=headers),
+                    ac.put(f"/orders/{order_id}/status", json={"status": "ready"}, headers=headers),
+                ]
+            return await asyncio.gather(*requests)
+
+    assert {r.status_code for r in client.portal.call(race)} == {200}
+
+    db = session_factory()
+    orders = db.query(Order).filter(Order.location_id == location_id).all()
+    counted, quantity, revenue = db.query(
+        func.sum(SalesRollup.order_count), func.sum(SalesRollup.quantity), func.sum(SalesRollup.revenue),
+    ).filter(SalesRollup.location_id == location_id, SalesRollup.product_id == 0).one()
+    db.close()
+    # every order is counted once, with every item it ended up with
+    assert counted == len(orders) == 6
+    assert (quantity, revenue) == (sum(o.item_count for o in orders), sum(o.total_amount for o in orders))
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+
+from app.api import app
+from app.models import Device
+
+
+def test_stock_is_taken_by_orders(client, session_factory):
+    r = client.post("/user/signup", json={"fullname": "Stock User", "email": "stock@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "StockOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "StockLoc", "address": "1 Stock St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    for name in ("Pie", "Tea"):
+        client.post("/menu/", json={"location_id": location_id, "name": name, "description": name, "price": 2}, headers=headers)
+    menu = {item["name"]: item["id"] for item in client.get(f"/menu/{location_id}", headers=headers).json()["menu"]}
+    pie, tea = menu["Pie"], menu["Tea"]
+
+    db = session_factory()
+    db.add(Device(location_id=location_id, device_name="POS", device_status="unpaired", device_type="POS", pairing_code="PAIRSTK1"))
+    db.commit()
+    db.close()
+    pos = {"Authorization": "Bearer " + client.post("/devices/pair", json={"pairing_code": "PAIRSTK1", "hardware_id": "HW-STK-1"}).json()["device_token"]}
+
+    # only Pie is tracked, Tea can always be ordered
+    r = client.put(f"/stock/{location_id}", json={"items": [{"product_id": pie, "quantity": 3}]}, headers=headers)
+    assert r.json()["items"] == [{"product_id": pie, "name": "Pie", "quantity": 3}]
+    assert client.put(f"/stock/{location_id}", json={"items": [{"product_id": 999999, "quantity": 1}]}, headers=headers).status_code == 400
+
+    order_id = client.post("/orders/", json={"location_id": location_id, "items": [
+        {"product_id": pie, "quantity": 1}, {"product_id": tea, "quantity": 5}, {"product_id": pie, "quantity": 1},
+    ]}, headers=pos).json()["order_id"]
+    assert client.get(f"/stock/{location_id}", headers=headers).json()["items"][0]["quantity"] == 1
+
+    # not enough left: nothing is taken and nothing is written
+    r = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": tea}, {"product_id": pie, "quantity": 2}]}, headers=pos)
+    assert r.status_code == 409 and r.json()["detail"] == f"Out of stock: [{pie}]"
+    r = client.post(f"/orders/{order_id}/items", json={"product_id": pie, "quantity": 2}, headers=pos)
+    assert r.status_code == 409
+    assert client.get(f"/orders/{order_id}", headers=pos).json()["order"]["item_count"] == 7
+
+    item_id = client.post(f"/orders/{order_id}/items", json={"product_id": pie, "quantity": 1}, headers=pos).json()["item_id"]
+    eighty_six = client.get(f"/stock/{location_id}/86", headers=pos)
+    assert eighty_six.json()["products"] == [{"product_id": pie, "name": "Pie"}]
+    assert client.get(f"/stock/{location_id}/86", headers={**pos, "If-None-Match": eighty_six.headers["ETag"]}).status_code == 304
+
+    # taking an item off the order puts its stock back
+    client.delete(f"/orders/{order_id}/items/{item_id}", headers=pos)
+    assert client.get(f"/stock/{location_id}/86", headers={**pos, "If-None-Match": eighty_six.headers["ETag"]}).json()["products"] == []
+    client.put(f"/stock/{location_id}", json={"items": [{"product_id": pie, "quantity": None}]}, headers=headers)
+    assert client.get(f"/stock/{location_id}", headers=headers).json()["items"] == []
+
+
+def test_concurrent_orders_cannot_oversell(client):
+    r = client.post("/user/signup", json={"fullname": "Rush User", "email": "rush@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "RushOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "RushLoc", "address": "1 Rush St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Special", "description": "Limited", "price": 9}, headers=headers)
+    special = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+    client.put(f"/stock/{location_id}", json={"items": [{"product_id": special, "quantity": 5}]}, headers=headers)
+
+    async def rush():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+            return await asyncio.gather(*[
+                ac.post("/orders/", json={"location_id": location_id, "items": [{"product_id": special}]}, headers=headers)
+                for _ in range(8)
+            ])
+
+    statuses = sorted(r.status_code for r in client.portal.call(rush))
+    assert statuses == [200] * 5 + [409] * 3
+    assert client.get(f"/stock/{location_id}", headers=headers).json()["items"][0]["quantity"] == 0
+
+
+def test_concurrent_item_updates_keep_totals_and_stock(client):
+    r = client.post("/user/signup", json={"fullname": "Patch User", "email": "patchrace@example.com", "password": "pass1234"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    org_id = client.post("/organization/create", json={"name": "PatchOrg"}, headers=headers).json()["organization_id"]
+    location_payload = {"name": "PatchLoc", "address": "1 Patch St", "timezone": "UTC"}
+    location_id = client.post(f"/organization/{org_id}/add_location", json=location_payload, headers=headers).json()["location_id"]
+    client.post("/menu/", json={"location_id": location_id, "name": "Pie", "description": "Pie", "price": 4}, headers=headers)
+    pie = client.get(f"/menu/{location_id}", headers=headers).json()["menu"][0]["id"]
+    client.put(f"/stock/{location_id}", json={"items": [{"product_id": pie, "quantity": 20}]}, headers=headers)
+
+    order = client.post("/orders/", json={"location_id": location_id, "items": [{"product_id": pie}]}, headers=headers).json()["order"]
+    item_id = order["items"][0]["id"]
+
+    async def race():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+            return await asyncio.gather(*[
+                ac.patch(f"/orders/{order['id']}/items/{item_id}", json={"quantity": quantity}, headers=headers)
+                for quantity in (3, 5)
+            ])
+
+    assert [r.status_code for r in client.portal.call(race)] == [200, 200]
+    [item] = client.get(f"/orders/{order['id']}/items", headers=headers).json()["items"]
+    totals = client.get(f"/orders/{order['id']}", headers=headers).json()["order"]
+    # whichever PATCH landed last, totals and stock follow the quantity it left
+    assert item["quantity"] in (3, 5)
+    assert (totals["item_count"], totals["subtotal"]) == (item["quantity"], item["quantity"] * 4)
+    assert client.get(f"/stock/{location_id}", headers=headers).json()["items"][0]["quantity"] == 20 - item["quantity"]
@@ -23,4 +23,45 @@ def test_user_signup_and_login(client):
     r3 = client.post("/user/login", json=bad_login)
     assert r3.status_code == 200
     assert r3.json().get("error") == "Wrong login details!"
-    
\ No newline at end of file
+    
+
+def test_login_rehashes_when_cost_changes(client, session_factory, monkeypatch):
+    from app.auth import passwords
+    from app.models import User
+
+    client.post("/user/signup", json={"fullname": "Rehash User", "email": "rehash@example.com", "password": "password123"})
+
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 5)
+    r = client.post("/user/login", json={"email": "rehash@example.com", "password": "password123"})
+    assert "access_token" in r.json()
+
+    db = session_factory()
+    stored = db.query(User).filter(User.email == "rehash@example.com").first().password
+    db.close()
+    assert stored.startswith(b"$2b$05$")
+
+
+def test_login_returns_503_when_hash_pool_is_saturated(client, monkeypatch):
+    from app.auth import passwords
+
+    monkeypatch.setattr(passwords, "PASSWORD_HASH_MAX_PENDING", 0)
+    r = client.post("/user/login", json={"email": "testuser@example.com", "password": "password123"})
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
+def test_refresh_token_rotation_and_reuse(client):
+    r = client.post("/user/signup", json={"fullname": "Refresh User", "email": "refresh@example.com", "password": "password123"})
+    first_refresh = r.json()["refresh_token"]
+
+    r2 = client.post("/user/refresh", json={"refresh_token": first_refresh})
+    assert r2.status_code == 200
+    second_refresh = r2.json()["refresh_token"]
+    assert second_refresh != first_refresh
+    assert client.get("/user/me", headers={"Authorization": f"Bearer {r2.json()['access_token']}"}).status_code == 200
+
+    # replaying a rotated token revokes the whole family, including the newest token
+    r3 = client.post("/user/refresh", json={"refresh_token": first_refresh})
+    assert r3.status_code == 401
+    assert client.post("/user/refresh", json={"refresh_token": second_refresh}).status_code == 401
+    assert client.post("/user/refresh", json={"refresh_token": "bogus"}).status_code == 401